@@ -1,34 +1,352 @@
-from dataclasses import dataclass
 from datetime import datetime
-import os
-from task import Task, TaskStatus
+import json, math, os, time
+from task import RunningTasks, Task, TaskStatus
 import numpy as np
 from zeromq_manager import ZeromqManager
 from ussp import USSP
 from paho.mqtt.client import Client as PahoClient
-from threading import Event
+from threading import Event, Lock, RLock
+from spatial_index import SpatialGrid, EARTH_RADIUS_KM
+from telemetry import TelemetryHistory
+from liveness import TimerWheel
+from aggregate import Aggregate
+from assignment import solve_assignment, INFEASIBLE_COST
+from data.config import OperatorConfig
+
+#Added to the cost of a task per priority level, longer than any distance on Earth so more important tasks always get an agent first
+PRIORITY_PENALTY_KM: float = 2 * math.pi * EARTH_RADIUS_KM
 
-@dataclass
 class Agent():
     '''
-    Saves everything an agent sends on MQTT
-    some common attributes are: \n
-    "heartbeat", "sensor_info", "position", "speed", "course", "heading", "direct_execution_info"
+    Keeps the state of an agent parsed from what it sends on MQTT. \n
+    "position", "heartbeat", "direct_execution_info", "speed", "course" and "heading" are parsed into typed fields,
+    other attributes like "sensor_info" are only kept in 'extra' if the AgentManager allows it
     '''
+    __slots__ = ("meta", "slot", "manager", "latitude", "longitude", "altitude",
+                 "_speed", "_course", "_heading", "cruise_speed",
+                 "levels", "heartbeat_stamp", "heartbeat_rate", "tasks_available", "capabilities", "extra", "history")
+
+    TYPED_ATTRIBUTES: frozenset = frozenset(("position", "heartbeat", "direct_execution_info", "speed", "course", "heading"))
+
     def __init__(self, meta_data) -> None:
         self.meta: dict = meta_data
+        self.slot: int = None #Index in the AgentPositions arrays, set by the AgentManager
+        self.manager: AgentManager = None #Set when the agent is added to an AgentManager
+
+        self.latitude: float = math.nan
+        self.longitude: float = math.nan
+        self.altitude: float = math.nan
+        self._speed: float = math.nan #m/s
+        self._course: float = math.nan #degrees, direction of travel
+        self._heading: float = math.nan #degrees
+        self.cruise_speed: float = OperatorConfig.CRUISE_SPEED #m/s, set from the domain of the agent by the AgentManager
+        self.levels: list = []
+        self.heartbeat_stamp: float = None
+        self.heartbeat_rate: float = None
+        self.tasks_available: list = []
+        self.capabilities: frozenset = frozenset() #names of the tasks in 'tasks_available'
+        self.extra: dict = None #Other attributes, bounded by AgentManager.max_extra_attributes
+        self.history: TelemetryHistory = None #Position and speed samples, created by the AgentManager if HISTORY_SIZE > 0
+
+    def update_attribute(self, name: str, value) -> None:
+        """Saves an attribute the agent sent on MQTT, 'name' is the last part of the topic"""
+        if name in self.TYPED_ATTRIBUTES:
+            setattr(self, name, value)
+            return
+
+        max_extra_attributes = self.manager.max_extra_attributes if self.manager is not None else 0
+        if max_extra_attributes <= 0:
+            return
+        if self.extra is None:
+            self.extra = {}
+        if name not in self.extra and len(self.extra) >= max_extra_attributes:
+            del self.extra[next(iter(self.extra))] #Drop the oldest attribute
+        self.extra[name] = value
+
+    @property
+    def has_position(self) -> bool:
+        return not (math.isnan(self.latitude) or math.isnan(self.longitude))
+
+    @property
+    def position(self) -> dict:
+        return {"altitude": self.altitude, "latitude": self.latitude, "longitude": self.longitude}
+
+    @position.setter
+    def position(self, position: dict):
+        had_position = self.has_position
+        try:
+            self.latitude = float(position["latitude"])
+            self.longitude = float(position["longitude"])
+            self.altitude = float(position.get("altitude", math.nan))
+        except (KeyError, TypeError, ValueError, AttributeError): #Not a valid position
+            self.latitude = self.longitude = self.altitude = math.nan
+        if self.history is not None and self.has_position:
+            self.history.append(time.time(), self.latitude, self.longitude, self.altitude, self._speed)
+        if self.manager is not None:
+            self.manager.positions.update(self.slot, self.latitude, self.longitude)
+            if not had_position and self.has_position:
+                self.manager.position_found(self)
+
+    @property
+    def speed(self) -> float:
+        return self._speed
+
+    @speed.setter
+    def speed(self, speed):
+        self._speed = self.__number(speed, "speed")
+        self.__update_motion()
+
+    @property
+    def course(self) -> float:
+        return self._course
+
+    @course.setter
+    def course(self, course):
+        self._course = self.__number(course, "course")
+        self.__update_motion()
+
+    @property
+    def heading(self) -> float:
+        return self._heading
+
+    @heading.setter
+    def heading(self, heading):
+        self._heading = self.__number(heading, "heading")
+        self.__update_motion()
+
+    @property
+    def direction(self) -> float:
+        """Direction of travel (degrees), the course if known otherwise the heading"""
+        return self._heading if math.isnan(self._course) else self._course
+
+    def __update_motion(self) -> None:
+        if self.manager is not None:
+            self.manager.positions.update_motion(self.slot, self._speed, self.direction, self.cruise_speed)
+
+    @staticmethod
+    def __number(value, key: str) -> float:
+        """Reads a number sent either as a plain value or as {key: value}"""
+        try:
+            return float(value[key] if isinstance(value, dict) else value)
+        except (KeyError, TypeError, ValueError):
+            return math.nan
+
+    @property
+    def heartbeat(self) -> dict:
+        return {"levels": self.levels, "stamp": self.heartbeat_stamp, "rate": self.heartbeat_rate}
+
+    @heartbeat.setter
+    def heartbeat(self, heartbeat: dict):
+        try:
+            stamp = heartbeat.get("stamp")
+            if stamp is not None and self.heartbeat_stamp is not None and stamp < self.heartbeat_stamp:
+                return #Older than the last heartbeat
+            levels = list(heartbeat.get("levels", []))
+            levels_changed = levels != self.levels
+            self.levels = levels
+            self.heartbeat_stamp = stamp
+            self.heartbeat_rate = heartbeat.get("rate")
+        except (AttributeError, TypeError): #Not a valid heartbeat
+            return
+        if self.manager is not None:
+            if levels_changed:
+                self.manager.update_levels(self)
+            self.manager.heartbeat_received(self)
+
+    @property
+    def direct_execution_info(self) -> dict:
+        return {"tasks-available": self.tasks_available}
+
+    @direct_execution_info.setter
+    def direct_execution_info(self, direct_execution_info: dict):
+        try:
+            tasks_available = list(direct_execution_info["tasks-available"])
+            capabilities = frozenset(task["name"] for task in tasks_available)
+        except (KeyError, TypeError): #Not a valid direct_execution_info
+            tasks_available, capabilities = [], frozenset()
+        if tasks_available == self.tasks_available:
+            return
+        self.tasks_available = tasks_available
+        self.capabilities = capabilities
+        if self.manager is not None:
+            self.manager.update_capabilities(self)
+
+
+def task_key(task) -> str:
+    """Tasks in 'tasks-available' are dicts, equal dicts are the same task"""
+    return json.dumps(task, sort_keys=True)
+
+
+MOVING_SPEED: float = 0.5 #m/s, slower agents can turn on the spot
+TURN_RATE: float = 30.0 #degrees/s
+
+class AgentPositions():
+    """
+    Positions of all agents kept in contiguous NumPy arrays (radians), every agent owns one slot.
+    Slots without a known position are NaN. The slots are also kept in a SpatialGrid to find the closest agents
+    """
+    def __init__(self, capacity: int = 64, cell_size_km: float = 10.0) -> None:
+        self.latitudes: np.ndarray = np.full(capacity, np.nan)
+        self.longitudes: np.ndarray = np.full(capacity, np.nan)
+        self.cos_latitudes: np.ndarray = np.full(capacity, np.nan)
+        self.speeds: np.ndarray = np.full(capacity, np.nan) #m/s
+        self.directions: np.ndarray = np.full(capacity, np.nan) #degrees
+        self.cruise_speeds: np.ndarray = np.full(capacity, np.nan) #m/s
+        self.registered: np.ndarray = np.zeros(capacity, dtype=np.int64) #When the slot was handed out, breaks ties in 'nearest_slots'
+        self.registrations: int = 0
+        self.grid: SpatialGrid = SpatialGrid(cell_size_km)
+        self.free_slots: list[int] = []
+        self.size: int = 0 #Number of slots that has been handed out
+        self.lock: Lock = Lock() #Positions are updated from the MQTT thread and read from the task thread
+
+    def allocate(self) -> int:
+        """Returns a free slot, grows the arrays if they are full"""
+        with self.lock:
+            self.registrations += 1
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.registered[slot] = self.registrations
+                return slot
+
+            if self.size == len(self.latitudes):
+                grow = np.full(self.size, np.nan)
+                self.latitudes = np.concatenate((self.latitudes, grow))
+                self.longitudes = np.concatenate((self.longitudes, grow))
+                self.cos_latitudes = np.concatenate((self.cos_latitudes, grow))
+                self.speeds = np.concatenate((self.speeds, grow))
+                self.directions = np.concatenate((self.directions, grow))
+                self.cruise_speeds = np.concatenate((self.cruise_speeds, grow))
+                self.registered = np.concatenate((self.registered, np.zeros(self.size, dtype=np.int64)))
+            self.registered[self.size] = self.registrations
+            self.size += 1
+            return self.size - 1
+
+    def release(self, slot: int) -> None:
+        """Clears the slot and makes it available again"""
+        self.update(slot, math.nan, math.nan)
+        self.update_motion(slot, math.nan, math.nan, math.nan)
+        with self.lock:
+            self.free_slots.append(slot)
+
+    def update(self, slot: int, latitude: float, longitude: float) -> None:
+        """Sets the position (degrees) of the slot, NaN if the position is unknown"""
+        lat = math.radians(latitude)
+        lon = math.radians(longitude)
+        with self.lock:
+            self.latitudes[slot] = lat
+            self.longitudes[slot] = lon
+            self.cos_latitudes[slot] = math.cos(lat)
+            self.grid.update(slot, lat, lon)
+
+    def update_motion(self, slot: int, speed: float, direction: float, cruise_speed: float) -> None:
+        """Sets the current speed (m/s), direction of travel (degrees) and nominal cruise speed (m/s) of the slot"""
+        with self.lock:
+            self.speeds[slot] = speed
+            self.directions[slot] = direction
+            self.cruise_speeds[slot] = cruise_speed
+
+    def haversine_terms(self, slots: np.ndarray, position: dict) -> np.ndarray:
+        """
+        Returns the haversine term 'a' from the position to the agents in the slots.
+        The distance is 2 * R * arcsin(sqrt(a)) which grows with 'a', so it can be used to rank agents
+        """
+        lat1 = np.radians(position["latitude"])
+        lon1 = np.radians(position["longitude"])
+
+        dlon = self.longitudes[slots] - lon1
+        dlat = self.latitudes[slots] - lat1
+
+        return np.sin(dlat / 2.0)**2 + np.cos(lat1) * self.cos_latitudes[slots] * np.sin(dlon / 2.0)**2
+
+    def distances_km(self, slots: np.ndarray, position: dict) -> np.ndarray:
+        """Returns the great circle distance (km) from the position to the agents in the slots"""
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(self.haversine_terms(slots, position)))
+
+    def nearest_slots(self, position: dict, accept, k: int = 1, score = None, lower_bound = None) -> list:
+        """
+        Returns up to 'k' slots closest to the position (closest first) for which accept(slot) is True,
+        of slots at the same distance the one handed out first (the agent registered first) comes first.
+        Only the cells of the grid around the position are visited, ring by ring, until no unvisited cell can be closer. \n
+        To rank by something else than distance, 'score(slots, terms)' returns the score of the slots (lower is better) from their
+        haversine terms, and 'lower_bound(km)' the lowest score a slot at least 'km' away can have
+        """
+        if score is None:
+            score = lambda slots, terms: terms
+            lower_bound = lambda km: math.sin(km / EARTH_RADIUS_KM / 2.0) ** 2
+
+        with self.lock:
+            center = self.grid.cell_of(np.radians(position["latitude"]), np.radians(position["longitude"]))
+            best: list = [] #(score, registered, slot), sorted
+            r = 0
+            while True:
+                last_ring = self.grid.shell_is_larger_than_grid(r)
+                ring = self.grid.outside(center, r) if last_ring else self.grid.shell(center, r)
+                slots = np.fromiter((slot for slot in ring if accept(slot)), dtype=np.intp)
+                if len(slots):
+                    scores = score(slots, self.haversine_terms(slots, position))
+                    best = sorted(best + list(zip(scores.tolist(), self.registered[slots].tolist(), slots.tolist())))[:k]
+
+                #Every unvisited cell is more than 'r * cell_size' (chord) away, the great circle is longer than the chord
+                if last_ring or (len(best) == k and best[-1][0] <= lower_bound(r * self.grid.cell_size * EARTH_RADIUS_KM)):
+                    return [slot for _, _, slot in best]
+                r += 1
+
+    def eta_seconds(self, slots: np.ndarray, terms: np.ndarray, position: dict) -> np.ndarray:
+        """
+        Estimated time (s) for the agents in the slots to reach the position: the distance at the highest of the current and
+        the cruise speed, plus the time to turn towards the position if the agent is moving
+        """
+        distances = 2 * EARTH_RADIUS_KM * 1000.0 * np.arcsin(np.sqrt(terms))
+        speeds = np.fmax(self.speeds[slots], self.cruise_speeds[slots])
+        speeds = np.where(speeds > 0, speeds, OperatorConfig.CRUISE_SPEED)
+
+        lat2 = np.radians(position["latitude"])
+        dlon = np.radians(position["longitude"]) - self.longitudes[slots]
+        lat1 = self.latitudes[slots]
+        bearings = np.degrees(np.arctan2(np.sin(dlon) * np.cos(lat2),
+                                         self.cos_latitudes[slots] * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon)))
+        turns = np.abs((bearings - self.directions[slots] + 180.0) % 360.0 - 180.0)
+        moving = self.speeds[slots] > MOVING_SPEED
+        turns = np.where(moving & ~np.isnan(turns), turns, 0.0)
+
+        return distances / speeds + turns / TURN_RATE
+
+    def fastest_speed(self) -> float:
+        """The highest speed (m/s) any agent can have in 'eta_seconds'"""
+        speeds = np.fmax(self.speeds[:self.size], self.cruise_speeds[:self.size])
+        return float(np.nanmax(speeds, initial=OperatorConfig.CRUISE_SPEED))
 
 
 class AgentManager():
-    def __init__(self, zmq_manager) -> None:
+    def __init__(self, zmq_manager = None, max_extra_attributes: int = OperatorConfig.MAX_EXTRA_ATTRIBUTES,
+                 history_size: int = OperatorConfig.HISTORY_SIZE, missed_heartbeats: float = OperatorConfig.MISSED_HEARTBEATS) -> None:
         try:
             self.zmq_manager: ZeromqManager = zmq_manager
-            self.agents: list[Agent] = []
-            self.running_tasks: list[Task] = []
+            self.max_extra_attributes: int = max_extra_attributes #Attributes kept per agent besides the typed ones, 0 keeps none
+            self.history_size: int = history_size #Telemetry samples kept per agent, 0 keeps none
+            self.cruise_speeds: dict = OperatorConfig.CRUISE_SPEEDS #domain -> m/s
+            self.selection_strategies: dict = OperatorConfig.SELECTION_STRATEGIES #task name -> "closest" or "eta"
+            self.agents: dict[str, Agent] = {} #name -> Agent
+            self.agents_by_uuid: dict[str, Agent] = {} #agent-uuid -> Agent
+            self.positions: AgentPositions = AgentPositions()
+            self.slot_agents: dict[int, Agent] = {} #slot in 'positions' -> Agent
+            self.capabilities: dict[str, set[str]] = {} #task name -> names of the agents that support it
+            self.agent_capabilities: dict[str, frozenset] = {} #agent name -> task names it is indexed under
+            self.idle_agents: set[str] = set() #names of the non-busy agents
+            self.stale_agents: set[str] = set() #names of the agents that have missed their heartbeats
+            self.liveness: TimerWheel = TimerWheel() #agent name -> when it goes stale
+            self.missed_heartbeats: float = missed_heartbeats #Heartbeat periods without a heartbeat before an agent is stale
+            self.running_tasks: RunningTasks = RunningTasks()
+            self.index_lock: RLock = RLock() #The registry and indexes are updated from the ingest workers and the task thread
+            #'levels' and 'tasks-available' of the agents that are alive and of the child drone operators
+            self.levels: Aggregate = Aggregate()
+            self.tasks_available: Aggregate = Aggregate(task_key)
+            #Called without arguments when an agent becomes idle or supports new tasks, wakes the task dispatcher
+            self.idle_listeners: list = []
             self.agents_list: list[str] = []
 
             try:
-                str_of_agents = os.getenv("AGENTS")
+                str_of_agents = os.getenv("AGENTS", "")
             except Exception:
                 str_of_agents = ""
             self.agents_list = str_of_agents.split(",")
@@ -39,80 +357,89 @@ class AgentManager():
 
     @property
     def all_agents(self) -> list:
-        return self.agents
+        return list(self.agents.values())
 
-    def check_feedback(self, client: PahoClient, topic: str, event: Event, feedback: dict, agent_name) -> None:
-        try:
-            task: Task = next(( t for t in self.running_tasks if t.task_uuid == feedback["task-uuid"])) #StopIteration
+    def get_agent_by_name(self, name: str) -> Agent:
+        """Returns the agent with the name, None if it does not exist"""
+        return self.agents.get(name)
 
-            if feedback["status"] == "finished" or feedback["status"] == "failed" or feedback["status"] == "aborted" or feedback["status"] == "enough":
-                task.agent.meta["busy"] = False
-                task.status = TaskStatus.FINISHED
-                task.task_completed = datetime.utcnow()
-                #task.save_task_to_log()
-                self.running_tasks.remove(task)
+    def get_agent_by_uuid(self, agent_uuid: str) -> Agent:
+        """Returns the agent with the agent-uuid, None if it does not exist"""
+        return self.agents_by_uuid.get(agent_uuid)
 
-            if feedback["status"] == "finished":
-                print(f"{task.agent.meta['name']} Completed the task")
-                if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
-            
-            elif feedback["status"] == "failed":
-                print(f"{task.agent.meta['name']} Failed the task")
-                if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
-            
-            elif feedback["status"] == "aborted":
-                print(f"{task.agent.meta['name']} Aborted the task")
-                if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
-
-            elif feedback["status"] == "enough":
-                print(f"{task.agent.meta['name']} 'enoughed' the task")
-                if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
-        
-        except StopIteration: #Not a task sent from this droneoperator
-            agent = next(( a for a in self.all_agents if a.meta["name"] == agent_name ))
+    def check_feedback(self, client: PahoClient, topic: str, event: Event, feedback: dict, agent_name) -> None:
+        task: Task = self.running_tasks.get(feedback["task-uuid"])
+        if task is None: #Not a task sent from this droneoperator
+            agent = self.get_agent_by_name(agent_name)
+            if agent is None:
+                return
             if feedback["status"] == "finished" or feedback["status"] == "failed" or feedback["status"] == "aborted" or feedback["status"] == "enough":
-                agent.meta["busy"] = False
+                self.set_busy(agent, False)
             elif feedback["status"] == "running":
-                agent.meta["busy"] = True
+                self.set_busy(agent, True)
+            return
 
-    def check_response(self, client: PahoClient, topic: str, event: Event, response: dict, agent_name):
-        try:
-            task: Task = next(( t for t in self.running_tasks if t.task_uuid == response["task-uuid"] )) #StopIteration
+        if feedback["status"] == "finished" or feedback["status"] == "failed" or feedback["status"] == "aborted" or feedback["status"] == "enough":
+            self.set_busy(task.agent, False)
+            task.status = TaskStatus.FINISHED
+            task.task_completed = datetime.utcnow()
+            self.running_tasks.remove(task)
 
-            if response["response"] == "running":
-                print(f"{task.agent.meta['name']} Accepted the task")
-                task.status = TaskStatus.RUNNING
+        if feedback["status"] == "finished":
+            print(f"{task.agent.meta['name']} Completed the task")
+            if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
 
-            elif response["response"] == "finished":
-                task.agent.meta["busy"] = False
-                task.status = TaskStatus.FINISHED
-                task.task_completed = datetime.utcnow()
-                #task.save_task_to_log()
-                self.running_tasks.remove(task)
-                print(f"{task.agent.meta['name']} Completed the task")
-                if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
-
-            elif response["response"] == "ok":
-                print(f"{task.agent.meta['name']} Preformed the Signal")
-                if task.status is TaskStatus.FINISHED:
-                    task.agent.meta["busy"] = False
-                    USSP.end_plan(client, topic, event, task.plan_id)
-                    self.running_tasks.remove(task)
-            else:
-                print(f"The agent did not accept the task: {response['fail-reason']}")
-                USSP.end_plan(client, topic, event, task.plan_id)
-                self.running_tasks.remove(task)
-        
-        except StopIteration: #Task not sent from this droneoperator
-            agent = next(( a for a in self.all_agents if a.meta["name"] == agent_name ))
+        elif feedback["status"] == "failed":
+            print(f"{task.agent.meta['name']} Failed the task")
+            if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
+
+        elif feedback["status"] == "aborted":
+            print(f"{task.agent.meta['name']} Aborted the task")
+            if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
+
+        elif feedback["status"] == "enough":
+            print(f"{task.agent.meta['name']} 'enoughed' the task")
+            if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
+
+    def check_response(self, client: PahoClient, topic: str, event: Event, response: dict, agent_name):
+        task: Task = self.running_tasks.get(response["task-uuid"])
+        if task is None: #Task not sent from this droneoperator
+            agent = self.get_agent_by_name(agent_name)
+            if agent is None:
+                return
             if response["response"] == "finished" or response["response"] == "failed":
-                agent.meta["busy"] = False
+                self.set_busy(agent, False)
             elif response["response"] == "running":
-                agent.meta["busy"] = True
+                self.set_busy(agent, True)
+            return
+
+        if response["response"] == "running":
+            print(f"{task.agent.meta['name']} Accepted the task")
+            task.status = TaskStatus.RUNNING
+
+        elif response["response"] == "finished":
+            self.set_busy(task.agent, False)
+            task.status = TaskStatus.FINISHED
+            task.task_completed = datetime.utcnow()
+            self.running_tasks.remove(task)
+            print(f"{task.agent.meta['name']} Completed the task")
+            if task.agent.meta['name'] != "Drone From Team Member": USSP.end_plan(client, topic, event, task.plan_id)
+
+        elif response["response"] == "ok":
+            print(f"{task.agent.meta['name']} Preformed the Signal")
+            if task.status is TaskStatus.FINISHED:
+                self.set_busy(task.agent, False)
+                USSP.end_plan(client, topic, event, task.plan_id)
+                self.running_tasks.remove(task)
+        else:
+            print(f"The agent did not accept the task: {response['fail-reason']}")
+            self.set_busy(task.agent, False)
+            USSP.end_plan(client, topic, event, task.plan_id)
+            self.running_tasks.remove(task)
 
     def filter_agents(self, cmd) -> list:
         """Returns a list of agents that support the task"""
-        agents = [agent for agent in self.all_agents for task in agent.direct_execution_info["tasks-available"] if cmd == task["name"]]
+        agents = [self.agents[name] for name in list(self.capabilities.get(cmd, ()))]
         if not agents:
             print("No agents available")
         return agents
@@ -127,22 +454,28 @@ class AgentManager():
         finally:
             return agent
             
+    @staticmethod
+    def first_position(cmd, params) -> dict:
+        """Returns the first waypoint of the task"""
+        if cmd == "move-to":
+            return params['waypoint']
+        elif cmd == "move-path":
+            return params['waypoints'][0]  # First waypoint on path
+        elif cmd == "search-area":
+            return params['area'][0]
+        else:
+            raise AttributeError('No waypoint or waypoints attribute in params')
+
     def select_closest_agent_that_is_non_busy(self, cmd, params) -> Agent:
         try:
-            agents = self.filter_agents(cmd)  #Filter agents, only agents that can perform task
             agent = None
-            non_busy_agents = self.__find_all_non_busy_agents(agents)
-            if cmd == "move-to":
-                first_position = params['waypoint']
-            elif cmd == "move-path":
-                first_position = params['waypoints'][0]  # First waypoint on path
-            elif cmd == "search-area":
-                first_position = params['area'][0]
-            else:
-                raise AttributeError('No waypoint or waypoints attribute in params')
-
-            agent = self.__select_closest_agent(non_busy_agents, first_position)
-            agent.meta["busy"] = True
+            first_position = self.first_position(cmd, params)
+
+            agents = self.find_closest_non_busy_agents(cmd, first_position)
+            if not agents:
+                print("No agent available")
+            agent = agents[0]
+            self.set_busy(agent, True)
 
         # except AttributeError:
         #     pass
@@ -152,37 +485,88 @@ class AgentManager():
         finally:
             return agent
 
-    @staticmethod
-    def __find_all_non_busy_agents(agents: list) -> list:
+    def select_agent_that_is_non_busy(self, cmd, params) -> Agent:
+        """Selects a non-busy agent for the task with the strategy configured for the task in SELECTION_STRATEGIES"""
+        self.expire_stale_agents()
+        if self.selection_strategies.get(cmd) == "eta":
+            return self.select_fastest_agent_that_is_non_busy(cmd, params)
+        return self.select_closest_agent_that_is_non_busy(cmd, params)
 
-        non_busy_agents = [agent for agent in agents if agent.meta["busy"] is False]
+    def select_fastest_agent_that_is_non_busy(self, cmd, params) -> Agent:
+        """Selects the non-busy agent with the shortest estimated time to the first waypoint"""
+        try:
+            agent = None
+            first_position = self.first_position(cmd, params)
 
-        if not non_busy_agents:
-            print("No agent available")
+            agents = self.find_fastest_non_busy_agents(cmd, first_position)
+            if not agents:
+                print("No agent available")
+            agent = agents[0]
+            self.set_busy(agent, True)
 
-        return non_busy_agents
+        finally:
+            return agent
 
-    def __select_closest_agent(self, agents: list, position) -> Agent:
-        '''
-        Return the closest agent, returns None type if no agent available
-        '''
-        try:
-            lat = position["latitude"]
-            lon = position["longitude"]
-            operator_waypoint = [lat, lon]
-
-            non_sorted_dict = {}
-            for index, agent in enumerate(agents):
-                agent_lat = agent.position['latitude']
-                agent_lon = agent.position['longitude']
-                agent_waypoint = [agent_lat, agent_lon]
-                non_sorted_dict[index] = self.calculate_haversine_distance(operator_waypoint, agent_waypoint)
-
-            sorted_dict = dict(sorted(non_sorted_dict.items(), key=lambda item: item[1]))  # sort on value (distance)
-            agent_number_to_return = list(sorted_dict.keys())[0]
-            return agents[agent_number_to_return]
-        except IndexError:
-            return None
+    def find_fastest_non_busy_agents(self, cmd, position: dict, k: int = 1) -> list:
+        """Returns up to 'k' non-busy agents that support the task, shortest estimated time to the position first"""
+        fastest_speed = self.positions.fastest_speed()
+        return self.find_closest_non_busy_agents(cmd, position, k,
+                                                 score=lambda slots, terms: self.positions.eta_seconds(slots, terms, position),
+                                                 lower_bound=lambda km: km * 1000.0 / fastest_speed)
+
+    def find_closest_non_busy_agents(self, cmd, position: dict, k: int = 1, score = None, lower_bound = None) -> list:
+        """Returns up to 'k' non-busy agents that support the task, closest to the position first"""
+        capable_agents = self.capabilities.get(cmd)
+        if not capable_agents or not self.idle_agents:
+            return []
+
+        def accept(slot: int) -> bool:
+            agent = self.slot_agents.get(slot)
+            if agent is None:
+                return False
+            name = agent.meta["name"]
+            return name in capable_agents and name in self.idle_agents
+
+        return [self.slot_agents[slot] for slot in self.positions.nearest_slots(position, accept, k, score, lower_bound)]
+
+    def assign_agents_to_tasks(self, tasks: list) -> list:
+        """
+        Assigns non-busy agents to several tasks at once so that the total distance to the first waypoints is as small as possible.
+        'tasks' is a list of (cmd, params, priority). Every priority level adds PRIORITY_PENALTY_KM to the cost of a task,
+        so when there are too few agents the more important tasks (lower priority) get them. Returns the selected Agent or
+        None for every task, selected agents are set busy
+        """
+        self.expire_stale_agents()
+        positions: list = []
+        candidates: dict[int, Agent] = {} #slot -> Agent
+        for cmd, params, _ in tasks:
+            try:
+                position = self.first_position(cmd, params)
+            except (AttributeError, KeyError, IndexError, TypeError):
+                position = None
+            positions.append(position)
+            if position is not None:
+                #A task is never better off with an agent further away than its len(tasks) closest ones
+                for agent in self.find_closest_non_busy_agents(cmd, position, k=len(tasks)):
+                    candidates[agent.slot] = agent
+
+        slots = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+        candidate_agents = list(candidates.values())
+        cost = np.full((len(tasks), len(candidate_agents)), INFEASIBLE_COST)
+        top_priority = min((priority for _, _, priority in tasks), default=0)
+        for row, ((cmd, _, priority), position) in enumerate(zip(tasks, positions)):
+            if position is None or not candidate_agents:
+                continue
+            capable_agents = self.capabilities.get(cmd, ())
+            capable = np.fromiter((agent.meta["name"] in capable_agents for agent in candidate_agents), dtype=bool, count=len(candidate_agents))
+            penalty = (priority - top_priority) * PRIORITY_PENALTY_KM
+            cost[row, capable] = self.positions.distances_km(slots[capable], position) + penalty
+
+        selected: list = [None] * len(tasks)
+        for row, col in solve_assignment(cost):
+            selected[row] = candidate_agents[col]
+            self.set_busy(candidate_agents[col], True)
+        return selected
 
     @staticmethod
     def calculate_distance(operator_waypoint, agent_waypoint):
@@ -215,14 +599,172 @@ class AgentManager():
         return km
 
     def create_new_agent(self, meta_data) -> Agent:
-        """Creates a new agent and append it to a list of agents! Returns the new agent"""
+        """Creates a new agent and adds it to the registry of agents! Returns the new agent"""
         new_agent = Agent(meta_data)
-        self.agents.append(new_agent)
-        return new_agent
+        return self.add_agent(new_agent)
+
+    def add_agent(self, agent: Agent) -> Agent:
+        """Adds an agent object to the registry of agents, an agent with the same name is replaced"""
+        with self.index_lock:
+            self.remove_agent(agent.meta["name"])
+            self.agents[agent.meta["name"]] = agent
+            agent.slot = self.positions.allocate()
+            agent.manager = self
+            self.slot_agents[agent.slot] = agent
+            self.positions.update(agent.slot, agent.latitude, agent.longitude)
+            agent.cruise_speed = self.cruise_speed_of(agent)
+            if agent.history is None and self.history_size > 0:
+                agent.history = TelemetryHistory(self.history_size)
+            self.positions.update_motion(agent.slot, agent.speed, agent.direction, agent.cruise_speed)
+            self.update_capabilities(agent)
+            self.update_levels(agent)
+            #Tasks already sent to an agent with the name, like tasks recovered from the task journal before the agent was seen
+            tasks = self.running_tasks.tasks_for_agent(agent.meta["name"])
+            for task in tasks:
+                task.agent = agent
+            self.set_busy(agent, agent.meta.get("busy", False) or bool(tasks))
+            agent_uuid = agent.meta.get("agent-uuid")
+            if agent_uuid is not None:
+                self.agents_by_uuid[agent_uuid] = agent
+            return agent
+
+    def remove_agent(self, name: str) -> Agent:
+        """Removes the agent with the name from the registry, returns the removed agent or None"""
+        with self.index_lock:
+            agent = self.agents.pop(name, None)
+            if agent is not None:
+                agent_uuid = agent.meta.get("agent-uuid")
+                if self.agents_by_uuid.get(agent_uuid) is agent:
+                    del self.agents_by_uuid[agent_uuid]
+                del self.slot_agents[agent.slot]
+                self.positions.release(agent.slot)
+                self.__set_capabilities(name, frozenset())
+                self.levels.discard(name)
+                self.tasks_available.discard(name)
+                self.idle_agents.discard(name)
+                self.stale_agents.discard(name)
+                self.liveness.cancel(name)
+                agent.slot = None
+                agent.manager = None
+            return agent
+
+    def cruise_speed_of(self, agent: Agent) -> float:
+        """Nominal cruise speed (m/s) of the agent from the domain in its base topic (waraps/unit/<domain>/...)"""
+        try:
+            domain = agent.meta["base_topic"].split("/")[2]
+        except (KeyError, IndexError, AttributeError):
+            return OperatorConfig.CRUISE_SPEED
+        return self.cruise_speeds.get(domain, OperatorConfig.CRUISE_SPEED)
+
+    def set_busy(self, agent: Agent, busy: bool) -> None:
+        """Marks the agent as busy or non-busy, keeps 'idle_agents' up to date"""
+        with self.index_lock:
+            agent.meta["busy"] = busy
+            name = agent.meta["name"]
+            if self.agents.get(name) is not agent: #Not in the registry, like a team member's dummy agent
+                return
+            if busy or name in self.stale_agents:
+                self.idle_agents.discard(name)
+            elif name not in self.idle_agents:
+                self.idle_agents.add(name)
+                self.__notify_idle()
+
+    def update_capabilities(self, agent: Agent) -> None:
+        """Updates the capability index from the agent's direct_execution_info"""
+        with self.index_lock:
+            name = agent.meta["name"]
+            if self.agents.get(name) is not agent or name in self.stale_agents:
+                return
+            self.__set_capabilities(name, agent.capabilities)
+            self.tasks_available.set(name, agent.tasks_available)
+
+    def update_levels(self, agent: Agent) -> None:
+        """Updates the aggregated levels from the agent's heartbeat"""
+        with self.index_lock:
+            name = agent.meta["name"]
+            if self.agents.get(name) is not agent or name in self.stale_agents:
+                return
+            self.levels.set(name, agent.levels)
+
+    def heartbeat_received(self, agent: Agent, now: float = None) -> None:
+        """Reschedules when the agent goes stale, a stale agent is back in the selection indexes"""
+        name = agent.meta["name"]
+        if self.agents.get(name) is not agent:
+            return
+        now = time.monotonic() if now is None else now
+        try:
+            rate = float(agent.heartbeat_rate)
+        except (TypeError, ValueError):
+            rate = OperatorConfig.RATE
+        self.liveness.schedule(name, now + max(rate, 0.0) * self.missed_heartbeats)
+
+        with self.index_lock:
+            if name in self.stale_agents:
+                self.stale_agents.discard(name)
+                print(f"{name} is alive again")
+                self.update_capabilities(agent)
+                self.update_levels(agent)
+                self.set_busy(agent, agent.meta.get("busy", False))
+
+    def expire_stale_agents(self, now: float = None) -> list:
+        """Takes the agents that have missed their heartbeats out of the selection indexes, returns their names"""
+        now = time.monotonic() if now is None else now
+        expired: list = []
+        for name in self.liveness.expire(now):
+            with self.index_lock:
+                if name not in self.agents:
+                    continue
+                print(f"{name} missed its heartbeats, no longer selected")
+                self.stale_agents.add(name)
+                self.idle_agents.discard(name)
+                self.__set_capabilities(name, frozenset())
+                self.levels.discard(name)
+                self.tasks_available.discard(name)
+            expired.append(name)
+        return expired
+
+    @property
+    def live_agents(self) -> list:
+        """Agents that are not stale"""
+        return [agent for name, agent in list(self.agents.items()) if name not in self.stale_agents]
+
+    def __set_capabilities(self, name: str, task_names: frozenset) -> None:
+        old_task_names = self.agent_capabilities.get(name, frozenset())
+        if task_names == old_task_names:
+            return
+
+        for task_name in old_task_names - task_names:
+            agents = self.capabilities[task_name]
+            agents.discard(name)
+            if not agents:
+                del self.capabilities[task_name]
+        new_task_names = task_names - old_task_names
+        for task_name in new_task_names:
+            self.capabilities.setdefault(task_name, set()).add(name)
+        if new_task_names and name in self.idle_agents:
+            self.__notify_idle()
+
+        if task_names:
+            self.agent_capabilities[name] = task_names
+        else:
+            self.agent_capabilities.pop(name, None)
+
+    def position_found(self, agent: Agent) -> None:
+        """Called by an agent that gets its first valid position, it can be selected from now on if it is idle"""
+        with self.index_lock:
+            idle = self.agents.get(agent.meta["name"]) is agent and agent.meta["name"] in self.idle_agents
+        if idle:
+            self.__notify_idle()
+
+    def __notify_idle(self) -> None:
+        for listener in self.idle_listeners:
+            listener()
+
+    def idle_agents_supporting(self, cmd) -> set:
+        """Returns the names of the non-busy agents that support the task"""
+        with self.index_lock:
+            return self.capabilities.get(cmd, set()) & self.idle_agents
 
-    def update_agents(self, name):
-        new_agents_list = [x for x in self.all_agents if name == x.meta["name"]]
-        self.agents = new_agents_list
 
 
 
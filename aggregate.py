@@ -0,0 +1,81 @@
+from threading import Lock
+
+
+class Aggregate():
+    '''
+    Union of the entries of many contributors (agents, drone operators), kept up to date incrementally. \n
+    Every entry has a reference count of the contributors that have it, an entry is in the union until the last
+    contributor drops it. 'key' makes the entries hashable (like task dicts), equal keys are one entry.
+    'version' changes every time the union changes, and the 'listeners' are called
+    '''
+    def __init__(self, key = None) -> None:
+        self.key = key if key is not None else (lambda entry: entry)
+        self.counts: dict = {} #entry key -> number of contributors with the entry
+        self.entries: dict = {} #entry key -> entry, in the order they were first added
+        self.contributions: dict = {} #contributor -> entry keys
+        self.version: int = 0
+        self.cached_items: list = []
+        self.cached_version: int = 0
+        self.lock: Lock = Lock()
+        self.listeners: list = [] #Called without arguments when the union has changed
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, entry) -> bool:
+        return self.key(entry) in self.counts
+
+    def set(self, contributor, entries) -> bool:
+        """Replaces the entries of the contributor, returns True if the union changed"""
+        entries_by_key = {self.key(entry): entry for entry in entries}
+        with self.lock:
+            old_keys = self.contributions.get(contributor, frozenset())
+            new_keys = frozenset(entries_by_key)
+            if new_keys == old_keys:
+                return False
+
+            changed = False
+            for key in entries_by_key: #In the order of the contributor's entries
+                if key in old_keys:
+                    continue
+                count = self.counts.get(key, 0)
+                if count == 0:
+                    self.entries[key] = entries_by_key[key]
+                    changed = True
+                self.counts[key] = count + 1
+            changed |= self.__release(old_keys - new_keys)
+
+            if new_keys:
+                self.contributions[contributor] = new_keys
+            else:
+                self.contributions.pop(contributor, None)
+            if changed:
+                self.version += 1
+        if changed:
+            for listener in self.listeners:
+                listener()
+        return changed
+
+    def discard(self, contributor) -> bool:
+        """Retracts all entries of the contributor, returns True if the union changed"""
+        return self.set(contributor, ())
+
+    def __release(self, keys) -> bool:
+        changed = False
+        for key in keys:
+            count = self.counts[key] - 1
+            if count == 0:
+                del self.counts[key]
+                del self.entries[key]
+                changed = True
+            else:
+                self.counts[key] = count
+        return changed
+
+    def items(self) -> list:
+        """The union as a list, the same list is returned until the union changes"""
+        with self.lock:
+            if self.cached_version != self.version:
+                self.cached_items = list(self.entries.values())
+                self.cached_version = self.version
+            return self.cached_items
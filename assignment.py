@@ -0,0 +1,57 @@
+import numpy as np
+
+INFEASIBLE_COST: float = 1e12 #Cost used for pairs that can not be assigned
+
+def solve_assignment(cost: np.ndarray) -> list:
+    '''
+    Min-cost assignment of rows (tasks) to columns (agents) with the Hungarian algorithm, O(n^2 * m). \n
+    Returns a list of (row, col). Every row is assigned if there are at least as many columns as rows,
+    otherwise every column is. Pairs with a cost of INFEASIBLE_COST or more are left out
+    '''
+    cost = np.asarray(cost, dtype=np.float64)
+    n, m = cost.shape
+    if n == 0 or m == 0:
+        return []
+    if n > m:
+        return sorted((row, col) for col, row in solve_assignment(cost.T))
+
+    cost = np.minimum(cost, INFEASIBLE_COST)
+    #Potentials and matching, index 0 is a dummy column
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.intp) #p[j] = row (1-based) matched to column j
+    way = np.zeros(m + 1, dtype=np.intp)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            free[0] = False
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, minv, np.inf)
+            j1 = int(np.argmin(candidates))
+            delta = candidates[j1]
+
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+
+        while j0: #Flip the augmenting path
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    return sorted((int(p[j]) - 1, j - 1) for j in range(1, m + 1)
+                  if p[j] and cost[p[j] - 1, j - 1] < INFEASIBLE_COST)
@@ -0,0 +1,191 @@
+import asyncio, traceback
+from paho.mqtt.client import Client as PahoClient, MQTT_ERR_SUCCESS
+from data.config import OperatorConfig
+from ingest import BLOCK, DROP_OLDEST
+from agent_manager import Agent
+from mqtt_manager import MqttManager
+from task import Task
+from ussp import AsyncUSSP
+
+
+class AsyncMqttLoop():
+    '''
+    Drives the paho client from an asyncio event loop instead of paho's own loop thread. \n
+    The socket is watched with 'add_reader'/'add_writer' and 'loop_misc' (keepalive) runs every second.
+    The connection is opened again 'reconnect_delay' seconds after it is lost
+    '''
+    def __init__(self, client: PahoClient, loop: asyncio.AbstractEventLoop, reconnect_delay: float = 5.0) -> None:
+        self.client: PahoClient = client
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.reconnect_delay: float = reconnect_delay
+        self.disconnected: asyncio.Event = asyncio.Event()
+        self.misc_task: asyncio.Task = None
+
+        client.on_socket_open = self.on_socket_open
+        client.on_socket_close = self.on_socket_close
+        client.on_socket_register_write = self.on_socket_register_write
+        client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    def on_socket_open(self, client, userdata, sock) -> None:
+        self.loop.add_reader(sock, self.__read)
+        self.misc_task = self.loop.create_task(self.__misc())
+
+    def on_socket_close(self, client, userdata, sock) -> None:
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+            self.misc_task = None
+        self.disconnected.set()
+
+    def on_socket_register_write(self, client, userdata, sock) -> None:
+        #Publishing from an ingest worker registers the socket from that thread
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock) -> None:
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+
+    def __read(self) -> None:
+        self.client.loop_read()
+        #A TLS socket can hold decrypted data that does not make the socket readable again
+        sock = self.client.socket()
+        while sock is not None and getattr(sock, "pending", None) is not None and sock.pending():
+            self.client.loop_read()
+            sock = self.client.socket()
+
+    async def __misc(self) -> None:
+        while self.client.loop_misc() == MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1.0)
+
+    async def run(self, broker: str, port: int, keepalive: int = 60) -> None:
+        """Connects to the broker and keeps the connection"""
+        while True:
+            self.disconnected.clear()
+            try:
+                self.client.connect(broker, port, keepalive)
+            except OSError as e:
+                print(f"Could not connect to MQTT Broker {broker}:{port}: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            await self.disconnected.wait()
+            print(f"Lost the connection to MQTT Broker {broker}:{port}, reconnecting")
+            await asyncio.sleep(self.reconnect_delay)
+
+
+class AsyncRuntime():
+    '''
+    Runs the drone operator on one asyncio event loop instead of the paho loop thread, the 'handle_task' thread and the main loop. \n
+    The MQTT client, the periodic publishers and the dispatching of tasks are coroutines. Every task is planned with the USSP
+    in its own asyncio task, so many tasks and USSP handshakes can be in flight at once.
+    Incoming messages are still decoded on the ingest workers, they are submitted from the event loop so the "block"
+    ingest policy is replaced by "drop_oldest", a full worker queue would otherwise stop the event loop
+    '''
+    def __init__(self, mqtt: MqttManager) -> None:
+        self.mqtt: MqttManager = mqtt
+        if mqtt.ingest.policy == BLOCK:
+            mqtt.ingest.policy = DROP_OLDEST
+        self.loop: asyncio.AbstractEventLoop = None
+        self.ussp: AsyncUSSP = None
+        self.status_changed: asyncio.Event = None
+        self.dispatch_needed: asyncio.Event = None #Set when a task is queued or an agent becomes idle or supports new tasks
+        self.running: set = set() #Dispatches in flight, asyncio only keeps weak references to them
+
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.ussp = AsyncUSSP(self.mqtt.outbound, self.loop)
+        self.mqtt.ussp_listener = self.ussp.reply_received
+        self.status_changed = asyncio.Event()
+        self.dispatch_needed = asyncio.Event()
+        self.mqtt.agent_manager.idle_listeners.append(self.__dispatch_needed)
+        self.mqtt.task_queue.listeners.append(self.__dispatch_needed)
+        if OperatorConfig.PUBLISH_ON_CHANGE:
+            self.mqtt.agent_manager.levels.listeners.append(self.__status_changed)
+            self.mqtt.agent_manager.tasks_available.listeners.append(self.__status_changed)
+
+        self.mqtt.ingest.start()
+        self.mqtt.outbound.start()
+        self.mqtt.recover_tasks()
+        await asyncio.gather(
+            AsyncMqttLoop(self.mqtt.client, self.loop).run(self.mqtt.broker, self.mqtt.port),
+            self.publish_status(),
+            self.every(1.0, self.mqtt.agent_manager.expire_stale_agents),
+            self.every(1.0, self.mqtt.expire_tasks),
+            self.dispatch_tasks()
+        )
+
+    def __status_changed(self) -> None:
+        self.loop.call_soon_threadsafe(self.status_changed.set)
+
+    def __dispatch_needed(self) -> None:
+        self.loop.call_soon_threadsafe(self.dispatch_needed.set)
+
+    async def every(self, interval: float, function) -> None:
+        """Calls 'function' every 'interval' seconds"""
+        next_run = self.loop.time()
+        while True:
+            function()
+            next_run += interval
+            await asyncio.sleep(max(next_run - self.loop.time(), 0.0))
+
+    async def publish_status(self) -> None:
+        """Publishes every 'rate' seconds and right away when the levels or tasks-available change (PUBLISH_ON_CHANGE)"""
+        next_publish = self.loop.time()
+        while True:
+            periodic = self.loop.time() >= next_publish
+            self.mqtt.publish_status(periodic)
+            if periodic:
+                next_publish = self.loop.time() + self.mqtt.rate
+            try:
+                await asyncio.wait_for(self.status_changed.wait(), max(next_publish - self.loop.time(), 0.0))
+            except asyncio.TimeoutError:
+                pass
+            self.status_changed.clear()
+
+    async def dispatch_tasks(self) -> None:
+        """Selects an agent for every queued task that an idle agent supports and dispatches it without waiting for the USSP"""
+        if self.mqtt.batch_assignment:
+            print("BATCH_ASSIGNMENT is only used by the threaded runtime, tasks are assigned one at a time")
+        while True:
+            self.dispatch_needed.clear() #Cleared before taking tasks, so a task or agent that comes meanwhile is not missed
+            self.mqtt.expire_tasks()
+            skipped: set = set()
+            while self.mqtt.agent_manager.idle_agents:
+                task_item, selected_agent = self.mqtt.take_dispatchable_task(skipped)
+                if task_item is None:
+                    break
+                self.__start(self.dispatch_task(task_item.item, selected_agent))
+            await self.dispatch_needed.wait()
+
+    def __start(self, coroutine) -> None:
+        running = self.loop.create_task(coroutine)
+        self.running.add(running)
+        running.add_done_callback(self.running.discard)
+
+    async def dispatch_task(self, task: Task, selected_agent: Agent) -> bool:
+        """Plans the task with the USSP and sends it to the selected agent. Returns False if the USSP failed"""
+        task.agent = selected_agent
+        task.task_uuid = task.original_task["task-uuid"]
+        self.mqtt.journal_task("assigned", task.original_task, agent=selected_agent.meta["name"])
+        topic = f"{self.mqtt.unique_ussp_topic}/command"
+        try:
+            waypoints: list = self.mqtt.task_waypoints(task, selected_agent)
+            task.ground_height = await self.ussp.request_height(topic)
+            task.set_plan_from_request(await self.ussp.request_plan(topic, waypoints, self.mqtt.ussp_payload_data()))
+            task.ussp_plan = await self.ussp.get_plan(topic, task.plan_id)
+            await self.ussp.accept_plan(topic, task.plan_id)
+            await self.ussp.activate_plan(topic, task.plan_id)
+            task.plan_to_task(self.mqtt, task.original_task)
+            self.mqtt.journal_task("planned", task.original_task, plan_id=task.plan_id)
+        except asyncio.TimeoutError:
+            print("Could not communicate with USSP Service")
+            self.mqtt.ussp_failed(task, selected_agent)
+            return False
+        except Exception:
+            print(traceback.format_exc())
+            self.mqtt.agent_manager.set_busy(selected_agent, False)
+            self.mqtt.send_task_failed(task, "Internal Error on the Drone Operator")
+            return False
+
+        self.mqtt.send_task_to_agent(task)
+        self.mqtt.agent_manager.running_tasks.add(task)
+        return True
@@ -0,0 +1,69 @@
+"""
+Compares assigning a batch of queued tasks one at a time to the closest agent (greedy)
+with assigning them all at once (min-cost matching). Reports the total distance
+the fleet has to travel to the first waypoints and the assignment throughput.
+
+Run from the repo root: python benchmarks/assignment_benchmark.py
+"""
+import random, time
+
+import bench_env
+
+from agent_manager import AgentManager
+
+FLEET_SIZE: int = 200
+BATCH_SIZES: list = [5, 20, 50]
+ROUNDS: int = 20
+DIRECT_EXECUTION_INFO: dict = {"tasks-available": [{"name": "move-to", "signals": ["$abort", "$enough"]}]}
+
+
+def build_manager(rng: random.Random) -> AgentManager:
+    agent_manager = AgentManager()
+    for i in range(FLEET_SIZE):
+        agent = agent_manager.create_new_agent({"name": f"agent_{i}", "agent-uuid": f"uuid-{i}", "busy": False})
+        agent.direct_execution_info = DIRECT_EXECUTION_INFO
+        agent.position = {"latitude": rng.uniform(57.5, 58.5), "longitude": rng.uniform(15.5, 17.5), "altitude": 40.0}
+    return agent_manager
+
+
+def total_distance(agents: list, tasks: list) -> float:
+    return sum(AgentManager.calculate_haversine_distance(
+        [params["waypoint"]["latitude"], params["waypoint"]["longitude"]], [agent.latitude, agent.longitude])
+        for agent, (_, params, _) in zip(agents, tasks) if agent is not None)
+
+
+def release(agent_manager: AgentManager, agents: list) -> None:
+    for agent in agents:
+        if agent is not None:
+            agent_manager.set_busy(agent, False)
+
+
+def main():
+    rng = random.Random(0)
+    agent_manager = build_manager(rng)
+    print(f"{'tasks':>6} {'greedy km':>10} {'batch km':>10} {'greedy tasks/s':>15} {'batch tasks/s':>14}")
+    for batch_size in BATCH_SIZES:
+        greedy_km = batch_km = greedy_time = batch_time = 0.0
+        for _ in range(ROUNDS):
+            tasks = [("move-to", {"waypoint": {"latitude": rng.uniform(57.5, 58.5), "longitude": rng.uniform(15.5, 17.5)}}, 1)
+                     for _ in range(batch_size)]
+
+            start = time.perf_counter()
+            agents = [agent_manager.select_closest_agent_that_is_non_busy(cmd, params) for cmd, params, _ in tasks]
+            greedy_time += time.perf_counter() - start
+            greedy_km += total_distance(agents, tasks)
+            release(agent_manager, agents)
+
+            start = time.perf_counter()
+            agents = agent_manager.assign_agents_to_tasks(tasks)
+            batch_time += time.perf_counter() - start
+            batch_km += total_distance(agents, tasks)
+            release(agent_manager, agents)
+
+        tasks_total = batch_size * ROUNDS
+        print(f"{batch_size:>6} {greedy_km / ROUNDS:>10.1f} {batch_km / ROUNDS:>10.1f} "
+              f"{tasks_total / greedy_time:>15.0f} {tasks_total / batch_time:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+Imported first by every benchmark: puts the repo root on the path and fills in the config that is read from the
+environment with the values from .env if nothing is set
+"""
+import os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for key, value in {"START_LAT": "57.7642", "START_LON": "16.6868", "WARAPS_PORT": "8883",
+                   "SERVICE_PORT": "5555", "PUBLISH_PORT": "5556"}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,74 @@
+"""
+Compares the cost per message of encoding the outgoing payloads (a fresh dict with json.dumps and with the codec)
+and of decoding incoming messages, for each JSON backend.
+
+Run from the repo root: python benchmarks/codec_benchmark.py
+"""
+import json, time, uuid
+
+import bench_env
+
+import codec
+
+ITERATIONS: int = 50000
+LEVELS: list = ["sensor", "direct execution", "tst execution"]
+TASKS_AVAILABLE: list = [{"name": name, "signals": ["$abort", "$enough", "$pause", "$continue"]}
+                         for name in ("move-to", "move-path", "search-area")]
+
+
+def heartbeat(stamp: float, levels) -> dict:
+    return {"name": "drone_operator", "agent-type": "drone_operator", "agent-description": "drone_operator",
+            "agent-model": "operator.controltower", "agent-uuid": "6f0b7a3e-5d1c-4c1e-9a53-1f4f7e0c2b11",
+            "levels": levels, "rate": 5.0, "stamp": stamp, "type": "HeartBeat"}
+
+
+def direct_execution_info(stamp: float, tasks_available) -> dict:
+    return {"name": "drone_operator", "rate": 5.0, "type": "DirectExecutionInfo", "stamp": stamp,
+            "tasks-available": tasks_available}
+
+
+def end_plan(task_uuid: str, plan_id) -> dict:
+    return {"com-uuid": "6f0b7a3e-5d1c-4c1e-9a53-1f4f7e0c2b11", "command": "start-task", "execution-unit": "USSP",
+            "sender": "drone_operator", "task": {"name": "end-plan", "meta": {}, "params": {"request": "end plan", "plan ID": plan_id}},
+            "task-uuid": task_uuid}
+
+
+def position() -> dict:
+    return {"latitude": 57.7642, "longitude": 16.6868, "altitude": 40.0, "type": "GeoPoint"}
+
+
+def response(task_uuid: str) -> dict:
+    return {"agent-uuid": "6f0b7a3e-5d1c-4c1e-9a53-1f4f7e0c2b11", "com-uuid": str(uuid.uuid4()), "fail-reason": "",
+            "response": "running", "response-to": str(uuid.uuid4()), "task-uuid": task_uuid}
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        function()
+    return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+def main():
+    task_uuid = str(uuid.uuid4())
+    print(f"{'backend':>8} {'message':>22} {'json.dumps us':>14} {'codec us':>9} {'decode us':>10}")
+    for backend in codec.BACKENDS:
+        if codec.use(backend) != backend:
+            continue
+        messages = {
+            "heartbeat": lambda: heartbeat(time.time(), LEVELS),
+            "direct_execution_info": lambda: direct_execution_info(time.time(), TASKS_AVAILABLE),
+            "end-plan": lambda: end_plan(task_uuid, "plan-1"),
+            "position": position,
+            "response": lambda: response(task_uuid),
+        }
+        for name, build in messages.items():
+            stdlib = timed(lambda: json.dumps(build()))
+            encoded = timed(lambda: codec.dumps(build()))
+            payload = codec.dumps(build())
+            decoded = timed(lambda: codec.loads(payload))
+            print(f"{backend:>8} {name:>22} {stdlib:>14.2f} {encoded:>9.2f} {decoded:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Measures the latency from queueing a task (agent idle) and from an agent becoming idle (task waiting) until the task
+is published to the agent, for the event-driven dispatcher (MqttManager.handle_task) and the old sleep-polling loop.
+The USSP handshake is left out, dispatch_task sends the task straight away.
+
+Run from the repo root: python benchmarks/dispatch_benchmark.py
+"""
+import statistics, threading, time
+
+import bench_env
+
+from agent_manager import AgentManager
+from mqtt_manager import MqttManager
+from task import Task, TaskQueue, TaskQueueItem
+
+ROUNDS: int = 10
+
+
+class Recorder():
+    '''Takes the place of the publish pipeline, notes when a task is published'''
+    def __init__(self) -> None:
+        self.published: threading.Event = threading.Event()
+        self.published_at: float = None
+
+    def publish(self, topic, payload = None, qos = None, retain = False, coalesce = None) -> bool:
+        self.published_at = time.perf_counter()
+        self.published.set()
+        return True
+
+
+def polling_handle_task(mqtt: MqttManager) -> None:
+    """The dispatcher before it waited on a condition"""
+    while True:
+        while not mqtt.task_queue.empty():
+            if mqtt.agent_manager.idle_agents:
+                task_item = mqtt.task_queue.get_task_from_queue()
+                task = task_item.item
+                selected_agent = mqtt.agent_manager.select_agent_that_is_non_busy(
+                    task.original_task["task"]["name"], task.original_task["task"]["params"])
+                if selected_agent is not None:
+                    mqtt.dispatch_task(task, selected_agent)
+                else:
+                    time.sleep(2)
+                    mqtt.task_queue.put_task_to_queue(TaskQueueItem(task_item.priority, task))
+            else:
+                time.sleep(2)
+        time.sleep(0.5)
+
+
+def build(dispatcher) -> tuple:
+    agent_manager = AgentManager()
+    task_queue = TaskQueue(10)
+    mqtt = MqttManager(agent_manager, None, None, None, task_queue)
+    mqtt.outbound = Recorder()
+
+    def dispatch_task(task, agent) -> bool:
+        task.agent = agent
+        mqtt.send_task_to_agent(task)
+        return True
+    mqtt.dispatch_task = dispatch_task
+
+    agent = agent_manager.create_new_agent({"name": "agent1", "base_topic": "waraps/unit/air/real/agent1",
+                                            "agent-uuid": "uuid1", "busy": True})
+    agent.position = {"latitude": 57.76, "longitude": 16.68, "altitude": 40.0}
+    agent.direct_execution_info = {"tasks-available": [{"name": "move-to", "signals": []}]}
+    threading.Thread(target=dispatcher, args=(mqtt,), daemon=True).start()
+    return mqtt, agent
+
+
+def queue_task(mqtt: MqttManager) -> None:
+    task = Task()
+    task.original_task = {"task": {"name": "move-to", "params": {"waypoint": {"latitude": 57.7, "longitude": 16.6}}}}
+    mqtt.task_queue.put_task_to_queue(TaskQueueItem(1, task))
+
+
+def measure(dispatcher) -> tuple:
+    mqtt, agent = build(dispatcher)
+    queued: list = []
+    released: list = []
+    for _ in range(ROUNDS):
+        #Task queued while the agent is idle
+        mqtt.outbound.published.clear()
+        mqtt.agent_manager.set_busy(agent, False)
+        time.sleep(0.05)
+        start = time.perf_counter()
+        queue_task(mqtt)
+        mqtt.outbound.published.wait(10)
+        queued.append(mqtt.outbound.published_at - start)
+
+        #Agent becomes idle while the task is waiting
+        mqtt.outbound.published.clear()
+        queue_task(mqtt)
+        time.sleep(0.05)
+        start = time.perf_counter()
+        mqtt.agent_manager.set_busy(agent, False)
+        mqtt.outbound.published.wait(10)
+        released.append(mqtt.outbound.published_at - start)
+    return queued, released
+
+
+def main():
+    print(f"{'dispatcher':>12} {'queued mean ms':>15} {'max ms':>8} {'agent idle mean ms':>19} {'max ms':>8}")
+    for name, dispatcher in (("polling", polling_handle_task), ("event", MqttManager.handle_task)):
+        queued, released = measure(dispatcher)
+        print(f"{name:>12} {statistics.mean(queued) * 1000:>15.2f} {max(queued) * 1000:>8.2f} "
+              f"{statistics.mean(released) * 1000:>19.2f} {max(released) * 1000:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Measures the cost of ingesting agent telemetry through MqttManager.agent_sensor_data
+for growing fleets. The cost per message should stay flat as the fleet grows.
+
+Run from the repo root: python benchmarks/ingest_benchmark.py
+"""
+import json, time
+from types import SimpleNamespace
+
+import bench_env
+
+from agent_manager import AgentManager
+from mqtt_manager import MqttManager
+
+FLEET_SIZES: list = [10, 100, 1000, 10000]
+MESSAGES: int = 20000
+
+
+def build_manager(fleet_size: int) -> MqttManager:
+    agent_manager = AgentManager()
+    for i in range(fleet_size):
+        agent_manager.create_new_agent({
+            "name": f"agent_{i}",
+            "base_topic": f"waraps/unit/air/real/agent_{i}",
+            "agent-uuid": f"uuid-{i}",
+            "busy": False
+        })
+    return MqttManager(agent_manager, None, None, None, None)
+
+
+def build_messages(fleet_size: int) -> list:
+    messages: list = []
+    for i in range(MESSAGES):
+        name = f"agent_{(i * 7919) % fleet_size}"
+        payload = {"latitude": 57.7 + i * 1e-6, "longitude": 16.6, "altitude": 40.0, "type": "GeoPoint"}
+        messages.append(SimpleNamespace(
+            topic=f"waraps/unit/air/real/{name}/sensor/position",
+            payload=json.dumps(payload).encode("utf-8")))
+    return messages
+
+
+def main():
+    print(f"{'agents':>8} {'us/msg':>10}")
+    for fleet_size in FLEET_SIZES:
+        mqtt = build_manager(fleet_size)
+        messages = build_messages(fleet_size)
+        start = time.perf_counter()
+        for msg in messages:
+            mqtt.agent_sensor_data(None, None, msg)
+        elapsed = time.perf_counter() - start
+        print(f"{fleet_size:>8} {elapsed / MESSAGES * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
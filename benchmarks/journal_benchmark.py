@@ -0,0 +1,79 @@
+"""
+Measures how many task lifecycle records per second are written durably by the task journal with 1 and 8 threads
+recording and waiting for every record (group commit), with 8 threads waiting only for "received" like the operator,
+against one fsync per record and the old one JSON file per task in ./logs (Task.save_task_to_log, not synced).
+
+Run from the repo root: python benchmarks/journal_benchmark.py
+"""
+import json, os, tempfile, time, uuid
+from threading import Thread
+
+import bench_env
+
+import codec
+from journal import HEADER, TaskJournal
+
+TASKS: int = 2000
+EVENTS: tuple = ("received", "queued", "assigned", "planned", "sent", "finished")
+MESSAGE: dict = {"com-uuid": "com1", "command": "start-task", "execution-unit": "operator", "sender": "c2",
+                 "task": {"name": "move-to", "params": {"speed": "standard", "waypoint": {
+                     "latitude": 57.7, "longitude": 16.6, "altitude": 40.0, "rostype": "GeoPoint"}}}}
+
+
+def journal(directory: str, threads: int, waited: tuple = EVENTS) -> tuple:
+    task_journal = TaskJournal(directory)
+
+    def work(count: int) -> None:
+        for _ in range(count):
+            task_uuid = str(uuid.uuid4())
+            for event in EVENTS:
+                task_journal.record(event, task_uuid, wait=event in waited, task=MESSAGE)
+
+    workers = [Thread(target=work, args=(TASKS // threads,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    task_journal.close()
+    return TASKS * len(EVENTS) / elapsed, task_journal.commits
+
+
+def fsync_per_record(directory: str) -> tuple:
+    with open(os.path.join(directory, "records.log"), "ab") as f:
+        start = time.perf_counter()
+        for _ in range(TASKS):
+            task_uuid = str(uuid.uuid4())
+            for event in EVENTS:
+                record = codec.dumps({"event": event, "task-uuid": task_uuid, "time": time.time(), "task": MESSAGE})
+                f.write(HEADER.pack(len(record), 0) + record)
+                f.flush()
+                os.fsync(f.fileno())
+        elapsed = time.perf_counter() - start
+    return TASKS * len(EVENTS) / elapsed, TASKS * len(EVENTS)
+
+
+def file_per_task(directory: str) -> tuple:
+    start = time.perf_counter()
+    for _ in range(TASKS):
+        with open(os.path.join(directory, f"{time.time()}-{uuid.uuid4()}.json"), "w") as f:
+            f.write(json.dumps({"waraps_task": MESSAGE, "status": 2}))
+    elapsed = time.perf_counter() - start
+    return TASKS / elapsed, 0
+
+
+def main():
+    print(f"{'writer':>26} {'records /s':>11} {'fsyncs':>7}")
+    for name, run in (("journal, 1 thread", lambda directory: journal(directory, 1)),
+                      ("journal, 8 threads", lambda directory: journal(directory, 8)),
+                      ("journal, wait on received", lambda directory: journal(directory, 8, ("received",))),
+                      ("fsync per record", fsync_per_record),
+                      ("file per task (finished)", file_per_task)):
+        with tempfile.TemporaryDirectory(dir=".") as directory:
+            rate, fsyncs = run(directory)
+        print(f"{name:>26} {rate:>11.0f} {fsyncs:>7}")
+
+
+if __name__ == "__main__":
+    main()
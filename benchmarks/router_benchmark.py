@@ -0,0 +1,90 @@
+"""
+Measures ingest throughput through the paho client with one message callback per agent topic
+(the old way) and with a single 'on_message' routing through the TopicRouter, with a handler that does nothing
+(the cost of routing alone) and with 'agent_sensor_data'. The best of REPEATS interleaved runs is reported,
+single runs vary by more than the difference.
+
+Run from the repo root: python benchmarks/router_benchmark.py
+"""
+import gc, json, time
+
+import bench_env
+
+from paho.mqtt.client import Client as PahoClient, MQTTMessage
+from agent_manager import AgentManager
+from mqtt_manager import MqttManager
+
+FLEET_SIZES: list = [1000, 10000]
+MESSAGES: int = 50000
+ATTRIBUTES: list = ["position", "heading", "speed", "course"]
+REPEATS: int = 5
+
+
+def ignore(*args) -> None:
+    pass
+
+
+def build_manager(fleet_size: int, routed: bool, handled: bool) -> MqttManager:
+    agent_manager = AgentManager()
+    mqtt = MqttManager(agent_manager, None, None, None, None)
+    mqtt.client = PahoClient()
+    if routed:
+        mqtt.client.on_message = mqtt.router.dispatch
+    for i in range(fleet_size):
+        meta_data = {
+            "name": f"agent_{i}",
+            "base_topic": f"waraps/unit/air/real/agent_{i}",
+            "agent-uuid": f"uuid-{i}",
+            "busy": False
+        }
+        agent_manager.create_new_agent(meta_data)
+        handler = mqtt.agent_sensor_data if handled else ignore
+        if routed:
+            mqtt.router.add(f"{meta_data['base_topic']}/#", handler, meta_data["name"])
+        else:
+            mqtt.client.message_callback_add(f"{meta_data['base_topic']}/#", handler)
+    return mqtt
+
+
+def build_messages(fleet_size: int) -> list:
+    messages: list = []
+    for i in range(MESSAGES):
+        name = f"agent_{(i * 7919) % fleet_size}"
+        attribute = ATTRIBUTES[i % len(ATTRIBUTES)]
+        if attribute == "position":
+            payload = {"latitude": 57.7 + i * 1e-6, "longitude": 16.6, "altitude": 40.0, "type": "GeoPoint"}
+        else:
+            payload = float(i % 360)
+        msg = MQTTMessage(topic=f"waraps/unit/air/real/{name}/sensor/{attribute}".encode("utf-8"))
+        msg.payload = json.dumps(payload).encode("utf-8")
+        messages.append(msg)
+    return messages
+
+
+def rate(mqtt: MqttManager, messages: list) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for msg in messages:
+            mqtt.client._handle_on_message(msg)
+        return MESSAGES / (time.perf_counter() - start)
+    finally:
+        gc.enable()
+
+
+def main():
+    print(f"{'agents':>8} {'handler':>18} {'callbacks msg/s':>16} {'router msg/s':>14}")
+    for fleet_size in FLEET_SIZES:
+        messages = build_messages(fleet_size)
+        for handled in (False, True):
+            rates: dict = {False: 0.0, True: 0.0}
+            for _ in range(REPEATS):
+                for routed in (False, True):
+                    rates[routed] = max(rates[routed], rate(build_manager(fleet_size, routed, handled), messages))
+            handler = "agent_sensor_data" if handled else "none"
+            print(f"{fleet_size:>8} {handler:>18} {rates[False]:>16.0f} {rates[True]:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
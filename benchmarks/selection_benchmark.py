@@ -0,0 +1,43 @@
+"""
+Measures the time to select the closest non-busy agent for a 'move-to' task
+for growing fleets spread over Sweden.
+
+Run from the repo root: python benchmarks/selection_benchmark.py
+"""
+import random, time
+
+import bench_env
+
+from agent_manager import AgentManager
+
+FLEET_SIZES: list = [100, 1000, 10000]
+SELECTIONS: int = 200
+DIRECT_EXECUTION_INFO: dict = {"tasks-available": [{"name": "move-to", "signals": ["$abort", "$enough"]}]}
+
+
+def build_manager(fleet_size: int, rng: random.Random) -> AgentManager:
+    agent_manager = AgentManager()
+    for i in range(fleet_size):
+        agent = agent_manager.create_new_agent({"name": f"agent_{i}", "agent-uuid": f"uuid-{i}", "busy": False})
+        agent.direct_execution_info = DIRECT_EXECUTION_INFO
+        agent.position = {"latitude": rng.uniform(55.0, 69.0), "longitude": rng.uniform(11.0, 24.0), "altitude": 40.0}
+    return agent_manager
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'agents':>8} {'ms/selection':>14}")
+    for fleet_size in FLEET_SIZES:
+        agent_manager = build_manager(fleet_size, rng)
+        waypoints = [{"latitude": rng.uniform(55.0, 69.0), "longitude": rng.uniform(11.0, 24.0)} for _ in range(SELECTIONS)]
+        elapsed = 0.0
+        for waypoint in waypoints:
+            start = time.perf_counter()
+            agent = agent_manager.select_closest_agent_that_is_non_busy("move-to", {"waypoint": waypoint})
+            elapsed += time.perf_counter() - start
+            agent_manager.set_busy(agent, False)
+        print(f"{fleet_size:>8} {elapsed / SELECTIONS * 1e3:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures the time from CONNACK until the broker has acknowledged all subscriptions (time-to-ready), with one SUBSCRIBE
+per topic (as before) and with the topics batched by Subscriptions, against a minimal in-process broker on localhost.
+
+Run from the repo root: python benchmarks/subscribe_benchmark.py
+"""
+import socket, threading, time
+
+import bench_env
+
+from paho.mqtt.client import Client as PahoClient
+from subscriptions import Subscriptions
+
+AGENTS: list = [100, 1000, 10000]
+
+
+def read_packet(connection: socket.socket):
+    header = connection.recv(1)
+    if not header:
+        return None, None
+    length, shift = 0, 0
+    while True:
+        byte = connection.recv(1)[0]
+        length += (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            break
+    body = b""
+    while len(body) < length:
+        body += connection.recv(length - len(body))
+    return header[0], body
+
+
+def broker(server: socket.socket) -> None:
+    """Answers CONNECT with CONNACK and every SUBSCRIBE with a SUBACK, one client at a time"""
+    while True:
+        connection, _ = server.accept()
+        while True:
+            kind, body = read_packet(connection)
+            if kind is None:
+                break
+            if kind >> 4 == 1:
+                connection.sendall(b"\x20\x02\x00\x00")
+            elif kind >> 4 == 8:
+                topics, i = 0, 2
+                while i < len(body):
+                    i += 2 + int.from_bytes(body[i:i + 2], "big") + 1
+                    topics += 1
+                length = 2 + topics
+                remaining = bytes([length]) if length < 128 else bytes([length % 128 | 0x80, length // 128])
+                connection.sendall(b"\x90" + remaining + body[:2] + b"\x00" * topics)
+        connection.close()
+
+
+def time_to_ready(port: int, topics: list, batched: bool) -> tuple:
+    client = PahoClient()
+    subscriptions = Subscriptions(client)
+    ready = threading.Event()
+    acked = [0]
+    sent = [0]
+
+    def on_subscribe(client, userdata, mid, granted_qos, properties = None):
+        subscriptions.on_subscribe(client, userdata, mid, granted_qos)
+        acked[0] += 1
+        if (batched and subscriptions.ready_time is not None) or (not batched and acked[0] == len(topics)):
+            ready.set()
+
+    def on_connect(client, userdata, flags, rc):
+        start[0] = time.perf_counter()
+        if batched:
+            subscriptions.restore()
+            sent[0] = subscriptions.packets
+        else:
+            for topic in topics:
+                client.subscribe(topic)
+            sent[0] = len(topics)
+
+    start = [0.0]
+    for topic in topics:
+        subscriptions.add(topic)
+    client.on_connect = on_connect
+    client.on_subscribe = on_subscribe
+    client.loop_start()
+    client.connect("127.0.0.1", port)
+    ready.wait(60)
+    elapsed = time.perf_counter() - start[0]
+    client.disconnect()
+    client.loop_stop()
+    return elapsed, sent[0]
+
+
+def main():
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen()
+    threading.Thread(target=broker, args=(server,), daemon=True).start()
+    port = server.getsockname()[1]
+
+    print(f"{'agents':>7} {'per topic ms':>13} {'packets':>8} {'batched ms':>11} {'packets':>8}")
+    for agents in AGENTS:
+        topics = [f"waraps/unit/+/+/agent{i}/heartbeat" for i in range(agents)]
+        single, single_packets = time_to_ready(port, topics, False)
+        batched, batched_packets = time_to_ready(port, topics, True)
+        print(f"{agents:>7} {single * 1000:>13.1f} {single_packets:>8} {batched * 1000:>11.1f} {batched_packets:>8}")
+
+
+if __name__ == "__main__":
+    main()
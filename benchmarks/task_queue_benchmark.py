@@ -0,0 +1,73 @@
+"""
+Measures enqueue and dequeue throughput of the TaskQueue with 100k pending tasks, all in memory and with a bounded
+in-memory head that spills the rest to disk, and the memory held by the queued tasks (tracemalloc, separate run).
+
+Run from the repo root: python benchmarks/task_queue_benchmark.py
+"""
+import random, tempfile, time, tracemalloc, uuid
+
+import bench_env
+
+from task import Task, TaskQueue, TaskQueueItem
+
+TASKS: int = 100000
+TASK_NAMES: list = ["move-to", "move-path", "search-area"]
+
+
+def new_item(rng: random.Random) -> TaskQueueItem:
+    task = Task()
+    task.original_task = {
+        "com-uuid": str(uuid.uuid4()), "command": "start-task", "execution-unit": "operator", "sender": "c2",
+        "task-uuid": str(uuid.uuid4()),
+        "task": {"name": rng.choice(TASK_NAMES), "params": {"speed": "standard", "waypoints": [
+            {"latitude": 57.7 + rng.random() * 0.1, "longitude": 16.6 + rng.random() * 0.1, "altitude": 40.0,
+             "rostype": "GeoPoint"} for _ in range(5)]}}
+    }
+    return TaskQueueItem(rng.randint(1, 5), task, time.time() + 3600.0)
+
+
+def build_queue(memory_size: int, directory: str) -> TaskQueue:
+    return TaskQueue(0, aging=60.0, memory_size=memory_size, spill_directory=directory)
+
+
+def throughput(memory_size: int, directory: str) -> tuple:
+    rng = random.Random(1)
+    items = [new_item(rng) for _ in range(TASKS)]
+    task_queue = build_queue(memory_size, directory)
+    start = time.perf_counter()
+    for item in items:
+        task_queue.put_task_to_queue(item)
+    enqueued = time.perf_counter() - start
+    spilled = len(task_queue.spill_file) if task_queue.spill_file is not None else 0
+
+    del items
+    start = time.perf_counter()
+    while task_queue.get_task_for(TASK_NAMES) is not None:
+        pass
+    dequeued = time.perf_counter() - start
+    return TASKS / enqueued, TASKS / dequeued, spilled
+
+
+def memory(memory_size: int, directory: str) -> float:
+    """MB held by the queue with all tasks pending, the messages are built as they arrive"""
+    rng = random.Random(1)
+    tracemalloc.start()
+    task_queue = build_queue(memory_size, directory)
+    for _ in range(TASKS):
+        task_queue.put_task_to_queue(new_item(rng))
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return held / 1e6
+
+
+def main():
+    print(f"{'memory size':>12} {'enqueue /s':>11} {'dequeue /s':>11} {'spill MB':>9} {'heap MB':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for memory_size in (0, 1000):
+            enqueue, dequeue, spilled = throughput(memory_size, directory)
+            held = memory(memory_size, directory)
+            print(f"{memory_size or 'all':>12} {enqueue:>11.0f} {dequeue:>11.0f} {spilled / 1e6:>9.1f} {held:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import json
+from data.config import OperatorConfig
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS: tuple = ("orjson", "json")
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _orjson_default(obj):
+    #orjson only takes exact floats and ints, like numpy scalars that are not covered by OPT_SERIALIZE_NUMPY
+    if isinstance(obj, float):
+        return float(obj)
+    if isinstance(obj, int):
+        return int(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+dumps = None #obj -> bytes (UTF-8 JSON)
+loads = None #bytes or str -> obj, raises a ValueError (json.JSONDecodeError) on invalid JSON
+backend: str = None
+
+
+def use(name: str = "auto") -> str:
+    """Selects the JSON backend, "auto" takes orjson if it is installed. Returns the name of the backend in use"""
+    global dumps, loads, backend
+    if name == "auto":
+        name = "orjson" if orjson is not None else "json"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown JSON backend: {name}")
+    if name == "orjson" and orjson is None:
+        print("orjson is not installed, using json")
+        name = "json"
+
+    if name == "orjson":
+        dumps, loads = _orjson_dumps, orjson.loads
+    else:
+        dumps, loads = _stdlib_dumps, json.loads
+    backend = name
+    return backend
+
+
+use(OperatorConfig.JSON_BACKEND)
@@ -3,6 +3,12 @@ import uuid
 import os
 
 
+def parse_key_values(text: str, value_type = str) -> dict:
+    "Parses 'key:value,key:value' into a dict"
+    pairs = (item.split(":", 1) for item in text.split(",") if ":" in item)
+    return {key.strip(): value_type(value.strip()) for key, value in pairs}
+
+
 @dataclass
 class OperatorConfig:        
     "Variables used for configuring the Drone Operator"
@@ -16,6 +22,45 @@ class OperatorConfig:
     POSITION: tuple = None
 
     POSITION = (float(os.getenv("START_LAT")), float(os.getenv("START_LON")))
+    #Number of other MQTT attributes (e.g. "speed", "sensor_info") kept per agent, 0 keeps none
+    MAX_EXTRA_ATTRIBUTES: int = int(os.getenv("MAX_EXTRA_ATTRIBUTES", "0"))
+    #Number of heartbeat periods ('rate' in the heartbeat) without a heartbeat before an agent is no longer selected
+    MISSED_HEARTBEATS: float = float(os.getenv("MISSED_HEARTBEATS", "3"))
+    #Number of position/speed samples kept per agent, 0 keeps none
+    HISTORY_SIZE: int = int(os.getenv("HISTORY_SIZE", "120"))
+    #Nominal cruise speed (m/s) per domain (waraps/unit/<domain>/...), used to estimate the time for an agent to reach a task
+    CRUISE_SPEED: float = float(os.getenv("CRUISE_SPEED", "5.0"))
+    CRUISE_SPEEDS = parse_key_values(os.getenv("CRUISE_SPEEDS", "ground:2.0,surface:5.0,air:15.0,subsurface:1.5"), float)
+    #How the agent for a task is selected, "closest" (distance) or "eta" (time to reach the first waypoint)
+    SELECTION_STRATEGIES = parse_key_values(os.getenv("SELECTION_STRATEGIES", "move-to:closest,move-path:closest,search-area:closest"))
+    #Assign all queued tasks at once (min-cost matching) instead of one at a time to the closest agent
+    BATCH_ASSIGNMENT: bool = bool(os.getenv('BATCH_ASSIGNMENT', 'False') == 'TRUE')
+    #Most tasks queued before new tasks are forwarded to a team member or rejected, and how many of them are kept in memory.
+    #The others are spilled to a file in TASK_QUEUE_SPILL_DIRECTORY (0 keeps every task in memory)
+    TASK_QUEUE_LIMIT: int = int(os.getenv("TASK_QUEUE_LIMIT", "100000"))
+    TASK_QUEUE_MEMORY: int = int(os.getenv("TASK_QUEUE_MEMORY", "1000"))
+    TASK_QUEUE_SPILL_DIRECTORY: str = os.getenv("TASK_QUEUE_SPILL_DIRECTORY", "./spill")
+    #Directory of the task journal, the tasks that had not finished are recovered from it on start. Empty turns it off.
+    #A new segment is started every TASK_JOURNAL_SEGMENT_SIZE bytes, older segments are kept up to TASK_JOURNAL_RETENTION bytes
+    TASK_JOURNAL_DIRECTORY: str = os.getenv("TASK_JOURNAL_DIRECTORY", "./journal")
+    TASK_JOURNAL_SEGMENT_SIZE: int = int(os.getenv("TASK_JOURNAL_SEGMENT_SIZE", "67108864"))
+    TASK_JOURNAL_RETENTION: int = int(os.getenv("TASK_JOURNAL_RETENTION", "268435456"))
+    #Seconds a queued task waits to move up one priority level, so less important tasks do not starve. 0 turns it off
+    TASK_AGING_SECONDS: float = float(os.getenv("TASK_AGING_SECONDS", "60"))
+    #Workers that decode and handle incoming MQTT messages, 0 handles them on the MQTT network thread
+    INGEST_WORKERS: int = int(os.getenv("INGEST_WORKERS", "4"))
+    #Messages queued per ingest worker, and what happens when the queue is full: "block", "drop_oldest" or "drop_newest"
+    #The asyncio runtime can not block, it uses "drop_oldest" instead of "block"
+    INGEST_QUEUE_SIZE: int = int(os.getenv("INGEST_QUEUE_SIZE", "1000"))
+    INGEST_POLICY: str = os.getenv("INGEST_POLICY", "block")
+    #Agent attributes where only the latest queued message is handled when the ingest workers fall behind, empty handles all
+    INGEST_CONFLATE: tuple = tuple(name for name in os.getenv("INGEST_CONFLATE", "position,speed,heading,course").split(",") if name)
+    #Topics subscribed to per agent, relative to its base topic. "#" subscribes to everything the agent publishes (needed for MAX_EXTRA_ATTRIBUTES)
+    AGENT_ATTRIBUTES: tuple = tuple(name for name in os.getenv("AGENT_ATTRIBUTES", "heartbeat,direct_execution_info,sensor/position,sensor/speed,sensor/heading,sensor/course,exec/response,exec/feedback").split(",") if name)
+    #Publish heartbeat and direct_execution_info as soon as the levels or tasks-available change, not only every RATE seconds
+    PUBLISH_ON_CHANGE: bool = bool(os.getenv('PUBLISH_ON_CHANGE', 'False') == 'TRUE')
+    #JSON library used for the MQTT payloads: "auto" (orjson if it is installed), "orjson" or "json"
+    JSON_BACKEND: str = os.getenv("JSON_BACKEND", "auto")
 
 
 '''
@@ -59,6 +104,16 @@ class MqttConfig:
     #REAL_SIM: str = "simulation"
     #DOMAIN: str = "air"
     BASE_TOPIC: str = f"waraps/unit/{DOMAIN}/{REAL_SIM}/{OperatorConfig.OPERATOR_NAME}"
+    #Most topics sent in one SUBSCRIBE packet, keep it below the limit of the broker
+    SUBSCRIBE_CHUNK_SIZE: int = int(os.getenv("MQTT_SUBSCRIBE_CHUNK_SIZE", "100"))
+    #QoS of the outgoing messages per end of topic, everything else (telemetry) is sent at QoS 0
+    PUBLISH_QOS = parse_key_values(os.getenv("MQTT_PUBLISH_QOS", "exec/command:1,exec/response:1,team/response:1,command:1"), int)
+    #Outgoing messages per second (0 for no limit) and the largest burst, and the messages queued before QoS 0 messages are dropped
+    PUBLISH_RATE: float = float(os.getenv("MQTT_PUBLISH_RATE", "100"))
+    PUBLISH_BURST: int = int(os.getenv("MQTT_PUBLISH_BURST", "50"))
+    PUBLISH_QUEUE_SIZE: int = int(os.getenv("MQTT_PUBLISH_QUEUE_SIZE", "1000"))
+    #QoS 1 messages sent but not acknowledged by the broker yet
+    MAX_INFLIGHT: int = int(os.getenv("MQTT_MAX_INFLIGHT", "20"))
 
 @dataclass
 class ZmqConfig:
@@ -77,4 +132,6 @@ class ZmqConfig:
 
 @dataclass
 class USSPConfig:
-    USSP_EXEC_TOPIC: str = os.getenv("USSP_EXEC_TOPIC")
\ No newline at end of file
+    USSP_EXEC_TOPIC: str = os.getenv("USSP_EXEC_TOPIC")
+    #Seconds the asyncio runtime waits for a reply from the USSP before the task fails
+    USSP_TIMEOUT: float = float(os.getenv("USSP_TIMEOUT", "30"))
@@ -0,0 +1,126 @@
+import queue, traceback
+from threading import Lock, Thread
+
+BLOCK, DROP_OLDEST, DROP_NEWEST = "block", "drop_oldest", "drop_newest" #What 'submit' does when a queue is full
+
+
+class IngestPool():
+    '''
+    Runs the handling of incoming messages (decoding and state updates) on a pool of workers instead of the MQTT network thread. \n
+    Messages are sharded on a key (the agent name), so all messages of one agent are handled in order by the same worker.
+    Every worker has a bounded queue, 'policy' decides what happens when it is full:
+    "block" waits for room (backpressure, the broker is slowed down through TCP), "drop_oldest" drops the oldest queued message
+    and "drop_newest" drops the new one. With 0 workers the messages are handled directly on the calling thread. \n
+    Messages submitted with a 'conflate' key (like the topic of a position) replace a queued message with the same key
+    instead of being queued after it, so only the latest one is handled and telemetry can not build up a backlog
+    '''
+    def __init__(self, workers: int = 4, queue_size: int = 1000, policy: str = BLOCK) -> None:
+        if policy not in (BLOCK, DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown ingest policy: {policy}")
+        self.policy: str = policy
+        self.queues: list[queue.Queue] = [queue.Queue(queue_size) for _ in range(workers)]
+        self.threads: list[Thread] = []
+        self.pending: list[dict] = [{} for _ in range(workers)] #conflate key -> queued item, per worker
+        self.locks: list[Lock] = [Lock() for _ in range(workers)] #Guards 'pending'
+        #Metrics, 'submitted' and 'dropped' are only written by the submitting thread, 'handled' by each worker
+        self.submitted: int = 0
+        self.dropped: int = 0
+        self.conflated: int = 0
+        self.handled: list[int] = [0] * workers
+        self.max_depths: list[int] = [0] * workers
+
+    def start(self) -> None:
+        for i, shard in enumerate(self.queues):
+            thread = Thread(target=self.__work, args=(i, shard), name=f"ingest-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        """Lets the workers finish the queued messages and waits for them"""
+        for shard in self.queues:
+            shard.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def submit(self, key, function, *args, conflate = None) -> bool:
+        """
+        Queues 'function(*args)' on the worker of the key, returns False if a message was dropped.
+        A queued message with the same 'conflate' key is replaced instead
+        """
+        self.submitted += 1
+        if not self.queues:
+            function(*args)
+            return True
+
+        i = hash(key) % len(self.queues)
+        shard = self.queues[i]
+        item = [function, args, conflate]
+        if conflate is not None:
+            with self.locks[i]:
+                queued = self.pending[i].get(conflate)
+                if queued is not None: #Not handled yet, only the latest message is kept
+                    queued[0], queued[1] = function, args
+                    self.conflated += 1
+                    return True
+                self.pending[i][conflate] = item
+
+        accepted = True
+        if self.policy == BLOCK:
+            shard.put(item)
+        else:
+            while True:
+                try:
+                    shard.put_nowait(item)
+                    break
+                except queue.Full:
+                    self.dropped += 1
+                    accepted = False
+                    if self.policy == DROP_NEWEST:
+                        self.__forget(i, item)
+                        break
+                    try:
+                        self.__forget(i, shard.get_nowait())
+                    except queue.Empty:
+                        pass
+
+        depth = shard.qsize()
+        if depth > self.max_depths[i]:
+            self.max_depths[i] = depth
+        return accepted
+
+    def __forget(self, i: int, item: list) -> None:
+        """Removes a dropped or taken item from the conflated messages"""
+        if item is None or item[2] is None:
+            return
+        with self.locks[i]:
+            if self.pending[i].get(item[2]) is item:
+                del self.pending[i][item[2]]
+
+    def depths(self) -> list:
+        """Current number of queued messages per worker"""
+        return [shard.qsize() for shard in self.queues]
+
+    def metrics(self) -> dict:
+        return {
+            "workers": len(self.queues),
+            "depths": self.depths(),
+            "max_depths": list(self.max_depths),
+            "submitted": self.submitted,
+            "handled": sum(self.handled) if self.queues else self.submitted,
+            "dropped": self.dropped,
+            "conflated": self.conflated
+        }
+
+    def __work(self, i: int, shard: queue.Queue) -> None:
+        while True:
+            item = shard.get()
+            if item is None:
+                return
+            self.__forget(i, item) #Later messages with the same key are queued again
+            function, args = item[0], item[1]
+            try:
+                function(*args)
+            except Exception:
+                print(traceback.format_exc())
+            self.handled[i] += 1
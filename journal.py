@@ -0,0 +1,169 @@
+import os, struct, time, traceback, zlib
+from threading import Condition, Thread
+import codec
+
+HEADER: struct.Struct = struct.Struct("<II") #Length and CRC-32 of the record
+
+
+class TaskJournal():
+    '''
+    Append-only log of what happens to every task: received, queued, assigned, planned, sent and finished. \n
+    Every record is a JSON object with the "event", the "task-uuid" and the "time", prefixed with its length and CRC-32.
+    'record' hands the record to a writer thread that writes everything recorded meanwhile and syncs it to disk with one
+    fsync (group commit), 'record(..., wait=True)' returns once the record is on disk. \n
+    The log is split into segments in 'directory'. A new segment is started when 'segment_size' bytes have been written
+    to the current one, the records of the tasks that have not finished are copied to the start of it, so the older
+    segments are not needed to recover and are removed once they take more than 'retention' bytes. \n
+    On start the segments are replayed, the records of the tasks that had not finished are kept in 'recovered'
+    (task-uuid -> records in order). A record cut short by a crash ends the replay of its segment
+    '''
+    def __init__(self, directory: str, segment_size: int = 64 * 1024 * 1024, retention: int = 0) -> None:
+        self.directory: str = directory
+        self.segment_size: int = segment_size
+        self.retention: int = retention
+        self.segments: list[int] = [] #Numbers of the segments on disk, oldest first, the last one is written to
+        self.file = None
+        self.written: int = 0 #Bytes recorded in the current segment, not counting the copied records
+        self.live: dict[str, list] = {} #task-uuid -> (offset, length) of its records in the current segment
+        self.recovered: dict[str, list[dict]] = {}
+        self.pending: list = [] #(task-uuid, event, record) waiting for the writer
+        self.recorded: int = 0
+        self.committed: int = 0 #Records on disk
+        self.commits: int = 0 #fsyncs
+        self.closing: bool = False
+        self.condition: Condition = Condition()
+
+        os.makedirs(directory, exist_ok=True)
+        self.segments = sorted(int(name.split(".")[0]) for name in os.listdir(directory) if name.endswith(".journal"))
+        for number in self.segments:
+            self.__replay(number)
+        self.__rotate()
+        self.thread: Thread = Thread(target=self.__work, name="journal", daemon=True)
+        self.thread.start()
+
+    def record(self, event: str, task_uuid: str, wait: bool = False, **data) -> None:
+        """Journals the event of the task with 'data', waits until it is on disk if 'wait'"""
+        record = codec.dumps({"event": event, "task-uuid": task_uuid, "time": time.time(), **data})
+        with self.condition:
+            self.pending.append((task_uuid, event, record))
+            self.recorded += 1
+            sequence = self.recorded
+            self.condition.notify_all()
+            while wait and self.committed < sequence and not self.closing:
+                self.condition.wait()
+
+    def close(self) -> None:
+        """Writes the pending records and stops the writer"""
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.file.close()
+
+    def segment_path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:08d}.journal")
+
+    def __replay(self, number: int) -> None:
+        with open(self.segment_path(number), "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + HEADER.size <= len(data):
+            length, crc = HEADER.unpack_from(data, offset)
+            body = data[offset + HEADER.size:offset + HEADER.size + length]
+            if len(body) < length or zlib.crc32(body) != crc:
+                print(f"Task journal segment {number} is cut short at byte {offset}, the rest is skipped")
+                break
+            offset += HEADER.size + length
+            record = codec.loads(body)
+            task_uuid = record["task-uuid"]
+            if record["event"] == "finished":
+                self.recovered.pop(task_uuid, None)
+            elif record["event"] == "received" or task_uuid in self.recovered:
+                records = self.recovered.setdefault(task_uuid, [])
+                if record["event"] == "received":
+                    records.clear() #A task-uuid used again
+                records.append(record)
+
+    def __rotate(self) -> None:
+        """Starts a new segment with the records of the tasks that have not finished, removes the segments beyond the retention"""
+        number = self.segments[-1] + 1 if self.segments else 1
+        new_file = open(self.segment_path(number), "w+b")
+        live: dict[str, list] = {}
+        buffer = bytearray()
+        if self.file is None: #Recovered from the replay
+            for task_uuid, records in self.recovered.items():
+                live[task_uuid] = [self.__frame(buffer, codec.dumps(record)) for record in records]
+        else:
+            fd = self.file.fileno()
+            for task_uuid, locations in self.live.items():
+                live[task_uuid] = [self.__frame(buffer, os.pread(fd, length, offset)[HEADER.size:])
+                                   for offset, length in locations]
+            self.file.close()
+        new_file.write(buffer)
+        new_file.flush()
+        os.fsync(new_file.fileno())
+        self.__sync_directory()
+        self.file, self.live, self.written = new_file, live, 0
+        self.segments.append(number)
+
+        old_size = 0
+        for old in reversed(self.segments[:-1]):
+            path = self.segment_path(old)
+            old_size += os.path.getsize(path)
+            if old_size > self.retention:
+                os.remove(path)
+                self.segments.remove(old)
+
+    @staticmethod
+    def __frame(buffer: bytearray, record: bytes) -> tuple:
+        """Appends the record with its header to 'buffer', returns the (offset, length) of both"""
+        offset = len(buffer)
+        buffer += HEADER.pack(len(record), zlib.crc32(record))
+        buffer += record
+        return offset, HEADER.size + len(record)
+
+    def __sync_directory(self) -> None:
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return #Not supported on every platform
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __work(self) -> None:
+        while True:
+            with self.condition:
+                while not self.pending and not self.closing:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+            try:
+                self.__write(batch)
+            except Exception:
+                print(traceback.format_exc())
+            with self.condition:
+                self.committed += len(batch)
+                self.commits += 1
+                self.condition.notify_all()
+
+    def __write(self, batch: list) -> None:
+        """Writes the records with one fsync"""
+        start = self.file.seek(0, os.SEEK_END)
+        buffer = bytearray()
+        for task_uuid, event, record in batch:
+            offset, length = self.__frame(buffer, record)
+            if event == "finished":
+                self.live.pop(task_uuid, None)
+            elif event == "received":
+                self.live[task_uuid] = [(start + offset, length)]
+            elif task_uuid in self.live:
+                self.live[task_uuid].append((start + offset, length))
+        self.file.write(buffer)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.written += len(buffer)
+        if self.written >= self.segment_size:
+            self.__rotate()
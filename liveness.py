@@ -0,0 +1,60 @@
+import math
+from threading import Lock
+
+class TimerWheel():
+    '''
+    Hashed timer wheel, keys are scheduled to expire at a deadline (seconds) with 'resolution' precision. \n
+    Scheduling, rescheduling and cancelling are O(1), 'expire' only visits the buckets of the ticks that passed
+    '''
+    def __init__(self, resolution: float = 0.5, size: int = 512) -> None:
+        self.resolution: float = resolution
+        self.buckets: list[set] = [set() for _ in range(size)]
+        self.ticks: dict = {} #key -> tick it expires at
+        self.current_tick: int = None #Last tick that has been expired
+        self.lock: Lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.ticks)
+
+    def __contains__(self, key) -> bool:
+        return key in self.ticks
+
+    def schedule(self, key, deadline: float) -> None:
+        """Schedules the key to expire at the deadline, replaces an earlier deadline of the key"""
+        tick = math.ceil(deadline / self.resolution)
+        with self.lock:
+            self.__cancel(key)
+            if self.current_tick is not None and tick <= self.current_tick:
+                tick = self.current_tick + 1 #Already passed, expire on the next call
+            self.ticks[key] = tick
+            self.buckets[tick % len(self.buckets)].add(key)
+
+    def cancel(self, key) -> None:
+        with self.lock:
+            self.__cancel(key)
+
+    def __cancel(self, key) -> None:
+        tick = self.ticks.pop(key, None)
+        if tick is not None:
+            self.buckets[tick % len(self.buckets)].discard(key)
+
+    def expire(self, now: float) -> list:
+        """Removes and returns the keys with a deadline at or before 'now'"""
+        now_tick = math.floor(now / self.resolution)
+        expired: list = []
+        with self.lock:
+            if self.current_tick is None:
+                self.current_tick = now_tick - 1 if not self.ticks else min(min(self.ticks.values()), now_tick) - 1
+            if now_tick <= self.current_tick:
+                return expired
+
+            #A full turn of the wheel visits every bucket, keys further ahead stay in their bucket
+            first_tick = max(self.current_tick + 1, now_tick - len(self.buckets) + 1)
+            for tick in range(first_tick, now_tick + 1):
+                bucket = self.buckets[tick % len(self.buckets)]
+                for key in [key for key in bucket if self.ticks[key] <= now_tick]:
+                    bucket.discard(key)
+                    del self.ticks[key]
+                    expired.append(key)
+            self.current_tick = now_tick
+        return expired
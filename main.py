@@ -1,9 +1,12 @@
-import time
+import argparse, asyncio, time
 from agent_manager import AgentManager
 from task import TaskQueue
+from journal import TaskJournal
+from data.config import OperatorConfig
 from team_manager import TeamManager
 from zeromq_manager import ZeromqManager
 from mqtt_manager import MqttManager
+from async_runtime import AsyncRuntime
 from drone_operator_manager import DroneOperatorManager
 from threading import Thread
 from flask import Flask
@@ -15,8 +18,9 @@ def flask_app():
         return 'OK'
     app.run()
 
-def main():
-    task_queue: TaskQueue = TaskQueue(10)
+def main(runtime: str = "threaded"):
+    task_queue: TaskQueue = TaskQueue(OperatorConfig.TASK_QUEUE_LIMIT, OperatorConfig.TASK_AGING_SECONDS,
+                                      OperatorConfig.TASK_QUEUE_MEMORY, OperatorConfig.TASK_QUEUE_SPILL_DIRECTORY)
     zeromq = ZeromqManager()
     #zeromq.initialize()
     #zeromq.run()
@@ -25,26 +29,50 @@ def main():
     drone_operator_manager = DroneOperatorManager()
     team_manager = TeamManager()
 
-    mqtt = MqttManager(agent_manager, zeromq, drone_operator_manager, team_manager, task_queue)
+    task_journal: TaskJournal = None
+    if OperatorConfig.TASK_JOURNAL_DIRECTORY:
+        task_journal = TaskJournal(OperatorConfig.TASK_JOURNAL_DIRECTORY, OperatorConfig.TASK_JOURNAL_SEGMENT_SIZE,
+                                   OperatorConfig.TASK_JOURNAL_RETENTION)
+
+    mqtt = MqttManager(agent_manager, zeromq, drone_operator_manager, team_manager, task_queue, task_journal)
     mqtt.initialize()
+    try:
+        run(mqtt, runtime)
+    finally: #Like on Ctrl+C
+        task_queue.close()
+        if task_journal is not None:
+            task_journal.close()
+
+def run(mqtt: MqttManager, runtime: str) -> None:
+    if runtime == "asyncio":
+        asyncio.run(AsyncRuntime(mqtt).run())
+        return
+
     mqtt.run() #PRODUCER THREAD
     
     handle_task_thread = Thread(target=mqtt.handle_task, daemon=True) 
     handle_task_thread.start() #CONSUMER THREAD
 
-    #Main loop
+    #Main loop, publishes every 'rate' seconds and right away when the levels or tasks-available change (PUBLISH_ON_CHANGE)
+    next_publish = time.monotonic()
     while True:
-        mqtt.update_tasks_available()
-        mqtt.update_levels()
-        mqtt.send_heartbeat()
-        mqtt.send_position()
-        mqtt.send_direct_execution_info()
-        time.sleep(mqtt.rate)
+        mqtt.agent_manager.expire_stale_agents()
+        mqtt.expire_tasks()
+        periodic = time.monotonic() >= next_publish
+        mqtt.publish_status(periodic)
+        if periodic:
+            next_publish = time.monotonic() + mqtt.rate
+        mqtt.status_changed.wait(max(next_publish - time.monotonic(), 0.0))
+        mqtt.status_changed.clear()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runtime", choices=["threaded", "asyncio"], default="threaded",
+                        help="'threaded' runs paho's loop thread and a thread per consumer, 'asyncio' runs everything on one event loop")
+    args = parser.parse_args()
     #TODO får ingen feedback av teams av teams, kan vara för att det är olika verisoner?
     #TODO skicka response att en agent har lagts till i kön
     flask_app_thread = Thread(target=flask_app, daemon=True) 
     flask_app_thread.start()
 
-    main()
\ No newline at end of file
+    main(args.runtime)
\ No newline at end of file
@@ -2,16 +2,22 @@ from enum import Enum
 import uuid
 from data.config import MqttConfig, OperatorConfig, USSPConfig
 from ussp import USSP
-from threading import Event
+from threading import Condition, Event
 import zmq
 from zeromq_manager import ZeromqManager
 from rounding_helpers import rounded_lat_lon, rounded_timestamp
 from paho.mqtt.client import Client as PahoClient
 import json, ssl, traceback, time
+import codec
 from agent_manager import Agent, AgentManager
-from task import Task, TaskQueueItem, TaskStatus, TaskQueue
+from task import Task, TaskQueueItem, TaskStatus, TaskQueue, task_deadline, task_priority
+from journal import TaskJournal
 from drone_operator_manager import DroneOperator, DroneOperatorManager
 from team_manager import Team, TeamManager, TeamType, TeamCommandMessage
+from topic_router import TopicRouter
+from subscriptions import Subscriptions
+from outbound import PublishPipeline
+from ingest import IngestPool
 
 class TaskNotSupported(Exception):
     """Exception raised for errors when a task is not supported"""
@@ -42,13 +48,22 @@ class TaskSignal(str, Enum):
     CONTINUE = "$continue"
 
 
+def stamped_body(payload: dict) -> bytes:
+    """Encodes the payload without the closing brace, the stamp is appended on every publish, see 'stamped'"""
+    return codec.dumps(payload)[:-1] + b',"stamp":'
+
+def stamped(body: bytes) -> bytes:
+    return body + codec.dumps(rounded_timestamp()) + b"}"
+
+
 class MqttManager:
-    def __init__(self, agent_manager, zeromq_manager, drone_operator_manager, team_manager, task_queue) -> None:
+    def __init__(self, agent_manager, zeromq_manager, drone_operator_manager, team_manager, task_queue, task_journal = None) -> None:
         self.base_topic: str = MqttConfig.BASE_TOPIC
         self.operator_id: str = OperatorConfig.OPERATOR_ID
         self.uas_id: str = OperatorConfig.UAS_ID
         self.operator_name: str = OperatorConfig.OPERATOR_NAME
         self.rate: float = OperatorConfig.RATE
+        self.batch_assignment: bool = OperatorConfig.BATCH_ASSIGNMENT
         self.espg: int = OperatorConfig.EPSG
         self.position: tuple = OperatorConfig.POSITION
         self.levels: list = []
@@ -59,14 +74,45 @@ class MqttManager:
         self.drone_operator_manager: DroneOperatorManager = drone_operator_manager
         self.team_manager: TeamManager = team_manager
         self.task_queue: TaskQueue = task_queue
+        self.task_journal: TaskJournal = task_journal #What happens to every task, to recover the tasks after a crash
+        self.agent_manager.running_tasks.journal = task_journal
         self.broker: str = None
         self.port: int = None
         self.client: PahoClient = None
+        self.subscriptions: Subscriptions = None #Every subscription goes through here, restored on reconnect
+        self.outbound: PublishPipeline = None #Every outgoing message goes through here instead of 'client.publish'
+        self.router: TopicRouter = TopicRouter() #All incoming messages are routed from here, see 'on_message'
+        self.ingest: IngestPool = IngestPool(OperatorConfig.INGEST_WORKERS, OperatorConfig.INGEST_QUEUE_SIZE, OperatorConfig.INGEST_POLICY)
+        self.agent_attributes: tuple = OperatorConfig.AGENT_ATTRIBUTES #Subscribed to per agent, see 'agent_topics'
+        self.conflated_attributes: frozenset = frozenset(OperatorConfig.INGEST_CONFLATE) #Only the latest queued message is handled
 
         self.ussp_exec_topic: str = None
         self.unique_ussp_topic: str = None
         self.ussp_event: Event = Event()
         self.current_working_task: Task = None
+        #'handle_task' waits on the condition until a task is queued or an agent becomes idle, counted in 'dispatch_wakeups'
+        self.dispatch_condition: Condition = Condition()
+        self.dispatch_wakeups: int = 0
+        self.agent_manager.idle_listeners.append(self.wake_dispatcher)
+        if task_queue is not None:
+            task_queue.listeners.append(self.wake_dispatcher)
+        self.ussp_listener = None #Called with every USSP reply instead of setting 'ussp_event', set by the asyncio runtime
+        self.status_changed: Event = Event() #Set when the levels or tasks-available change, if PUBLISH_ON_CHANGE
+        if OperatorConfig.PUBLISH_ON_CHANGE:
+            self.agent_manager.levels.listeners.append(self.status_changed.set)
+            self.agent_manager.tasks_available.listeners.append(self.status_changed.set)
+
+        #Encoded with the current levels and tasks-available, only the stamp is encoded on every publish
+        self.heartbeat_body: bytes = self.encode_heartbeat()
+        self.direct_execution_info_body: bytes = self.encode_direct_execution_info()
+        #The position of the operator does not change, it is encoded once
+        lat, lon = self.position
+        self.position_payload: bytes = codec.dumps({
+            "latitude":lat,
+            "longitude":lon,
+            "altitude":0,
+            "type":"GeoPoint"
+        })
 
     def initialize(self) -> None:
 
@@ -88,36 +134,44 @@ class MqttManager:
         #LIST of all topics, add new here :)
         topics: list = [command_topic, team_command_topic, tst_topic, self.ussp_exec_topic]
         client: PahoClient = PahoClient(self.operator_name)
+        self.subscriptions = Subscriptions(client, MqttConfig.SUBSCRIBE_CHUNK_SIZE)
+        self.outbound = PublishPipeline(client, MqttConfig.PUBLISH_QOS, MqttConfig.PUBLISH_RATE, MqttConfig.PUBLISH_BURST,
+                                        MqttConfig.PUBLISH_QUEUE_SIZE)
+        client.max_inflight_messages_set(MqttConfig.MAX_INFLIGHT)
+
+        #Drone Operators own topics
+        for topic in topics:
+            self.subscriptions.add(topic)
+            print(f"Subscribing to {topic}")
+
+        #Topics for the agents
+        for agent in self.agent_manager.agents_list:
+            topic: str = f"waraps/unit/+/+/{agent}/heartbeat"
+            self.subscriptions.add(topic)
+            print(f"Subscribing to {topic}")
+            self.router.add(topic, self.search_and_create_agent, agent)
+
+        #topcis for other droneoperators (Teams of teams)
+        for dop in self.drone_operator_manager.children_list:
+            topic: str = f"waraps/unit/+/+/{dop}/heartbeat"
+            self.subscriptions.add(topic)
+            print(f"Subscribing to {topic}")
+            self.router.add(topic, self.search_and_create_agent, dop)
 
         def on_connect(client, userdata, flags, rc) -> None:
             if rc == 0:
                 print(f"Connected to MQTT Broker: {self.broker}:{self.port}")
-                #Drone Operators own topics
-                for topic in topics:
-                    self.client.subscribe(topic)
-                    print(f"Subscribing to {topic}")
-
-                #Topics for the agents
-                for agent in self.agent_manager.agents_list:
-                    topic: str = f"waraps/unit/+/+/{agent}/heartbeat"
-                    self.client.subscribe(topic)
-                    print(f"Subscribing to {topic}")
-                    self.client.message_callback_add(topic, self.search_and_create_agent)
-
-                #topcis for other droneoperators (Teams of teams)
-                for dop in self.drone_operator_manager.children_list:
-                    topic: str = f"waraps/unit/+/+/{dop}/heartbeat"
-                    self.client.subscribe(topic)
-                    print(f"Subscribing to {topic}")
-                    self.client.message_callback_add(topic, self.search_and_create_agent)    
-
-                USSP.create_connection(self.client, f"{ussp_exec_topic}/command", self.operator_name)
+                #Own topics, the agents not found yet and the agents found before a reconnect, in as few packets as possible
+                self.subscriptions.restore()
+
+                if self.unique_ussp_topic is None:
+                    USSP.create_connection(self.outbound, f"{ussp_exec_topic}/command", self.operator_name)
             else :
                 print(f"Error to connect : {rc}")
 
 
         def team_command_messages(client, userdata, msg):
-            msg_json = json.loads(msg.payload.decode('utf-8'))
+            msg_json = codec.loads(msg.payload)
             print(msg_json)
             payload: dict = dict()
 
@@ -166,7 +220,7 @@ class MqttManager:
 
         def tst_command_messages(client, userdatam, msg):
             print("TST COMMAND")
-            command = json.loads(msg.payload.decode('utf-8'))
+            command = codec.loads(msg.payload)
             print(command)
             #print(command)
             #print(command["children"]) #list
@@ -206,11 +260,13 @@ class MqttManager:
 
         #Bind callback functions
         client.on_connect = on_connect
-        client.message_callback_add(command_topic, self.handle_command)
-        client.message_callback_add(team_command_topic, team_command_messages)
-        client.message_callback_add(tst_topic, tst_command_messages)
+        client.on_subscribe = self.subscriptions.on_subscribe
+        client.on_message = self.on_message
+        self.router.add(command_topic, self.handle_command)
+        self.router.add(team_command_topic, team_command_messages)
+        self.router.add(tst_topic, tst_command_messages)
 
-        client.message_callback_add(self.ussp_exec_topic, self.ussp_connection_callback)
+        self.router.add(self.ussp_exec_topic, self.ussp_connection_callback)
         
         
 
@@ -222,15 +278,28 @@ class MqttManager:
         self.client = client
     
     def run(self) -> None:
-        """Starts the background loop and connect to the broker"""
+        """Starts the ingest workers, the publish pipeline and the background loop and connect to the broker"""
+        self.ingest.start()
+        self.outbound.start()
+        self.recover_tasks() #Publishes the tasks that can not be recovered as failed, the pipeline has to be running
         self.client.loop_start()
         self.client.connect(self.broker, self.port, 60)
 
+    def on_message(self, client, userdata, msg) -> None:
+        """Runs on the paho network thread, only looks up the routes and hands the raw message to the ingest workers"""
+        resolved = self.router.resolve(msg.topic)
+        if resolved:
+            route = resolved[0]
+            #Telemetry of an agent is conflated per topic, the rest (like 'response' and 'feedback') is handled in full and in order
+            conflate = msg.topic if route.agent_name is not None and route.attribute in self.conflated_attributes else None
+            #Sharded on the agent name to keep the messages of an agent in order, other topics are kept in order per topic
+            self.ingest.submit(route.agent_name or msg.topic, self.router.call, resolved, client, userdata, msg, conflate=conflate)
+
     def forward_task_to_team_member(self, payload: json):
         selected_dop: DroneOperator = self.select_first_drone_operator()
         print(f"Could not find an Agent sent task to team member: {selected_dop.name}")
         topic: str = selected_dop.command_topic
-        self.client.publish(topic, json.dumps(payload))
+        self.outbound.publish(topic, codec.dumps(payload))
 
     def select_first_drone_operator(self):
         return self.drone_operator_manager.children[0]
@@ -240,7 +309,7 @@ class MqttManager:
         name = task.agent.meta['name']
         topic = f"{task.agent.meta['base_topic']}/exec/command"
         print(f"Sent Signal to Agent {name}")
-        self.client.publish(topic, json.dumps(payload))
+        self.outbound.publish(topic, codec.dumps(payload))
         print(f"Looking for agent to response...")
 
     def send_task_to_agent(self, task: Task):
@@ -250,97 +319,108 @@ class MqttManager:
         name = task.agent.meta['name']
         topic = f"{task.agent.meta['base_topic']}/exec/command"
         print(f"Sent task to Agent {name}")
-        self.client.publish(topic, json.dumps(payload))
+        self.outbound.publish(topic, codec.dumps(payload))
         print(f"Looking for agent to response...")
 
+    def agent_topics(self, base_topic: str) -> list:
+        """The topics of the agent in AGENT_ATTRIBUTES, only '{base_topic}/#' if it has the wildcard"""
+        if "#" in self.agent_attributes:
+            return [f"{base_topic}/#"]
+        return [f"{base_topic}/{attribute}" for attribute in self.agent_attributes]
+
     def subscribe_to_agent(self, meta_data: dict) -> None:
-        agent_topic: str = f"{meta_data['base_topic']}/#"
-        self.client.subscribe(agent_topic)
-        self.client.message_callback_add(agent_topic, self.agent_sensor_data)
-        print(f"Subscribing to {agent_topic}")
+        agent_topics: list = self.agent_topics(meta_data['base_topic'])
+        self.subscriptions.subscribe(agent_topics)
+        for agent_topic in agent_topics:
+            self.router.add(agent_topic, self.agent_sensor_data, meta_data['name'])
+        print(f"Subscribing to {', '.join(agent_topics)}")
 
     def subscribe_to_drone_operator(self, meta_data: dict) -> None:
         agent_topic: str = f"{meta_data['base_topic']}/exec/#"
-        self.client.subscribe(agent_topic)
-        self.client.message_callback_add(agent_topic, self.agent_sensor_data)
+        self.subscriptions.subscribe([agent_topic])
+        self.router.add(agent_topic, self.agent_sensor_data, meta_data['name'])
         print(f"Subscribing to {agent_topic}")
 
-    def agent_sensor_data(self, client, userdata, msg ) -> None:
-        s = msg.topic.split("/")
-        #name is always in 4th place if following the docs
-        agent_name = s[4]
-        agent_attri = s[-1]
+    def agent_sensor_data(self, client, userdata, msg, agent_name: str = None, agent_attri: str = None) -> None:
+        if agent_name is None: #Not routed, take them from the topic
+            s = msg.topic.split("/")
+            #name is always in 4th place if following the docs
+            agent_name = s[4]
+            agent_attri = s[-1]
         try:
             str_msg = msg.payload.decode('utf-8')
-            agent = next(( a for a in self.agent_manager.all_agents if a.meta["name"] == agent_name )) #StopIteration
-            json_msg = json.loads(str_msg) #ValueError
+            agent = self.agent_manager.agents[agent_name] #KeyError
+            json_msg = codec.loads(str_msg) #ValueError
         except ValueError: 
             #if a "str_msg" is not a valid JSON object, like a cam_url etc.
-            setattr(agent, agent_attri, str_msg)
-        except StopIteration: #IS DRONE OPERATOR TODO: Is this used??
-            json_msg = json.loads(str_msg) #ValueError
+            agent.update_attribute(agent_attri, str_msg)
+        except KeyError: #IS DRONE OPERATOR TODO: Is this used??
+            json_msg = codec.loads(str_msg) #ValueError
             if agent_attri == "heartbeat": 
                 dop_list = [x for x in self.drone_operator_manager.children if x.name == agent_name]
                 dop_list[0].levels = json_msg["levels"]
+                self.agent_manager.levels.set(("drone_operator", agent_name), dop_list[0].levels)
             elif agent_attri == "direct_execution_info":
                 dop_list = [x for x in self.drone_operator_manager.children if x.name == agent_name]
                 dop_list[0].tasks_available = json_msg["tasks-available"]
+                self.agent_manager.tasks_available.set(("drone_operator", agent_name), dop_list[0].tasks_available)
          
         else: #No error
-            setattr(agent, agent_attri, json_msg)
+            agent.update_attribute(agent_attri, json_msg)
         finally: #always runs
             # try:
             if agent_attri == "response":
-                self.agent_manager.check_response(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event, json_msg, agent_name)
+                self.agent_manager.check_response(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event, json_msg, agent_name)
                 self.send_response(json_msg)
             elif agent_attri == "feedback":
-                self.agent_manager.check_feedback(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event, json_msg, agent_name)
+                self.agent_manager.check_feedback(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event, json_msg, agent_name)
                 self.send_feedback(json_msg)
 
-    def update_levels(self) -> None:
-        """Updates 'LEVELS' that is used in heartbeat"""
-        try:
-            for agent in self.agent_manager.all_agents:
-                for lvl in agent.heartbeat["levels"]:
-                    if lvl not in self.levels:
-                        self.levels.append(lvl)
-
-            for dop in self.drone_operator_manager.children:
-                for lvl in dop.levels:
-                    if lvl not in self.levels:
-                        self.levels.append(lvl)
-
-        except AttributeError:
-            return
-
-    def update_tasks_available(self) -> None:
-        """Updates 'tasks-available' that is used in direct_execution_info"""
-        try:
-            for agent in self.agent_manager.all_agents:
-                for task in agent.direct_execution_info["tasks-available"]:
-                    if task not in self.tasks_available:
-                        self.tasks_available.append(task)
-
-            for dop in self.drone_operator_manager.children:
-                for task in dop.tasks_available:
-                    if task not in self.tasks_available:
-                        self.tasks_available.append(task)
-        except AttributeError:
-            return
-
-    def send_direct_execution_info(self) -> None:
-        payload = {
+    def update_levels(self) -> bool:
+        """
+        Updates 'LEVELS' that is used in heartbeat, kept up to date by the AgentManager as agents come and go.
+        Returns True if they changed, the heartbeat is then encoded again
+        """
+        levels = self.agent_manager.levels.items()
+        if levels is self.levels: #The same list until the levels change
+            return False
+        self.levels = levels
+        self.heartbeat_body = self.encode_heartbeat()
+        return True
+
+    def update_tasks_available(self) -> bool:
+        """
+        Updates 'tasks-available' that is used in direct_execution_info, kept up to date by the AgentManager as agents come and go.
+        Returns True if they changed, the direct_execution_info is then encoded again
+        """
+        tasks_available = self.agent_manager.tasks_available.items()
+        if tasks_available is self.tasks_available:
+            return False
+        self.tasks_available = tasks_available
+        self.direct_execution_info_body = self.encode_direct_execution_info()
+        return True
+
+    def publish_status(self, periodic: bool) -> None:
+        """Publishes heartbeat, position and direct_execution_info if 'periodic', otherwise only the ones that changed"""
+        tasks_available_changed = self.update_tasks_available()
+        levels_changed = self.update_levels()
+        if periodic or levels_changed:
+            self.send_heartbeat()
+        if periodic:
+            self.send_position()
+        if periodic or tasks_available_changed:
+            self.send_direct_execution_info()
+
+    def encode_direct_execution_info(self) -> bytes:
+        return stamped_body({
             "name":self.operator_name,
             "rate":self.rate,
             "type":"DirectExecutionInfo",
-            "stamp":rounded_timestamp(),
             "tasks-available":self.tasks_available
-        }
-
-        self.client.publish(f"{self.base_topic}/direct_execution_info", json.dumps(payload))
+        })
 
-    def send_heartbeat(self) -> None:
-        payload = {
+    def encode_heartbeat(self) -> bytes:
+        return stamped_body({
             "name":self.operator_name,
             "agent-type":"drone_operator",
             "agent-description":"drone_operator",
@@ -348,42 +428,44 @@ class MqttManager:
             "agent-uuid":self.operator_id,
             "levels":self.levels,
             "rate":self.rate,
-            "stamp":rounded_timestamp(),
             "type":"HeartBeat"
-            }
+            })
 
-        self.client.publish(f"{self.base_topic}/heartbeat", json.dumps(payload))
+    def send_direct_execution_info(self) -> None:
+        topic = f"{self.base_topic}/direct_execution_info"
+        self.outbound.publish(topic, stamped(self.direct_execution_info_body), coalesce=topic)
 
-    def send_position(self) -> None:
-        lat, lon = self.position
-        payload = { 
-            "latitude":lat,
-            "longitude":lon,
-            "altitude":0,
-            "type":"GeoPoint"
-        }
+    def send_heartbeat(self) -> None:
+        topic = f"{self.base_topic}/heartbeat"
+        self.outbound.publish(topic, stamped(self.heartbeat_body), coalesce=topic)
 
-        self.client.publish(f"{self.base_topic}/sensor/position", json.dumps(payload))
+    def send_position(self) -> None:
+        topic = f"{self.base_topic}/sensor/position"
+        self.outbound.publish(topic, self.position_payload, coalesce=topic)
 
     def send_feedback(self, payload) -> None:
-        self.client.publish(f"{self.base_topic}/exec/feedback", json.dumps(payload))
+        #A newer feedback of the same task supersedes a queued one
+        task_uuid = payload.get("task-uuid") if isinstance(payload, dict) else None
+        coalesce = ("feedback", task_uuid) if task_uuid is not None else None
+        self.outbound.publish(f"{self.base_topic}/exec/feedback", codec.dumps(payload), coalesce=coalesce)
 
     def send_response(self, payload) -> None:
-        self.client.publish(f"{self.base_topic}/exec/response", json.dumps(payload))
+        self.outbound.publish(f"{self.base_topic}/exec/response", codec.dumps(payload))
 
     def subscribe_to_list_of_agents(self, agent_list) -> None:
         for agent in agent_list:
             topic: str = f"waraps/unit/+/+/{agent}/#"
-            self.client.subscribe(topic)
+            self.subscriptions.add(topic)
             print(f"Subscribe to {topic}")
-            self.client.message_callback_add(agent, self.handle_command)
+            self.router.add(agent, self.handle_command)
+        self.subscriptions.flush() #One SUBSCRIBE for the whole team
     
     def handle_command(self, client, userdata, msg):
         try:
             print(f"New task received!")
             try:
                 json_str = msg.payload.decode("utf-8")
-                json_msg = json.loads(json_str)
+                json_msg = codec.loads(json_str)
                 print(json_msg)
             except json.JSONDecodeError:
                 payload: dict = dict()
@@ -417,9 +499,8 @@ class MqttManager:
             elif command == AgentCommand.SIGNAL_TASK:
                 signal = json_msg["signal"]
                 task_uuid = json_msg["task-uuid"]
-                try:
-                    task_to_handle: Task = next( (_task for _task in self.agent_manager.running_tasks if task_uuid == _task.task_uuid) ) #StopIteration
-                except StopIteration:
+                task_to_handle: Task = self.agent_manager.running_tasks.get(task_uuid)
+                if task_to_handle is None:
                     payload["response"] = "failed"
                     payload["fail-reason"] = "No agents is preforming this task"
                     self.send_response(payload)
@@ -453,23 +534,26 @@ class MqttManager:
                     return
 
                 task: Task = Task()
+                self.journal_task("received", json_msg, wait=True, task=json_msg)
 
-                if not self.task_queue.queue.full():
+                if not self.task_queue.full():
                     task.original_task = json_msg
-                    queue_priority = 1 #lower is better
-                    queue_item = TaskQueueItem(queue_priority, task)
+                    queue_item = TaskQueueItem(task_priority(json_msg), task, task_deadline(json_msg))
+                    self.journal_task("queued", json_msg, priority=queue_item.priority, deadline=queue_item.deadline)
                     self.task_queue.put_task_to_queue(queue_item)
                 else:  
                     print("QUEUE FULL")
                     if self.drone_operator_manager.children:
                         dummy_agent: Agent = Agent({"name": "Drone From Team Member"}) #This name is used in the functions check_internal_feedback & check__internal_response in agent_manager.py
                         task.agent = dummy_agent
+                        task.task_uuid = json_msg["task-uuid"]
                         task.plan_to_task(self, json_msg)
-                        self.agent_manager.running_tasks.append(task)
+                        self.agent_manager.running_tasks.add(task)
                         self.forward_task_to_team_member(json_msg)
                     else:
                         print("No agent was found to execute the task....")
                         print("Awaiting new task")
+                        self.journal_task("finished", json_msg, status="failed")
                         payload["response"] ="failed"
                         payload["fail-reason"] ="No agent was found to execute the task"
                         self.send_response(payload)
@@ -481,17 +565,24 @@ class MqttManager:
             self.send_response(payload)
             print(traceback.format_exc())
 
-    def search_and_create_agent(self, client, userdata, msg) -> None:
+    def search_and_create_agent(self, client, userdata, msg, agent_name: str = None, agent_attri: str = None) -> None:
         """Looks for the agent with the 'wildcard' topic and replaces it with a proper (no wildcard) topic and creatas a Agent object"""
         new_topic: str = msg.topic.replace("/heartbeat", "")
-        agent_name = msg.topic.split("/")[4] #name is always in 4th place if following the docs
-        json_msg = json.loads(msg.payload.decode("utf-8"))
+        if agent_name is None:
+            agent_name = msg.topic.split("/")[4] #name is always in 4th place if following the docs
+        json_msg = codec.loads(msg.payload)
 
         agent_type: str =json_msg["agent-type"]
+        #Heartbeats routed here before the route below is removed are handled on the same ingest worker, after the first one
+        if agent_type == "Drone_Operator":
+            if any(dop.name == json_msg["name"] for dop in self.drone_operator_manager.children):
+                return
+        elif self.agent_manager.get_agent_by_name(agent_name) is not None:
+            return
 
         unsubcribe_topic: str = f"waraps/unit/+/+/{agent_name}/heartbeat"
-        self.client.message_callback_remove(unsubcribe_topic)
-        self.client.unsubscribe(unsubcribe_topic)
+        self.router.remove(unsubcribe_topic)
+        self.subscriptions.unsubscribe(unsubcribe_topic)
         print(f"{unsubcribe_topic} -> {new_topic}")
         if agent_type == "Drone_Operator":
             data: dict  = {}
@@ -509,122 +600,251 @@ class MqttManager:
                     "busy": False
                 }
             self.subscribe_to_agent(meta_data)
-            self.agent_manager.create_new_agent(meta_data)
+            agent = self.agent_manager.create_new_agent(meta_data)
+            agent.heartbeat = json_msg #Starts the liveness tracking
+
+    def wake_dispatcher(self) -> None:
+        with self.dispatch_condition:
+            self.dispatch_wakeups += 1
+            self.dispatch_condition.notify_all()
 
     def handle_task(self) -> None: #Started in an other thread from main.py
+        """Dispatches the queued tasks, sleeps until a task is queued or an agent becomes idle or supports new tasks"""
+        dispatched_wakeups: int = None
         while True:
-            while not self.task_queue.queue.empty():
-                if any(agent.meta["busy"] == False for agent in self.agent_manager.all_agents):
-                    task_item: TaskQueueItem = self.task_queue.get_task_from_queue()
-                    task: Task = task_item.item
-                    self.current_working_task = task
-                    prio: int = task_item.priority
-                    task_name = task.original_task["task"]["name"]
-                    params = task.original_task["task"]["params"]
-                    selected_agent: Agent = self.agent_manager.select_closest_agent_that_is_non_busy(task_name, params)
-
-                    if selected_agent is not None:
-                        task.agent = selected_agent
-                        task.task_uuid = task.original_task["task-uuid"]
-                        waypoints: list[dict] = []
-                        
+            with self.dispatch_condition:
+                while self.dispatch_wakeups == dispatched_wakeups: #Nothing changed since the last try
+                    self.dispatch_condition.wait()
+                dispatched_wakeups = self.dispatch_wakeups
+
+            self.expire_tasks()
+            if self.batch_assignment:
+                if not self.task_queue.empty() and self.agent_manager.idle_agents and not self.handle_task_batch():
+                    return
+                continue
+
+            skipped: set = set()
+            while self.agent_manager.idle_agents:
+                task_item, selected_agent = self.take_dispatchable_task(skipped)
+                if task_item is None:
+                    break
+                self.current_working_task = task_item.item
+                if not self.dispatch_task(task_item.item, selected_agent):
+                    return
 
-                        if task_name == TaskName.MOVE_PATH:
-                            for wp in params["waypoints"]:
-                                lat = wp["latitude"]
-                                lon = wp["longitude"]
-                                waypoint = [lat, lon]
-                                waypoints.append(waypoint)
-
-                        elif task_name == TaskName.MOVE_TO:
-                            lat = task.original_task["task"]["params"]["waypoint"]["latitude"]
-                            lon = task.original_task["task"]["params"]["waypoint"]["longitude"]
-                            alt = task.original_task["task"]["params"]["waypoint"]["altitude"]
-
-                            waypoint = [lat, lon] 
-                            waypoints.append(waypoint)
-
-                        elif task_name == TaskName.SEARCH_AREA:
-                            for wp in params["area"]:
-                                lat = wp["latitude"]
-                                lon = wp["longitude"]
-                                waypoint = [lat, lon]
-                                waypoints.append(waypoint)
-
-                        else:
-                            raise TaskNotSupported #TODO fångas inte :(
-                        
+    def take_dispatchable_task(self, skipped: set) -> tuple:
+        """
+        Takes the first queued task that an idle agent supports and selects the agent for it, returns (TaskQueueItem, Agent)
+        or (None, None). Task names in 'skipped' are passed over, a task name no agent could be selected for is added
+        """
+        while True:
+            task_names: list = [name for name in self.task_queue.task_names()
+                                if name not in skipped and self.agent_manager.idle_agents_supporting(name)]
+            task_item: TaskQueueItem = self.task_queue.get_task_for(task_names)
+            if task_item is None:
+                return None, None
+            task: Task = task_item.item
+            task_name = task.original_task["task"]["name"]
+            params = task.original_task["task"]["params"]
+            selected_agent: Agent = self.agent_manager.select_agent_that_is_non_busy(task_name, params)
+            if selected_agent is not None:
+                return task_item, selected_agent
+            #NO AGENT TO DO THE TASK, tried again when an agent becomes idle
+            self.task_queue.put_task_to_queue(task_item, requeue=True)
+            skipped.add(task_name)
+
+    def handle_task_batch(self) -> bool:
+        """
+        Takes the first queued tasks of every task name, as many as there are idle agents that support it, and assigns
+        them to the non-busy agents all at once (min-cost matching), then sends the assigned tasks.
+        Tasks without an agent are put back in the queue. Returns False if the USSP failed
+        """
+        limits: dict = {}
+        for name in self.task_queue.task_names():
+            idle_agents = len(self.agent_manager.idle_agents_supporting(name))
+            if idle_agents:
+                limits[name] = idle_agents
+        task_items: list[TaskQueueItem] = self.task_queue.get_tasks_for(limits)
+        if not task_items:
+            return True
+        requests: list = [(item.item.original_task["task"]["name"], item.item.original_task["task"]["params"], item.priority) for item in task_items]
+        selected_agents: list = self.agent_manager.assign_agents_to_tasks(requests)
+
+        assigned: list = []
+        for task_item, selected_agent in zip(task_items, selected_agents):
+            if selected_agent is None: #NO AGENT TO DO THE TASK
+                self.task_queue.put_task_to_queue(task_item, requeue=True)
+            else:
+                assigned.append((task_item, selected_agent))
+
+        for index, (task_item, selected_agent) in enumerate(assigned):
+            self.current_working_task = task_item.item
+            if not self.dispatch_task(task_item.item, selected_agent):
+                for not_sent_item, agent in assigned[index + 1:]: #Release the agents of the tasks not sent
+                    self.agent_manager.set_busy(agent, False)
+                    self.task_queue.put_task_to_queue(not_sent_item, requeue=True)
+                return False
+        return True
+
+    def dispatch_task(self, task: Task, selected_agent: Agent) -> bool:
+        """Plans the task with the USSP and sends it to the selected agent. Returns False if the USSP failed"""
+        task.agent = selected_agent
+        task.task_uuid = task.original_task["task-uuid"]
+        self.journal_task("assigned", task.original_task, agent=selected_agent.meta["name"])
+        waypoints: list = self.task_waypoints(task, selected_agent)
+        payload_data: dict = self.ussp_payload_data()
+        try:
+            ##NEW##
+            USSP.request_height(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event)
+            USSP.request_plan(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event, waypoints, payload_data)
+            USSP.get_plan(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event, task.plan_id)
+            USSP.accept_plan(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event, task.plan_id)
+            USSP.activate_plan(self.outbound, f"{self.unique_ussp_topic}/command", self.ussp_event, task.plan_id)
+            task.plan_to_task(self, task.original_task)
+            self.journal_task("planned", task.original_task, plan_id=task.plan_id)
+            
+
+            ##old##
+            #the code for Zeromq
+            # task.ground_height = self.zmq_manager.request_height()
+            # request_plan_resp = self.zmq_manager.request_plan(waypoints, payload_data)
+            # task.set_plan_from_request(request_plan_resp)
+
+            # #print(f"Waiting for plan to active....")
+            # #time.sleep(request_plan_resp['delay'])
+
+            # task.ussp_plan = self.zmq_manager.get_plan(request_plan_resp)
+            # self.zmq_manager.accept_plan(request_plan_resp)
+            # self.zmq_manager.activate_plan(request_plan_resp)
+            # task.plan_to_task(self, task.original_task)
+            ##old END##
+
+        except zmq.ZMQError as e:
+            print("Could not communicate with USSP Service")
+            print(e)
+            self.ussp_failed(task, selected_agent)
+            return False
+
+        self.send_task_to_agent(task)
+        self.agent_manager.running_tasks.add(task)
+        self.current_working_task = None
+        return True
+
+    def task_waypoints(self, task: Task, selected_agent: Agent) -> list:
+        """Returns the [lat, lon] waypoints of the task to plan with the USSP, starting at the agent (except for 'search-area')"""
+        task_name = task.original_task["task"]["name"]
+        params = task.original_task["task"]["params"]
+        waypoints: list[dict] = []
+        
 
-                        #SPECIAL CASE FOR 'search-area' :(
-                        if task_name != TaskName.SEARCH_AREA:
+        if task_name == TaskName.MOVE_PATH:
+            for wp in params["waypoints"]:
+                lat = wp["latitude"]
+                lon = wp["longitude"]
+                waypoint = [lat, lon]
+                waypoints.append(waypoint)
 
-                            lat = selected_agent.position["latitude"]
-                            lon = selected_agent.position["longitude"]
-                            alt = selected_agent.position["altitude"]
+        elif task_name == TaskName.MOVE_TO:
+            lat = task.original_task["task"]["params"]["waypoint"]["latitude"]
+            lon = task.original_task["task"]["params"]["waypoint"]["longitude"]
+            alt = task.original_task["task"]["params"]["waypoint"]["altitude"]
 
-                            
-                            waypoint = [lat, lon]
-                            waypoints.insert(0, waypoint)
+            waypoint = [lat, lon] 
+            waypoints.append(waypoint)
 
-                        payload_data: dict = {
-                            "operator ID": self.operator_id,
-                            "UAS ID": self.uas_id,
-                            "EPSG": self.espg
-                        }
-                        try:
-                            ##NEW##
-                            USSP.request_height(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event)
-                            USSP.request_plan(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event, waypoints, payload_data)
-                            USSP.get_plan(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event, task.plan_id)
-                            USSP.accept_plan(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event, task.plan_id)
-                            USSP.activate_plan(self.client, f"{self.unique_ussp_topic}/command", self.ussp_event, task.plan_id)
-                            task.plan_to_task(self, task.original_task)
-                            
-
-                            ##old##
-                            #the code for Zeromq
-                            # task.ground_height = self.zmq_manager.request_height()
-                            # request_plan_resp = self.zmq_manager.request_plan(waypoints, payload_data)
-                            # task.set_plan_from_request(request_plan_resp)
-
-                            # #print(f"Waiting for plan to active....")
-                            # #time.sleep(request_plan_resp['delay'])
-
-                            # task.ussp_plan = self.zmq_manager.get_plan(request_plan_resp)
-                            # self.zmq_manager.accept_plan(request_plan_resp)
-                            # self.zmq_manager.activate_plan(request_plan_resp)
-                            # task.plan_to_task(self, task.original_task)
-                            ##old END##
-
-                        except zmq.ZMQError as e:
-                            payload = {
-                                "agent-uuid": self.operator_id,
-                                "com-uuid": task.original_task["com-uuid"],
-                                "fail-reason": "Could not communicate with USSP Service",
-                                "response": "failed",
-                                "response-to": task.original_task["com-uuid"],
-                                "task-uuid": task.original_task["task-uuid"]
-                            }
+        elif task_name == TaskName.SEARCH_AREA:
+            for wp in params["area"]:
+                lat = wp["latitude"]
+                lon = wp["longitude"]
+                waypoint = [lat, lon]
+                waypoints.append(waypoint)
 
-                            print("Could not communicate with USSP Service")
-                            print(e)
-                            selected_agent.meta["busy"] = False
-                            self.send_response(payload)
-                            return
+        else:
+            raise TaskNotSupported #TODO fångas inte :(
+        
 
-                        self.send_task_to_agent(task)
-                        self.agent_manager.running_tasks.append(task)
-                        self.current_working_task = None
+        #SPECIAL CASE FOR 'search-area' :(
+        if task_name != TaskName.SEARCH_AREA:
 
+            lat = selected_agent.position["latitude"]
+            lon = selected_agent.position["longitude"]
+            alt = selected_agent.position["altitude"]
 
-                    else: #NO AGENT TO DO THE TASK
-                        time.sleep(2)
-                        queue_item = TaskQueueItem(prio, task)
-                        self.task_queue.put_task_to_queue(queue_item)
-                else:
-                    time.sleep(2)
+            
+            waypoint = [lat, lon]
+            waypoints.insert(0, waypoint)
+        return waypoints
 
-            time.sleep(0.5)
+    def ussp_payload_data(self) -> dict:
+        return {
+            "operator ID": self.operator_id,
+            "UAS ID": self.uas_id,
+            "EPSG": self.espg
+        }
+
+    def ussp_failed(self, task: Task, selected_agent: Agent) -> None:
+        """Releases the agent and tells the sender of the task that it failed"""
+        self.agent_manager.set_busy(selected_agent, False)
+        self.send_task_failed(task, "Could not communicate with USSP Service")
+
+    def send_task_failed(self, task: Task, fail_reason: str) -> None:
+        """Tells the sender of the task that it failed"""
+        payload = {
+            "agent-uuid": self.operator_id,
+            "com-uuid": task.original_task["com-uuid"],
+            "fail-reason": fail_reason,
+            "response": "failed",
+            "response-to": task.original_task["com-uuid"],
+            "task-uuid": task.original_task["task-uuid"]
+        }
+        self.journal_task("finished", task.original_task, status="failed", fail_reason=fail_reason)
+        self.send_response(payload)
+
+    def journal_task(self, event: str, message: dict, wait: bool = False, **data) -> None:
+        """Journals the event of the task with the start-task 'message', if there is a task journal"""
+        if self.task_journal is not None:
+            self.task_journal.record(event, message["task-uuid"], wait, **data)
+
+    def recover_tasks(self) -> None:
+        """
+        Restores the tasks that had not finished when the operator stopped from the task journal. Tasks sent to an agent
+        are running again (the agent is taken over when it is seen), the others are queued again, also the ones that were
+        being planned with the USSP. Called once the publish pipeline is running, a task that does not fit in the queue
+        is published as failed
+        """
+        if self.task_journal is None:
+            return
+        running, queued = 0, 0
+        for task_uuid, records in self.task_journal.recovered.items():
+            events: dict = {record["event"]: record for record in records} #The last record of every event
+            task: Task = Task()
+            task.original_task = events["received"]["task"]
+            if records[-1]["event"] == "sent":
+                meta = dict(events["sent"]["agent"], busy=True)
+                task.agent = self.agent_manager.get_agent_by_name(meta["name"]) or Agent(meta)
+                task.task_uuid = task_uuid
+                task.plan_id = events.get("planned", {}).get("plan_id")
+                task.status = TaskStatus.RUNNING
+                self.agent_manager.running_tasks.add(task, record=False)
+                running += 1
+            elif self.task_queue.full():
+                self.send_task_failed(task, "The queue was full when the task was recovered")
+            else:
+                item: dict = events.get("queued", {})
+                queue_item = TaskQueueItem(item.get("priority", task_priority(task.original_task)), task,
+                                           item.get("deadline", task_deadline(task.original_task)))
+                self.task_queue.put_task_to_queue(queue_item)
+                queued += 1
+        self.task_journal.recovered.clear()
+        print(f"Recovered {running} running and {queued} queued tasks from the task journal")
+
+    def expire_tasks(self) -> list:
+        """Removes the queued tasks whose deadline has passed and tells their senders, returns the expired TaskQueueItems"""
+        expired: list = self.task_queue.expire()
+        for task_item in expired:
+            print(f"Task {task_item.item.original_task.get('task-uuid')} expired in the queue")
+            self.send_task_failed(task_item.item, "The deadline passed before an agent was available")
+        return expired
    
     def get_payload(self, tst_name: str) -> dict:
         task_payloads = {
@@ -653,7 +873,7 @@ class MqttManager:
             return task_payloads[tst_name]
 
     def ussp_connection_callback(self, client, userdata, msg):
-        message: dict = json.loads(msg.payload.decode("utf-8"))
+        message: dict = codec.loads(msg.payload)
         dop_name: str = message.get("name")
         ussp_topic: str = message.get("ussp_topic")
 
@@ -667,22 +887,25 @@ class MqttManager:
         if dop_name == self.operator_name:
             self.unique_ussp_topic = ussp_topic
 
-            self.client.unsubscribe(self.ussp_exec_topic)
+            self.subscriptions.unsubscribe(self.ussp_exec_topic)
 
-            self.client.subscribe(f"{self.unique_ussp_topic}/response")
+            self.subscriptions.subscribe([f"{self.unique_ussp_topic}/response"])
 
-            self.client.message_callback_add(f"{self.unique_ussp_topic}/response", self.handle_ussp)
+            self.router.add(f"{self.unique_ussp_topic}/response", self.handle_ussp)
             print("Connection to USSP established")
     
     def handle_ussp(self, client, userdata, msg):
         try:
-            message: dict = json.loads(msg.payload.decode("utf-8"))
-        except json.decoder.JSONDecodeError as e:
+            message: dict = codec.loads(msg.payload)
+        except json.JSONDecodeError as e:
             print(e)
             return
         reply = message.get("reply")
 
         print(reply)
+        if self.ussp_listener is not None: #Replies are awaited by the asyncio runtime
+            self.ussp_listener(message)
+            return
 
         if reply == "query ground height":
             print(f"'query ground height' response from server: \n {message}")
@@ -738,7 +961,7 @@ class MqttManager:
 
     def send_team_response(self, payload):
         #teams which is info about all existing teams belonging to the specific team manager
-        self.client.publish(f"{self.base_topic}/team/response", json.dumps(payload))
+        self.outbound.publish(f"{self.base_topic}/team/response", codec.dumps(payload))
 
 
 
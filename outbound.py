@@ -0,0 +1,145 @@
+import queue, time, traceback
+from threading import Lock, Thread
+from paho.mqtt.client import Client as PahoClient, MQTT_ERR_SUCCESS
+
+
+class TokenBucket():
+    '''Allows 'rate' messages per second on average and bursts of up to 'burst' messages, a rate of 0 allows everything'''
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate: float = rate
+        self.burst: float = max(burst, 1)
+        self.tokens: float = self.burst
+        self.updated: float = time.monotonic()
+
+    def wait(self) -> float:
+        """Takes a token, returns the seconds to wait before the message can be sent"""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class PublishPipeline():
+    '''
+    Every outgoing MQTT message goes through here instead of straight to paho. \n
+    The QoS is picked on the end of the topic ('qos_classes', like commands at 1 and telemetry at 0) and the messages
+    are sent in order by one thread, at most 'rate' messages per second (token bucket). The queue holds 'queue_size'
+    messages, when it is full new QoS 0 messages are dropped and the others wait for room.
+    A message published with a 'coalesce' key (like the topic of the heartbeat) replaces a queued message with the
+    same key, so superseded status messages are never sent. 'publish' has the arguments of paho's, so the pipeline
+    can be given to code that takes a client (USSP)
+    '''
+    def __init__(self, client: PahoClient, qos_classes: dict = None, rate: float = 0.0, burst: int = 100,
+                 queue_size: int = 1000) -> None:
+        self.client: PahoClient = client
+        #Longest suffix first, so "exec/response" is found before "response"
+        self.qos_classes: list = sorted(((f"/{suffix}", int(qos)) for suffix, qos in (qos_classes or {}).items()),
+                                        key=lambda item: len(item[0]), reverse=True)
+        self.qos_by_topic: dict = {}
+        self.bucket: TokenBucket = TokenBucket(rate, burst)
+        self.queue: queue.Queue = queue.Queue(queue_size)
+        self.pending: dict = {} #coalesce key -> queued item
+        self.lock: Lock = Lock() #Guards 'pending' and the metrics
+        self.thread: Thread = None
+        #Metrics
+        self.published: int = 0
+        self.dropped: int = 0
+        self.coalesced: int = 0
+        self.failed: int = 0 #Not accepted by paho, like QoS 0 messages while disconnected
+        self.max_depth: int = 0
+        self.latency_total: float = 0.0 #Seconds from 'publish' until the message was handed to paho
+        self.latency_max: float = 0.0
+
+    def start(self) -> None:
+        self.thread = Thread(target=self.__work, name="publish", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Sends the queued messages and waits for them"""
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def qos(self, topic: str) -> int:
+        qos = self.qos_by_topic.get(topic)
+        if qos is None:
+            qos = next((qos for suffix, qos in self.qos_classes if topic.endswith(suffix)), 0)
+            self.qos_by_topic[topic] = qos
+        return qos
+
+    def publish(self, topic: str, payload = None, qos: int = None, retain: bool = False, coalesce = None) -> bool:
+        """Queues the message, returns False if it was dropped"""
+        if qos is None:
+            qos = self.qos(topic)
+        item = [topic, payload, qos, retain, time.monotonic(), coalesce]
+        if coalesce is not None:
+            with self.lock:
+                queued = self.pending.get(coalesce)
+                if queued is not None: #Not sent yet, only the latest message is sent
+                    queued[1], queued[4] = payload, item[4]
+                    self.coalesced += 1
+                    return True
+                self.pending[coalesce] = item
+
+        try:
+            if qos == 0:
+                self.queue.put_nowait(item)
+            else:
+                self.queue.put(item) #Commands are not dropped, the caller waits for room
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            self.__forget(item)
+            return False
+
+        depth = self.queue.qsize()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def __forget(self, item: list) -> None:
+        if item[5] is None:
+            return
+        with self.lock:
+            if self.pending.get(item[5]) is item:
+                del self.pending[item[5]]
+
+    def metrics(self) -> dict:
+        with self.lock:
+            return {
+                "depth": self.queue.qsize(),
+                "max_depth": self.max_depth,
+                "published": self.published,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "failed": self.failed,
+                "latency_mean": self.latency_total / self.published if self.published else 0.0,
+                "latency_max": self.latency_max
+            }
+
+    def __work(self) -> None:
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            delay = self.bucket.wait()
+            if delay > 0:
+                time.sleep(delay)
+            self.__forget(item) #Later messages with the same key are queued again
+            topic, payload, qos, retain, queued_at = item[0], item[1], item[2], item[3], item[4]
+            try:
+                rc = self.client.publish(topic, payload, qos, retain).rc
+            except Exception:
+                print(traceback.format_exc())
+                rc = None
+            latency = time.monotonic() - queued_at
+            with self.lock:
+                if rc == MQTT_ERR_SUCCESS:
+                    self.published += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                else:
+                    self.failed += 1
@@ -1,6 +1,6 @@
 #!/bin/sh
 
-AGENT_MANAGER_TEST_CLASS="agent_manager_test.py"
-echo -e "Starting tests from test class(es): $AGENT_MANAGER_TEST_CLASS \n"
+TEST_CLASSES="*_test.py"
+echo -e "Starting tests from test class(es): $TEST_CLASSES \n"
 
-python -m unittest tests/$AGENT_MANAGER_TEST_CLASS
+python -m unittest discover -s tests -p "$TEST_CLASSES"
@@ -0,0 +1,73 @@
+import math
+from itertools import product
+
+EARTH_RADIUS_KM: float = 6371.0
+
+class SpatialGrid():
+    '''
+    Uniform grid of cubes over the unit sphere, used to find agents close to a position without looking at the whole fleet. \n
+    Points are stored as 3D unit vectors, the straight line (chord) distance between two points grows with the
+    great circle distance. A point in a cell 'r + 1' cells away from the cell of the query is more than 'r * cell_size' away
+    '''
+    def __init__(self, cell_size_km: float = 10.0) -> None:
+        self.cell_size: float = cell_size_km / EARTH_RADIUS_KM
+        self.cells: dict[tuple, set[int]] = {} #cell -> slots
+        self.slot_cells: dict[int, tuple] = {} #slot -> cell
+
+    def cell_of(self, lat: float, lon: float) -> tuple:
+        """Returns the cell of a position (radians)"""
+        cos_lat = math.cos(lat)
+        return (math.floor(cos_lat * math.cos(lon) / self.cell_size),
+                math.floor(cos_lat * math.sin(lon) / self.cell_size),
+                math.floor(math.sin(lat) / self.cell_size))
+
+    def update(self, slot: int, lat: float, lon: float) -> None:
+        """Moves the slot to the cell of the position (radians), a NaN position removes the slot"""
+        if math.isnan(lat) or math.isnan(lon):
+            self.remove(slot)
+            return
+
+        cell = self.cell_of(lat, lon)
+        old_cell = self.slot_cells.get(slot)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self.__discard(old_cell, slot)
+        self.cells.setdefault(cell, set()).add(slot)
+        self.slot_cells[slot] = cell
+
+    def remove(self, slot: int) -> None:
+        old_cell = self.slot_cells.pop(slot, None)
+        if old_cell is not None:
+            self.__discard(old_cell, slot)
+
+    def __discard(self, cell: tuple, slot: int) -> None:
+        slots = self.cells[cell]
+        slots.discard(slot)
+        if not slots:
+            del self.cells[cell]
+
+    def shell(self, center: tuple, r: int):
+        """Yields the slots in the cells exactly 'r' cells away (Chebyshev distance) from the center cell"""
+        cx, cy, cz = center
+        for dx, dy in product(range(-r, r + 1), repeat=2):
+            #Only the faces of the cube, the inside has already been visited
+            dzs = range(-r, r + 1) if abs(dx) == r or abs(dy) == r else (-r, r)
+            for dz in dzs:
+                slots = self.cells.get((cx + dx, cy + dy, cz + dz))
+                if slots:
+                    yield from slots
+
+    def outside(self, center: tuple, r: int):
+        """Yields the slots in all occupied cells 'r' or more cells away from the center cell"""
+        for cell, slots in self.cells.items():
+            if self.distance(center, cell) >= r:
+                yield from slots
+
+    def shell_is_larger_than_grid(self, r: int) -> bool:
+        """True when walking the occupied cells is cheaper than walking the cube of radius 'r'"""
+        return (2 * r + 1) ** 3 > len(self.cells)
+
+    @staticmethod
+    def distance(cell_a: tuple, cell_b: tuple) -> int:
+        return max(abs(cell_a[0] - cell_b[0]), abs(cell_a[1] - cell_b[1]), abs(cell_a[2] - cell_b[2]))
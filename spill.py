@@ -0,0 +1,65 @@
+import glob, mmap, os, tempfile
+
+PREFIX: str = "tasks-"
+SUFFIX: str = ".spill"
+
+
+def remove_spill_files(directory: str) -> int:
+    """Removes the spill files left in the directory by an earlier run, returns how many"""
+    paths = glob.glob(os.path.join(glob.escape(directory), f"{PREFIX}*{SUFFIX}"))
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return len(paths)
+
+
+class SpillFile():
+    '''
+    Append-only file on local disk for records that do not fit in memory. \n
+    Records are appended with 'append' and read back through a memory map with 'read', the index (offset and length of
+    every record) is kept by the caller. The file is emptied with 'clear' once none of its records are needed anymore
+    '''
+    def __init__(self, directory: str = None) -> None:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix=PREFIX, suffix=SUFFIX, dir=directory or None)
+        self.file = os.fdopen(fd, "w+b")
+        self.size: int = 0
+        self.map: mmap.mmap = None #Maps the first 'len(self.map)' bytes, mapped again when a record is read beyond it
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, record: bytes) -> tuple:
+        """Appends the record, returns its (offset, length)"""
+        offset = self.size
+        self.file.seek(offset)
+        self.file.write(record)
+        self.size += len(record)
+        return offset, len(record)
+
+    def read(self, offset: int, length: int) -> bytes:
+        if self.map is None or offset + length > len(self.map):
+            self.file.flush()
+            if self.map is not None:
+                self.map.close()
+            self.map = mmap.mmap(self.file.fileno(), self.size, access=mmap.ACCESS_READ)
+        return self.map[offset:offset + length]
+
+    def clear(self) -> None:
+        """Drops every record"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.truncate(0)
+        self.size = 0
+
+    def close(self) -> None:
+        """Closes and removes the file"""
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+        os.remove(self.path)
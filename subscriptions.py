@@ -0,0 +1,103 @@
+import time
+from threading import Lock
+from paho.mqtt.client import Client as PahoClient, MQTT_ERR_SUCCESS
+
+
+class Subscriptions():
+    '''
+    Keeps every topic the operator is subscribed to and sends them as multi-topic SUBSCRIBE packets. \n
+    Topics are gathered with 'add' and sent with 'flush', at most 'chunk_size' topics per packet (the broker limit).
+    After a (re)connect 'restore' subscribes to all of them again in one batch, the time until the broker has
+    acknowledged all of them is kept in 'ready_time'
+    '''
+    def __init__(self, client: PahoClient, chunk_size: int = 100) -> None:
+        self.client: PahoClient = client
+        self.chunk_size: int = max(chunk_size, 1)
+        self.topics: dict = {} #topic -> qos, everything to subscribe to after a reconnect
+        self.pending: dict = {} #topic -> qos, added but not sent yet
+        self.outstanding: set = set() #mids of the SUBSCRIBE packets that are not acknowledged yet
+        self.acknowledged: set = set() #mids acknowledged before 'flush' recorded them
+        self.lock: Lock = Lock()
+        self.restored_at: float = None
+        self.ready_time: float = None #Seconds from 'restore' until all topics were acknowledged
+        self.packets: int = 0 #SUBSCRIBE packets sent since the last 'restore'
+        self.flushing: int = 0 #Flushes sending packets, not ready before they are done
+
+    def __len__(self) -> int:
+        return len(self.topics)
+
+    def __contains__(self, topic: str) -> bool:
+        return topic in self.topics
+
+    def add(self, topic: str, qos: int = 0) -> None:
+        """Gathers a topic for the next 'flush'"""
+        with self.lock:
+            if self.topics.get(topic) == qos:
+                return
+            self.topics[topic] = qos
+            self.pending[topic] = qos
+
+    def subscribe(self, topics, qos: int = 0) -> None:
+        """Adds the topics and sends them"""
+        for topic in topics:
+            self.add(topic, qos)
+        self.flush()
+
+    def unsubscribe(self, topic: str) -> None:
+        with self.lock:
+            self.topics.pop(topic, None)
+            self.pending.pop(topic, None)
+        self.client.unsubscribe(topic)
+
+    def restore(self) -> None:
+        """Sends all topics again, called when the client has (re)connected"""
+        with self.lock:
+            self.pending = dict(self.topics)
+            self.restored_at = time.monotonic()
+            self.ready_time = None
+            self.packets = 0
+            self.outstanding.clear()
+            self.acknowledged.clear()
+        self.flush()
+
+    def flush(self) -> int:
+        """Sends the gathered topics, returns the number of SUBSCRIBE packets"""
+        with self.lock:
+            if not self.pending or not self.client.is_connected():
+                return 0 #Kept in 'pending' and sent by 'restore' on connect
+            topics = list(self.pending.items())
+            self.pending = {}
+            self.flushing += 1
+
+        packets = 0
+        for i in range(0, len(topics), self.chunk_size):
+            rc, mid = self.client.subscribe(topics[i:i + self.chunk_size])
+            if rc != MQTT_ERR_SUCCESS:
+                print(f"Could not subscribe to {len(topics) - i} topics: {rc}")
+                break
+            packets += 1
+            with self.lock:
+                if mid in self.acknowledged:
+                    self.acknowledged.discard(mid)
+                else:
+                    self.outstanding.add(mid)
+        with self.lock:
+            self.packets += packets
+            self.flushing -= 1
+        self.__check_ready()
+        return packets
+
+    def on_subscribe(self, client, userdata, mid, granted_qos, properties = None) -> None:
+        with self.lock:
+            if mid in self.outstanding:
+                self.outstanding.discard(mid)
+            else:
+                self.acknowledged.add(mid)
+        self.__check_ready()
+
+    def __check_ready(self) -> None:
+        with self.lock:
+            if self.restored_at is None or self.ready_time is not None or self.outstanding or self.pending or self.flushing:
+                return
+            self.ready_time = time.monotonic() - self.restored_at
+        print(f"Subscribed to {len(self.topics)} topics in {self.ready_time * 1000:.1f} ms ({self.packets} SUBSCRIBE packets)")
@@ -1,9 +1,12 @@
 from dataclasses import dataclass, field
 from typing import Any
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import Enum
-import json, os
-from queue import PriorityQueue
+import heapq, time
+from threading import Condition, RLock
+import codec
+from spill import SpillFile, remove_spill_files
+from journal import TaskJournal
 
 class TaskStatus(Enum):
     NONE = None
@@ -28,7 +31,8 @@ class Task():
         self.json = None
         self._ground_height: int = None
         self.waypoints: list = None
-        self.status: TaskStatus = TaskStatus.NONE
+        self.running_tasks: RunningTasks = None #Set while the task is in a RunningTasks table
+        self._status: TaskStatus = TaskStatus.NONE
         
         #request_plan
         self.plan_id: str = None
@@ -40,6 +44,18 @@ class Task():
         
 
 
+    @property
+    def status(self) -> TaskStatus:
+        return self._status
+
+    @status.setter
+    def status(self, status: TaskStatus):
+        running_tasks = self.running_tasks
+        if running_tasks is not None:
+            running_tasks.set_status(self, status)
+        else:
+            self._status = status
+
     @property
     def ground_height(self):
         return self._ground_height
@@ -160,46 +176,373 @@ class Task():
             print("Plan -> Task !DONE!")
             return waraps_task
 
-    def make_json(self) -> dict:
-        item: dict = {}
-        item["ground_height"] = self.ground_height
-        item["status"] = self.status
-        item["plan_id"] = self.plan_id
-        item["task_made"] = str(self.task_made)
-        item["task_completed"] = str(self.task_completed)
-        item["delay"] = self.delay
-        item["ussp_plan"] = self.ussp_plan
-        item["agent"] = self.agent.meta["name"]
-        item["waraps_task"] = self.waraps_task
-        return item
-
-    def save_task_to_log(self):
-        try:
-            time_str = str(datetime.utcnow())
-            file_name = time_str.replace(":", "-")
-            file_name = file_name + ".json"
-            file = self.make_json()
-            with open(f"./logs/{file_name}", "w") as f:
-                f.write(json.dumps(file))
-        except FileNotFoundError:
-            file_path = "./logs/"
-            os.makedirs(os.path.dirname(file_path), exist_ok=True)
-            with open(f"./logs/{file_name}", "w") as f:
-                f.write(json.dumps(file))
-
 @dataclass(order=True)
 class TaskQueueItem:
-    priority: int
+    priority: int #Lower is better
     item: Any=field(compare=False)
+    deadline: float=field(default=None, compare=False) #Unix time the task has to be dispatched by, None for no deadline
+    #Set by the TaskQueue the first time the item is queued, so a task that is put back keeps its place
+    queued_at: float=field(default=None, compare=False)
+    sequence: int=field(default=None, compare=False)
+    entry: list=field(default=None, compare=False, repr=False) #Heap entry while the item is queued
+    #(generation, offset, length) of the task in the spill file, 'item' is None while it is spilled. Kept when the task is
+    #read back, so a task that is put back is not written again
+    spilled: tuple=field(default=None, compare=False, repr=False)
+
+
+def task_priority(message: dict, default: int = 1) -> int:
+    """The 'priority' of a start-task message, lower is better"""
+    try:
+        return int(message.get("priority", default))
+    except (TypeError, ValueError):
+        print(f"Invalid task priority: {message.get('priority')}")
+        return default
+
+
+def task_deadline(message: dict) -> float:
+    """The 'deadline' of a start-task message as Unix time, given as Unix time or ISO 8601 (UTC if it has no time zone). None if there is none"""
+    deadline = message.get("deadline")
+    if deadline is None:
+        return None
+    try:
+        if isinstance(deadline, str):
+            deadline = datetime.fromisoformat(deadline)
+            if deadline.tzinfo is None:
+                deadline = deadline.replace(tzinfo=timezone.utc)
+            return deadline.timestamp()
+        return float(deadline)
+    except (TypeError, ValueError):
+        print(f"Invalid task deadline: {deadline}")
+        return None
+
+SPILL_COMPACT_BYTES: int = 1024 * 1024 #Dead bytes in the spill file before it is compacted
 
 class TaskQueue():
-    def __init__(self, _maxsize: int = 10) -> None:
-        self.queue: PriorityQueue[Task] = PriorityQueue(maxsize=_maxsize)
+    '''
+    Queued tasks partitioned by task name, each partition in priority order (lower is better, first in first out on equal priority). \n
+    The dispatcher takes tasks only from the partitions that an idle agent supports ('get_task_for'), so a task no agent
+    can run does not hold back the tasks behind it. '_maxsize' bounds the number of tasks in all partitions together. \n
+    A task moves up one priority level for every 'aging' seconds it has waited (0 turns it off), so less important tasks
+    do not starve. As every task ages at the same pace this is part of the heap order, and 'expire' removes the tasks
+    whose deadline has passed with a heap of deadlines. Every operation is O(log n), removed entries are skipped when they
+    reach the top of a heap. \n
+    At most 'memory_size' tasks are kept in memory, the worst ones are written to a SpillFile in 'spill_directory' and only
+    their place in the order is kept. The best spilled tasks are read back as room frees up (0 keeps every task in memory).
+    The spill file is written again without the tasks that have left the Queue once they take more than half of it
+    (and SPILL_COMPACT_BYTES), spill files left by an earlier run in 'spill_directory' are removed
+    '''
+    def __init__(self, _maxsize: int = 10, aging: float = 0.0, memory_size: int = 0, spill_directory: str = None) -> None:
+        self.maxsize: int = _maxsize
+        self.aging: float = aging
+        self.memory_size: int = memory_size
+        self.spill_directory: str = spill_directory
+        self.spill_file: SpillFile = None #Created when the first task is spilled
+        self.partitions: dict[str, list] = {} #task name -> heap of [order, sequence, TaskQueueItem, task name]
+        self.counts: dict[str, int] = {} #task name -> queued tasks
+        self.deadlines: list = [] #heap of (deadline, sequence, entry)
+        self.spilled: list = [] #heap of the entries of the spilled tasks, best on top
+        self.resident: list = [] #heap of [-order, -sequence, entry] of the tasks in memory, worst on top
+        self.spill_generation: int = 0 #Counted up when the spill file is emptied or written again, older locations are not valid
+        self.spill_live: int = 0 #Bytes of the spill file that hold queued tasks
+        self.size: int = 0
+        self.loaded: int = 0 #Queued tasks in memory
+        self.sequence: int = 0
+        self.condition: Condition = Condition()
+        self.listeners: list = [] #Called without arguments when a task is put into the Queue, wakes the task dispatcher
+        if spill_directory and memory_size > 0:
+            remove_spill_files(spill_directory)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def empty(self) -> bool:
+        return self.size == 0
+
+    def full(self) -> bool:
+        return 0 < self.maxsize <= self.size
+
+    def put_task_to_queue(self, item: TaskQueueItem, requeue: bool = False):
+        """
+        Puts a TaskQueueItem into the Queue, waits for room if it is full. 'requeue' is True when the dispatcher puts back
+        a task it took and could not assign, it is put back even if the Queue is full and the listeners are not called
+        """
+        with self.condition:
+            while not requeue and self.full():
+                self.condition.wait()
+            if item.queued_at is None:
+                item.queued_at = time.monotonic()
+            if item.sequence is None:
+                item.sequence = self.sequence
+                self.sequence += 1
+            #Waiting 'aging' seconds weighs as much as one priority level
+            order = item.priority * self.aging + item.queued_at if self.aging > 0 else item.priority
+            task_name = item.item.original_task["task"]["name"]
+            entry = [order, item.sequence, item, task_name]
+            item.entry = entry
+            heapq.heappush(self.partitions.setdefault(task_name, []), entry)
+            self.counts[task_name] = self.counts.get(task_name, 0) + 1
+            if item.deadline is not None:
+                heapq.heappush(self.deadlines, (item.deadline, item.sequence, entry))
+            self.size += 1
+            self.loaded += 1
+            if self.__spill_valid(item): #Put back, its task is still in the spill file
+                self.spill_live += item.spilled[2]
+            heapq.heappush(self.resident, [-order, -item.sequence, entry])
+            if 0 < self.memory_size < self.loaded:
+                self.__spill(self.__pop_worst())
+            self.condition.notify_all()
+        if not requeue:
+            for listener in self.listeners:
+                listener()
+
+    def task_names(self) -> list[str]:
+        """Names of the tasks in the Queue"""
+        with self.condition:
+            return list(self.counts)
 
-    def put_task_to_queue(self, item: TaskQueueItem):
-        """Puts a TaskQueueItem into the Queue"""
-        self.queue.put(item)
+    def get_task_for(self, task_names) -> TaskQueueItem:
+        """Removes and returns the first TaskQueueItem of the given task names, None if there is none"""
+        with self.condition:
+            heads = [self.partitions[name][0] for name in task_names if name in self.counts]
+            if not heads:
+                return None
+            entry = min(heads)
+            heapq.heappop(self.partitions[entry[3]])
+            return self.__remove(entry)
+
+    def get_tasks_for(self, limits: dict) -> list[TaskQueueItem]:
+        """Removes and returns up to 'limit' of the first TaskQueueItems of every task name in 'limits' (task name -> limit)"""
+        items: list[TaskQueueItem] = []
+        with self.condition:
+            for task_name, limit in limits.items():
+                for _ in range(limit):
+                    item = self.get_task_for((task_name,))
+                    if item is None:
+                        break
+                    items.append(item)
+        return items
 
     def get_task_from_queue(self) -> TaskQueueItem:
-        """Return the first TaskQueueItem from the Queue"""
-        return self.queue.get()
\ No newline at end of file
+        """Return the first TaskQueueItem from the Queue, waits for one if it is empty"""
+        with self.condition:
+            while self.empty():
+                self.condition.wait()
+            return self.get_task_for(list(self.counts))
+
+    def get_all_tasks_from_queue(self) -> list[TaskQueueItem]:
+        """Removes and returns every TaskQueueItem in the Queue, in priority order"""
+        with self.condition:
+            entries = sorted(entry for heap in self.partitions.values() for entry in heap if entry[2].entry is entry)
+            for entry in entries:
+                self.__load(entry[2])
+                entry[2].entry = None
+            self.partitions.clear()
+            self.counts.clear()
+            self.deadlines.clear()
+            self.spilled.clear()
+            self.resident.clear()
+            self.size = self.loaded = 0
+            self.__clear_spill_file()
+            self.condition.notify_all()
+            return [entry[2] for entry in entries]
+
+    def expire(self, now: float = None) -> list[TaskQueueItem]:
+        """Removes and returns the TaskQueueItems whose deadline has passed"""
+        now = time.time() if now is None else now
+        expired: list[TaskQueueItem] = []
+        with self.condition:
+            while self.deadlines and self.deadlines[0][0] <= now:
+                entry = heapq.heappop(self.deadlines)[2]
+                if entry[2].entry is entry: #Still queued
+                    expired.append(self.__remove(entry))
+        return expired
+
+    def close(self) -> None:
+        """Removes the spill file"""
+        with self.condition:
+            if self.spill_file is not None:
+                self.spill_file.close()
+                self.spill_file = None
+                self.spill_generation += 1
+
+    def __remove(self, entry: list) -> TaskQueueItem:
+        """Takes the entry out of the counts, it is left in the heaps and skipped when it reaches the top"""
+        item: TaskQueueItem = entry[2]
+        self.__load(item)
+        item.entry = None
+        if self.__spill_valid(item):
+            self.spill_live -= item.spilled[2]
+        task_name = entry[3]
+        self.counts[task_name] -= 1
+        heap = self.partitions[task_name]
+        while heap and heap[0][2].entry is not heap[0]:
+            heapq.heappop(heap)
+        if not self.counts[task_name]:
+            del self.counts[task_name]
+            del self.partitions[task_name]
+        self.size -= 1
+        self.loaded -= 1
+        self.__reload()
+        self.__prune()
+        self.condition.notify_all()
+        return item
+
+    def __spill_valid(self, item: TaskQueueItem) -> bool:
+        """If the task of the item is in the current spill file"""
+        return item.spilled is not None and item.spilled[0] == self.spill_generation
+
+    def __pop_worst(self) -> list:
+        """Removes and returns the entry of the worst task in memory"""
+        while True:
+            entry = heapq.heappop(self.resident)[2]
+            if entry[2].entry is entry and entry[2].item is not None:
+                return entry
+
+    def __spill(self, entry: list) -> None:
+        """Writes the task of the entry to the spill file, unless it is there from before"""
+        item: TaskQueueItem = entry[2]
+        if not self.__spill_valid(item):
+            if self.spill_file is None:
+                self.spill_file = SpillFile(self.spill_directory)
+            item.spilled = (self.spill_generation, *self.spill_file.append(codec.dumps(item.item.original_task)))
+            self.spill_live += item.spilled[2]
+        item.item = None
+        heapq.heappush(self.spilled, entry)
+        self.loaded -= 1
+
+    def __load(self, item: TaskQueueItem) -> None:
+        """Reads the task of a spilled item back into memory"""
+        if item.item is not None:
+            return
+        task = Task()
+        task.original_task = codec.loads(self.spill_file.read(*item.spilled[1:]))
+        item.item = task
+        self.loaded += 1
+
+    def __reload(self) -> None:
+        """Reads the best spilled tasks back while there is room in memory"""
+        while self.spilled and (self.memory_size <= 0 or self.loaded < self.memory_size):
+            entry = heapq.heappop(self.spilled)
+            if entry[2].entry is entry and entry[2].item is None: #Still queued and spilled
+                self.__load(entry[2])
+                heapq.heappush(self.resident, [-entry[0], -entry[1], entry])
+        if not self.spilled:
+            self.__clear_spill_file()
+
+    def __prune(self) -> None:
+        """Drops the entries of removed tasks from the heaps of the tasks in memory and on disk, and compacts the spill file"""
+        if len(self.resident) > 2 * self.loaded + 64:
+            self.resident = [top for top in self.resident if top[2][2].entry is top[2] and top[2][2].item is not None]
+            heapq.heapify(self.resident)
+        spilled = self.size - self.loaded
+        if len(self.spilled) > 2 * spilled + 64:
+            self.spilled = list({id(entry): entry for entry in self.spilled
+                                 if entry[2].entry is entry and entry[2].item is None}.values())
+            heapq.heapify(self.spilled)
+        if self.spill_file is not None and len(self.spill_file) - self.spill_live > max(self.spill_live, SPILL_COMPACT_BYTES):
+            self.__compact()
+
+    def __compact(self) -> None:
+        """Writes the spilled tasks to a new spill file and removes the old one"""
+        old_file, self.spill_file = self.spill_file, SpillFile(self.spill_directory)
+        old_generation = self.spill_generation
+        self.spill_generation += 1
+        self.spill_live = 0
+        entries: dict = {}
+        for entry in self.spilled:
+            item: TaskQueueItem = entry[2]
+            if entry[2].entry is entry and item.item is None and item.spilled[0] == old_generation:
+                record = old_file.read(*item.spilled[1:])
+                item.spilled = (self.spill_generation, *self.spill_file.append(record))
+                self.spill_live += item.spilled[2]
+                entries[id(entry)] = entry
+        old_file.close()
+        self.spilled = list(entries.values())
+        heapq.heapify(self.spilled)
+
+    def __clear_spill_file(self) -> None:
+        if self.spill_file is not None and len(self.spill_file):
+            self.spill_file.clear()
+            self.spill_generation += 1
+            self.spill_live = 0
+
+class RunningTasks():
+    """
+    Tasks sent to agents, indexed by task-uuid and by the name of the agent. Keeps a count of tasks per TaskStatus.
+    Adding a task journals it as "sent" and removing it as "finished", if there is a 'journal'.
+    Used from the ingest workers, the task dispatcher and the command handler, every method takes 'lock'
+    """
+    def __init__(self) -> None:
+        self.tasks: dict[str, Task] = {} #task-uuid -> Task
+        self.tasks_by_agent: dict[str, dict[str, Task]] = {} #agent name -> task-uuid -> Task
+        self.status_counts: dict[TaskStatus, int] = {status: 0 for status in TaskStatus}
+        self.journal: TaskJournal = None
+        self.lock: RLock = RLock()
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.tasks)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.tasks.values()))
+
+    def __contains__(self, task: Task) -> bool:
+        with self.lock:
+            return self.tasks.get(task.task_uuid) is task
+
+    def add(self, task: Task, record: bool = True) -> None:
+        """Adds a task, a task with the same task-uuid is replaced. 'record' is False for a task recovered from the journal"""
+        with self.lock:
+            old_task = self.tasks.get(task.task_uuid)
+            if old_task is not None:
+                self.remove(old_task, record=False)
+            if record and self.journal is not None:
+                agent_meta = task.agent.meta if task.agent is not None else {}
+                self.journal.record("sent", task.task_uuid, agent={key: agent_meta[key] for key in ("name", "base_topic", "agent-uuid") if key in agent_meta})
+            self.tasks[task.task_uuid] = task
+            self.tasks_by_agent.setdefault(self.__agent_name(task), {})[task.task_uuid] = task
+            task.running_tasks = self
+            self.status_counts[task.status] += 1
+
+    def get(self, task_uuid: str) -> Task:
+        """Returns the task with the task-uuid, None if there is no such task"""
+        with self.lock:
+            return self.tasks.get(task_uuid)
+
+    def remove(self, task: Task, record: bool = True) -> None:
+        """Removes the task, does nothing if the task is not in the table. 'record' is False for a task that is replaced"""
+        with self.lock:
+            if self.tasks.get(task.task_uuid) is not task:
+                return
+            del self.tasks[task.task_uuid]
+            agent_name = self.__agent_name(task)
+            agent_tasks = self.tasks_by_agent[agent_name]
+            del agent_tasks[task.task_uuid]
+            if not agent_tasks:
+                del self.tasks_by_agent[agent_name]
+            task.running_tasks = None
+            self.status_counts[task.status] -= 1
+            if record and self.journal is not None:
+                self.journal.record("finished", task.task_uuid, status=task.status.name)
+
+    def tasks_for_agent(self, agent_name: str) -> list[Task]:
+        """Returns the tasks sent to the agent"""
+        with self.lock:
+            return list(self.tasks_by_agent.get(agent_name, {}).values())
+
+    def count(self, status: TaskStatus) -> int:
+        with self.lock:
+            return self.status_counts[status]
+
+    def set_status(self, task: Task, status: TaskStatus) -> None:
+        """Called by Task when its status changes, changes it and the counts together"""
+        with self.lock:
+            if self.tasks.get(task.task_uuid) is task:
+                self.status_counts[task._status] -= 1
+                self.status_counts[status] += 1
+            task._status = status
+
+    @staticmethod
+    def __agent_name(task: Task) -> str:
+        return task.agent.meta["name"] if task.agent is not None else None
@@ -0,0 +1,70 @@
+import math
+import numpy as np
+from spatial_index import EARTH_RADIUS_KM
+
+STAMP, LATITUDE, LONGITUDE, ALTITUDE, SPEED = range(5) #Columns of a sample
+
+class TelemetryHistory():
+    '''
+    Fixed size ring buffer of timestamped samples (stamp, latitude, longitude, altitude, speed) for one agent. \n
+    Every sample is written twice, 'capacity' rows apart, so the latest samples are always one contiguous slice
+    and can be returned as views without copying. Memory does not grow with the number of samples
+    '''
+    def __init__(self, capacity: int = 120) -> None:
+        self.capacity: int = capacity
+        self.samples: np.ndarray = np.full((2 * capacity, 5), np.nan)
+        self.head: int = 0 #Row of the next sample (0 <= head < capacity)
+        self.count: int = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def append(self, stamp: float, latitude: float, longitude: float, altitude: float, speed: float) -> None:
+        sample = (stamp, latitude, longitude, altitude, speed)
+        self.samples[self.head] = sample
+        self.samples[self.head + self.capacity] = sample
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self, n: int = None) -> np.ndarray:
+        """Returns a view of the latest 'n' samples (all if None), oldest first"""
+        n = self.count if n is None else min(n, self.count)
+        end = self.head + self.capacity
+        return self.samples[end - n:end]
+
+    def last_seconds(self, seconds: float, now: float = None) -> np.ndarray:
+        """Returns a view of the samples from the last 'seconds' before 'now' (the latest sample if None), oldest first"""
+        samples = self.latest()
+        if not len(samples):
+            return samples
+        if now is None:
+            now = samples[-1, STAMP]
+        start = np.searchsorted(samples[:, STAMP], now - seconds, side="left")
+        return samples[start:]
+
+    def downsample(self, interval: float, seconds: float = None) -> np.ndarray:
+        """Returns a copy with the latest sample in every 'interval' seconds, from the last 'seconds' (all if None)"""
+        samples = self.latest() if seconds is None else self.last_seconds(seconds)
+        if not len(samples):
+            return samples.copy()
+        bins = np.floor(samples[:, STAMP] / interval)
+        last_in_bin = np.append(bins[1:] != bins[:-1], True)
+        return samples[last_in_bin]
+
+    def velocity(self, seconds: float) -> tuple:
+        """
+        Estimates (speed m/s, course degrees) from the first and the last sample in the last 'seconds'.
+        Returns (NaN, NaN) if there is not enough history
+        """
+        samples = self.last_seconds(seconds)
+        if len(samples) < 2 or samples[-1, STAMP] <= samples[0, STAMP]:
+            return math.nan, math.nan
+
+        lat1, lon1 = np.radians(samples[0, LATITUDE]), np.radians(samples[0, LONGITUDE])
+        lat2, lon2 = np.radians(samples[-1, LATITUDE]), np.radians(samples[-1, LONGITUDE])
+        dlat, dlon = lat2 - lat1, lon2 - lon1
+        a = np.sin(dlat / 2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2.0)**2
+        meters = 2 * EARTH_RADIUS_KM * 1000.0 * np.arcsin(np.sqrt(a))
+        course = np.degrees(np.arctan2(np.sin(dlon) * np.cos(lat2),
+                                       np.cos(lat1) * np.sin(lat2) - np.sin(lat1) * np.cos(lat2) * np.cos(dlon))) % 360.0
+        return float(meters / (samples[-1, STAMP] - samples[0, STAMP])), float(course)
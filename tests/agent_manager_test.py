@@ -1,3 +1,4 @@
+import random
 import unittest
 from agent_manager import AgentManager
 
@@ -63,6 +64,194 @@ class AgentManagerTests(unittest.TestCase):
         self.assertEqual(agent_move_to.position["latitude"], 57.8611363)
         self.assertEqual(agent_move_to.position["longitude"], 16.7805011)
 
+    def test_agent_registry_lookup_and_remove(self):
+        close_agent, far_away_agent, agent_manager = self.__setup_two_agents_and_agent_manager()
+
+        self.assertIs(agent_manager.get_agent_by_name("name1"), close_agent)
+        self.assertIs(agent_manager.get_agent_by_uuid("5c2bb680-d780-11ec-9d64-0242ac120002"), far_away_agent)
+
+        # Assert that an agent that reconnects replaces the old one
+        new_agent = agent_manager.create_new_agent(dict(close_agent.meta))
+        self.assertIs(agent_manager.get_agent_by_name("name1"), new_agent)
+        self.assertEqual(len(agent_manager.all_agents), 2)
+
+        agent_manager.remove_agent("name1")
+        self.assertIsNone(agent_manager.get_agent_by_name("name1"))
+        self.assertIsNone(agent_manager.get_agent_by_uuid("ea7f6c3e-d757-11ec-9d64-0242ac120002"))
+        self.assertEqual(agent_manager.all_agents, [far_away_agent])
+
+    def test_select_closest_agent_matches_scalar_haversine(self):
+        agent_manager = AgentManager()
+        rng = random.Random(1)
+        for i in range(200):
+            agent = agent_manager.create_new_agent({"name": f"agent{i}", "agent-uuid": str(i), "busy": False})
+            setattr(agent, "direct_execution_info", self.msg)
+            setattr(agent, "position", {"altitude": 40.0,
+                                        "latitude": rng.uniform(55.0, 69.0),
+                                        "longitude": rng.uniform(11.0, 24.0)})
+
+        for _ in range(20):
+            waypoint = {"latitude": rng.uniform(55.0, 69.0), "longitude": rng.uniform(11.0, 24.0)}
+            expected = min(agent_manager.all_agents, key=lambda a: AgentManager.calculate_haversine_distance(
+                [waypoint["latitude"], waypoint["longitude"]],
+                [a.position["latitude"], a.position["longitude"]]))
+
+            agent = agent_manager.select_closest_agent_that_is_non_busy("move-to", {"waypoint": waypoint})
+            self.assertIs(agent, expected)
+            agent_manager.set_busy(agent, False)
+
+    def test_agents_at_the_same_distance_are_selected_in_registration_order(self):
+        agent_manager = AgentManager()
+        position = {"altitude": 40.0, "latitude": 57.7, "longitude": 11.9}
+        for name in ("agent0", "agent1", "agent2"):
+            agent = agent_manager.create_new_agent({"name": name, "agent-uuid": name, "busy": False})
+            setattr(agent, "direct_execution_info", self.msg)
+            setattr(agent, "position", position)
+        agent_manager.remove_agent("agent0")
+        agent = agent_manager.create_new_agent({"name": "agent3", "agent-uuid": "agent3", "busy": False}) #Gets the slot of agent0
+        setattr(agent, "direct_execution_info", self.msg)
+        setattr(agent, "position", position)
+
+        waypoint = {"latitude": 57.8, "longitude": 11.9}
+        agents = agent_manager.find_closest_non_busy_agents("move-to", waypoint, k=3)
+        self.assertEqual([agent.meta["name"] for agent in agents], ["agent1", "agent2", "agent3"])
+        self.assertEqual(agent_manager.select_closest_agent_that_is_non_busy("move-to", {"waypoint": waypoint}).meta["name"], "agent1")
+
+    def test_find_closest_non_busy_agents_follows_position_updates(self):
+        close_agent, far_away_agent, agent_manager = self.__setup_two_agents_and_agent_manager()
+        waypoint = {'latitude': 57.70823988120551, 'longitude': 11.93838357925415}
+
+        agents = agent_manager.find_closest_non_busy_agents("move-to", waypoint, k=2)
+        self.assertEqual(agents, [close_agent, far_away_agent])
+
+        # Move the far away agent next to the waypoint
+        far_away_agent.position = {"altitude": 40.0, "latitude": 57.7082, "longitude": 11.9383}
+        agents = agent_manager.find_closest_non_busy_agents("move-to", waypoint, k=2)
+        self.assertEqual(agents, [far_away_agent, close_agent])
+
+        # Busy agents and agents that does not support the task are skipped
+        agent_manager.set_busy(far_away_agent, True)
+        self.assertEqual(agent_manager.find_closest_non_busy_agents("move-to", waypoint, k=2), [close_agent])
+        self.assertEqual(agent_manager.find_closest_non_busy_agents("search-area", waypoint, k=2), [])
+
+    def test_capability_index_follows_direct_execution_info(self):
+        close_agent, far_away_agent, agent_manager = self.__setup_two_agents_and_agent_manager()
+
+        self.assertEqual(agent_manager.capabilities["move-to"], {"name1", "name2"})
+        self.assertEqual(agent_manager.idle_agents_supporting("move-path"), {"name1", "name2"})
+
+        # The same task advertised twice only gives the agent once
+        far_away_agent.direct_execution_info = {"tasks-available": [{'name': 'search-area'}, {'name': 'search-area'}]}
+        self.assertEqual(agent_manager.filter_agents("search-area"), [far_away_agent])
+        self.assertEqual(agent_manager.capabilities["move-to"], {"name1"})
+
+        agent_manager.set_busy(close_agent, True)
+        self.assertEqual(agent_manager.idle_agents_supporting("move-to"), set())
+
+        agent_manager.remove_agent("name2")
+        self.assertNotIn("search-area", agent_manager.capabilities)
+
+    def test_agent_keeps_typed_fields_and_bounded_extra_attributes(self):
+        agent_manager = AgentManager(max_extra_attributes=2)
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+
+        agent.update_attribute("heartbeat", {"levels": ["sensor", "direct execution"], "rate": 1.0, "stamp": 1.5})
+        agent.update_attribute("position", {"altitude": 40.0, "latitude": 57.86, "longitude": 16.78, "type": "GeoPoint"})
+        self.assertEqual(agent.levels, ["sensor", "direct execution"])
+        self.assertEqual((agent.latitude, agent.longitude, agent.altitude), (57.86, 16.78, 40.0))
+        self.assertFalse(hasattr(agent, "__dict__"))
+
+        agent.update_attribute("sensor_info", {"sensors": []})
+        agent.update_attribute("battery", {"level": 0.9})
+        agent.update_attribute("camera_url", "rtsp://camera")
+        self.assertEqual(list(agent.extra), ["battery", "camera_url"])
+
+        # Without a limit other attributes are not kept
+        other_agent = AgentManager().create_new_agent({"name": "name2", "agent-uuid": "uuid2", "busy": False})
+        other_agent.update_attribute("battery", {"level": 0.9})
+        self.assertIsNone(other_agent.extra)
+
+    def test_assign_agents_to_tasks_minimizes_total_distance(self):
+        close_agent, far_away_agent, agent_manager = self.__setup_two_agents_and_agent_manager()
+        close_agent.position = {"altitude": 40.0, "latitude": 58.0, "longitude": 16.0}
+        far_away_agent.position = {"altitude": 40.0, "latitude": 58.1, "longitude": 16.0}
+
+        # Closest agent first would give the first task 'close_agent' and send 'far_away_agent' 11 km away
+        tasks = [("move-to", {"waypoint": {"latitude": 58.04, "longitude": 16.0}}, 1),
+                 ("move-to", {"waypoint": {"latitude": 57.99, "longitude": 16.0}}, 1),
+                 ("search-area", {"area": [{"latitude": 58.0, "longitude": 16.0}]}, 1)]
+        selected = agent_manager.assign_agents_to_tasks(tasks)
+
+        self.assertEqual(selected, [far_away_agent, close_agent, None])
+        self.assertTrue(close_agent.meta["busy"])
+        self.assertTrue(far_away_agent.meta["busy"])
+        self.assertEqual(agent_manager.assign_agents_to_tasks(tasks[:1]), [None])
+
+    def test_assign_agents_to_tasks_gives_scarce_agents_to_important_tasks(self):
+        close_agent, far_away_agent, agent_manager = self.__setup_two_agents_and_agent_manager()
+        agent_manager.set_busy(far_away_agent, True)
+        close_agent.position = {"altitude": 40.0, "latitude": 58.0, "longitude": 16.0}
+
+        # The less important task is closer, but the one agent goes to the more important task
+        tasks = [("move-to", {"waypoint": {"latitude": 58.0, "longitude": 16.0}}, 5),
+                 ("move-to", {"waypoint": {"latitude": 58.1, "longitude": 16.0}}, 1),
+                 ("move-to", {"waypoint": {"latitude": 58.0, "longitude": 16.0}}, 3)]
+        self.assertEqual(agent_manager.assign_agents_to_tasks(tasks), [None, close_agent, None])
+
+    def test_select_fastest_agent_that_is_non_busy_prefers_fast_agents(self):
+        agent_manager = AgentManager()
+        ground_agent = agent_manager.create_new_agent({"name": "ground", "base_topic": "waraps/unit/ground/real/ground",
+                                                       "agent-uuid": "uuid1", "busy": False})
+        air_agent = agent_manager.create_new_agent({"name": "air", "base_topic": "waraps/unit/air/real/air",
+                                                    "agent-uuid": "uuid2", "busy": False})
+        for agent in (ground_agent, air_agent):
+            agent.direct_execution_info = self.msg
+        ground_agent.position = {"altitude": 0.0, "latitude": 58.02, "longitude": 16.0}  # ~2 km away
+        air_agent.position = {"altitude": 40.0, "latitude": 58.09, "longitude": 16.0}  # ~10 km away
+        params = {"waypoint": {"latitude": 58.0, "longitude": 16.0}}
+
+        agent_manager.selection_strategies = {"move-to": "eta"}
+        self.assertIs(agent_manager.select_agent_that_is_non_busy("move-to", params), air_agent)
+        agent_manager.set_busy(air_agent, False)
+
+        agent_manager.selection_strategies = {}
+        self.assertIs(agent_manager.select_agent_that_is_non_busy("move-to", params), ground_agent)
+
+    def test_find_fastest_non_busy_agents_matches_brute_force(self):
+        agent_manager = AgentManager()
+        rng = random.Random(2)
+        for i in range(300):
+            domain = rng.choice(["ground", "air"])
+            agent = agent_manager.create_new_agent({"name": f"agent{i}", "base_topic": f"waraps/unit/{domain}/real/agent{i}",
+                                                    "agent-uuid": str(i), "busy": False})
+            agent.direct_execution_info = self.msg
+            agent.position = {"altitude": 40.0, "latitude": rng.uniform(57.0, 59.0), "longitude": rng.uniform(15.0, 18.0)}
+            agent.update_attribute("speed", {"speed": rng.uniform(0.0, 25.0)})
+            agent.update_attribute("heading", rng.uniform(0.0, 360.0))
+
+        all_slots = [agent.slot for agent in agent_manager.all_agents]
+        for _ in range(10):
+            waypoint = {"latitude": rng.uniform(57.0, 59.0), "longitude": rng.uniform(15.0, 18.0)}
+            terms = agent_manager.positions.haversine_terms(all_slots, waypoint)
+            etas = agent_manager.positions.eta_seconds(all_slots, terms, waypoint)
+            expected = [agent_manager.slot_agents[all_slots[i]] for i in sorted(range(len(etas)), key=lambda i: etas[i])[:3]]
+            self.assertEqual(agent_manager.find_fastest_non_busy_agents("move-to", waypoint, k=3), expected)
+
+    def test_agents_that_miss_heartbeats_are_not_selected(self):
+        close_agent, far_away_agent, agent_manager = self.__setup_two_agents_and_agent_manager()
+        close_agent.heartbeat = {"levels": ["sensor"], "rate": 1.0, "stamp": 1.0}
+        agent_manager.heartbeat_received(close_agent, now=100.0)
+        far_away_agent.heartbeat = {"levels": ["sensor"], "rate": 1.0, "stamp": 1.0}
+        agent_manager.heartbeat_received(far_away_agent, now=102.0)
+
+        self.assertEqual(agent_manager.expire_stale_agents(now=103.5), ["name1"])
+        self.assertEqual(agent_manager.live_agents, [far_away_agent])
+        self.assertEqual(agent_manager.idle_agents_supporting("move-to"), {"name2"})
+
+        close_agent.heartbeat = {"levels": ["sensor"], "rate": 1.0, "stamp": 2.0}
+        self.assertEqual(agent_manager.idle_agents_supporting("move-to"), {"name1", "name2"})
+        self.assertEqual(len(agent_manager.live_agents), 2)
+
     def __setup_two_agents_and_agent_manager(self):
         agent_manager = AgentManager()
         meta_data_1 = {
@@ -0,0 +1,43 @@
+import unittest
+from aggregate import Aggregate
+from agent_manager import AgentManager, task_key
+
+
+class AggregateTests(unittest.TestCase):
+
+    def test_entries_stay_until_the_last_contributor_drops_them(self):
+        levels = Aggregate()
+        self.assertTrue(levels.set("name1", ["sensor", "direct execution"]))
+        self.assertTrue(levels.set("name2", ["sensor", "tst execution"]))
+        items = levels.items()
+        self.assertEqual(items, ["sensor", "direct execution", "tst execution"])
+
+        self.assertFalse(levels.set("name1", ["direct execution", "sensor"]))
+        self.assertIs(levels.items(), items)  # Nothing changed, nothing rebuilt
+
+        self.assertTrue(levels.discard("name2"))
+        self.assertIn("sensor", levels)  # Still used by name1
+        self.assertEqual(levels.items(), ["sensor", "direct execution"])
+        levels.discard("name1")
+        self.assertEqual(levels.items(), [])
+        self.assertEqual(levels.counts, {})
+
+    def test_agent_manager_retracts_the_tasks_of_removed_agents(self):
+        agent_manager = AgentManager()
+        agent1 = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+        agent2 = agent_manager.create_new_agent({"name": "name2", "agent-uuid": "uuid2", "busy": False})
+        agent1.direct_execution_info = {"tasks-available": [{"name": "move-to", "signals": ["$abort"]}]}
+        agent2.direct_execution_info = {"tasks-available": [{"signals": ["$abort"], "name": "move-to"}, {"name": "search-area"}]}
+        agent2.heartbeat = {"levels": ["sensor"], "rate": 1.0, "stamp": 1.0}
+
+        self.assertEqual([task_key(task) for task in agent_manager.tasks_available.items()],
+                         [task_key({"name": "move-to", "signals": ["$abort"]}), task_key({"name": "search-area"})])
+        self.assertEqual(agent_manager.levels.items(), ["sensor"])
+
+        agent_manager.remove_agent("name2")
+        self.assertEqual(agent_manager.tasks_available.items(), [{"name": "move-to", "signals": ["$abort"]}])
+        self.assertEqual(agent_manager.levels.items(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import itertools
+import unittest
+import numpy as np
+from assignment import solve_assignment, INFEASIBLE_COST
+
+
+class AssignmentTests(unittest.TestCase):
+
+    def test_solve_assignment_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            rows, cols = int(rng.integers(1, 6)), int(rng.integers(1, 6))
+            cost = rng.random((rows, cols)) * 100
+            cost[rng.random((rows, cols)) < 0.2] = INFEASIBLE_COST
+
+            pairs = solve_assignment(cost)
+            self.assertEqual(len({row for row, _ in pairs}), len(pairs))
+            self.assertEqual(len({col for _, col in pairs}), len(pairs))
+
+            # Pairs left out count as infeasible, compare with the best of every possible assignment
+            total = sum(cost[row, col] for row, col in pairs) + (min(rows, cols) - len(pairs)) * INFEASIBLE_COST
+            if rows <= cols:
+                best = min(sum(cost[row, perm[row]] for row in range(rows)) for perm in itertools.permutations(range(cols), rows))
+            else:
+                best = min(sum(cost[perm[col], col] for col in range(cols)) for perm in itertools.permutations(range(rows), cols))
+            self.assertAlmostEqual(total, best, delta=1e-6 * max(1.0, best))
+
+    def test_solve_assignment_empty(self):
+        self.assertEqual(solve_assignment(np.zeros((0, 3))), [])
+        self.assertEqual(solve_assignment(np.zeros((2, 0))), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
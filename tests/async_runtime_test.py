@@ -0,0 +1,60 @@
+import asyncio, tempfile
+import unittest
+from agent_manager import AgentManager
+from async_runtime import AsyncRuntime
+from ingest import BLOCK, DROP_OLDEST
+from journal import TaskJournal
+from mqtt_manager import MqttManager
+from task import Task, TaskQueue
+
+
+class Recorder():
+    '''Takes the place of the publish pipeline, keeps the published payloads'''
+    def __init__(self) -> None:
+        self.published: list = []
+
+    def publish(self, topic, payload = None, qos = None, retain = False, coalesce = None) -> bool:
+        self.published.append((topic, payload))
+        return True
+
+
+class BrokenUSSP():
+    async def request_height(self, topic):
+        raise ValueError("Unexpected reply")
+
+
+class AsyncRuntimeTests(unittest.TestCase):
+
+    def test_ingest_does_not_block_the_event_loop(self):
+        mqtt = MqttManager(AgentManager(), None, None, None, TaskQueue(10))
+        mqtt.ingest.policy = BLOCK
+        AsyncRuntime(mqtt)
+        self.assertEqual(mqtt.ingest.policy, DROP_OLDEST)
+
+    def test_task_that_fails_to_plan_is_reported_and_journaled(self):
+        with tempfile.TemporaryDirectory() as directory:
+            agent_manager = AgentManager()
+            journal = TaskJournal(directory)
+            mqtt = MqttManager(agent_manager, None, None, None, TaskQueue(10), journal)
+            mqtt.outbound = Recorder()
+            agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": True})
+            agent.position = {"latitude": 57.76, "longitude": 16.68, "altitude": 40.0}
+            task = Task()
+            task.original_task = {"com-uuid": "com1", "task-uuid": "task1",
+                                  "task": {"name": "move-to", "params": {"waypoint": {"latitude": 57.7, "longitude": 16.6, "altitude": 40.0}}}}
+            mqtt.journal_task("received", task.original_task, task=task.original_task)
+
+            runtime = AsyncRuntime(mqtt)
+            runtime.ussp = BrokenUSSP()
+            self.assertFalse(asyncio.run(runtime.dispatch_task(task, agent)))
+            self.assertFalse(agent.meta["busy"])
+            self.assertEqual(len(mqtt.outbound.published), 1)
+            self.assertIn(b'"response":"failed"', mqtt.outbound.published[0][1])
+            journal.close()
+            journal = TaskJournal(directory)
+            self.assertEqual(journal.recovered, {}) #Finished, not recovered
+            journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,21 @@
+import json
+import unittest
+import numpy as np
+import codec
+
+
+class CodecTests(unittest.TestCase):
+
+    def tearDown(self):
+        codec.use("auto")
+
+    def test_backends_encode_numpy_values_and_raise_value_errors(self):
+        for backend in codec.BACKENDS:
+            codec.use(backend)
+            self.assertEqual(codec.loads(codec.dumps({"latitude": np.float64(57.5)})), {"latitude": 57.5})
+            with self.assertRaises(json.JSONDecodeError):
+                codec.loads(b"rtsp://camera")
+
+
+if __name__ == '__main__':
+    unittest.main()
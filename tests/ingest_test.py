@@ -0,0 +1,66 @@
+import threading
+import unittest
+from ingest import IngestPool, DROP_OLDEST
+
+
+class IngestPoolTests(unittest.TestCase):
+
+    def test_messages_of_an_agent_are_handled_in_order(self):
+        pool = IngestPool(workers=4, queue_size=8)
+        handled: dict = {}
+        pool.start()
+        for i in range(400):
+            name = f"agent_{i % 10}"
+            pool.submit(name, lambda name, i: handled.setdefault(name, []).append(i), name, i)
+        pool.stop()
+
+        self.assertEqual(len(handled), 10)
+        for values in handled.values():
+            self.assertEqual(values, sorted(values))
+        self.assertEqual(pool.metrics()["handled"], 400)
+        self.assertEqual(pool.metrics()["dropped"], 0)
+
+    def test_drop_oldest_when_the_queue_is_full(self):
+        pool = IngestPool(workers=1, queue_size=2, policy=DROP_OLDEST)
+        handled: list = []
+        release = threading.Event()
+        pool.start()
+        pool.submit("agent", release.wait)
+        while pool.depths() != [0]:  # The worker is now blocked on the first message
+            pass
+        for i in range(5):
+            pool.submit("agent", handled.append, i)
+        self.assertEqual(pool.metrics()["max_depths"], [2])
+        release.set()
+        pool.stop()
+
+        self.assertEqual(handled, [3, 4])
+        self.assertEqual(pool.metrics()["dropped"], 3)
+
+    def test_conflated_messages_keep_only_the_latest(self):
+        pool = IngestPool(workers=1, queue_size=100)
+        handled: list = []
+        release = threading.Event()
+        pool.start()
+        pool.submit("agent", release.wait)
+        while pool.depths() != [0]:
+            pass
+        for i in range(5):
+            pool.submit("agent", handled.append, ("position", i), conflate="agent/sensor/position")
+            pool.submit("agent", handled.append, ("response", i))
+        self.assertEqual(pool.depths(), [6])
+        release.set()
+        pool.stop()
+
+        self.assertEqual(handled, [("position", 4)] + [("response", i) for i in range(5)])
+        self.assertEqual(pool.metrics()["conflated"], 4)
+
+        # Once handled, the next message with the key is queued again
+        pool.start()
+        pool.submit("agent", handled.append, ("position", 5), conflate="agent/sensor/position")
+        pool.stop()
+        self.assertEqual(handled[-1], ("position", 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import os, tempfile
+import unittest
+from journal import TaskJournal
+
+
+class TaskJournalTests(unittest.TestCase):
+
+    def test_tasks_that_have_not_finished_are_recovered(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = TaskJournal(directory)
+            journal.record("received", "uuid1", wait=True, task={"task-uuid": "uuid1"})
+            journal.record("queued", "uuid1", priority=2, deadline=None)
+            journal.record("received", "uuid2", task={"task-uuid": "uuid2"})
+            journal.record("sent", "uuid2", agent={"name": "name1"})
+            journal.record("finished", "uuid2", wait=True, status="FINISHED")
+            journal.close()
+            self.assertLessEqual(journal.commits, 5)
+
+            with open(journal.segment_path(journal.segments[-1]), "ab") as f:
+                f.write(b"\x40\x00\x00\x00\x00\x00\x00\x00{}") #Cut short by a crash
+            journal = TaskJournal(directory)
+            self.assertEqual(list(journal.recovered), ["uuid1"])
+            self.assertEqual([record["event"] for record in journal.recovered["uuid1"]], ["received", "queued"])
+            self.assertEqual(journal.recovered["uuid1"][1]["priority"], 2)
+            journal.close()
+
+    def test_segments_rotate_with_the_unfinished_tasks_and_old_segments_are_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = TaskJournal(directory, segment_size=200, retention=0)
+            journal.record("received", "uuid1", wait=True, task={"task-uuid": "uuid1"})
+            for index in range(10):
+                journal.record("received", f"done{index}", task={"task-uuid": f"done{index}"})
+                journal.record("finished", f"done{index}", wait=True, status="FINISHED")
+            journal.close()
+            self.assertGreater(journal.segments[-1], 2)
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+            journal = TaskJournal(directory)
+            self.assertEqual(list(journal.recovered), ["uuid1"])
+            journal.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
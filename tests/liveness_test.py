@@ -0,0 +1,34 @@
+import unittest
+from liveness import TimerWheel
+
+
+class TimerWheelTests(unittest.TestCase):
+
+    def test_keys_expire_once_at_their_deadline(self):
+        wheel = TimerWheel(resolution=0.5, size=8)
+        wheel.schedule("a", 1.0)
+        wheel.schedule("b", 2.0)
+        wheel.schedule("c", 20.0)  # More than a turn of the wheel ahead
+
+        self.assertEqual(wheel.expire(0.9), [])
+        self.assertEqual(wheel.expire(1.0), ["a"])
+        self.assertEqual(wheel.expire(5.0), ["b"])
+        self.assertEqual(wheel.expire(19.5), [])
+        self.assertEqual(wheel.expire(25.0), ["c"])
+        self.assertEqual(len(wheel), 0)
+
+    def test_reschedule_and_cancel(self):
+        wheel = TimerWheel(resolution=0.5, size=8)
+        wheel.schedule("a", 1.0)
+        wheel.schedule("b", 1.0)
+        wheel.schedule("a", 3.0)
+        wheel.cancel("b")
+
+        self.assertEqual(wheel.expire(2.0), [])
+        self.assertIn("a", wheel)
+        self.assertNotIn("b", wheel)
+        self.assertEqual(wheel.expire(3.0), ["a"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+import json, tempfile, threading
+import unittest
+from agent_manager import AgentManager
+from journal import TaskJournal
+from task import Task, TaskQueue, TaskQueueItem, TaskStatus
+from mqtt_manager import MqttManager
+from paho.mqtt.client import Client as PahoClient, MQTTMessage
+from subscriptions import Subscriptions
+from tests.async_runtime_test import Recorder
+
+
+class MqttManagerTests(unittest.TestCase):
+
+    def test_heartbeat_is_only_encoded_again_when_the_levels_change(self):
+        agent_manager = AgentManager()
+        mqtt = MqttManager(agent_manager, None, None, None, None)
+        mqtt.outbound = Recorder()
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+
+        agent.heartbeat = {"levels": ["sensor"], "rate": 1.0, "stamp": 1.0}
+        self.assertTrue(mqtt.update_levels())
+        heartbeat_body = mqtt.heartbeat_body
+        agent.heartbeat = {"levels": ["sensor"], "rate": 1.0, "stamp": 2.0}
+        self.assertFalse(mqtt.update_levels())
+        self.assertIs(mqtt.heartbeat_body, heartbeat_body)
+        mqtt.send_heartbeat()
+        mqtt.send_heartbeat()
+        first, second = (json.loads(payload) for topic, payload in mqtt.outbound.published)
+        self.assertEqual((first["levels"], first["type"]), (["sensor"], "HeartBeat"))
+        self.assertLessEqual(first["stamp"], second["stamp"])
+
+        agent_manager.remove_agent("name1")
+        self.assertTrue(mqtt.update_levels())
+        mqtt.send_heartbeat()
+        self.assertEqual(json.loads(mqtt.outbound.published[-1][1])["levels"], [])
+
+    def test_only_the_allowed_attributes_of_an_agent_are_subscribed(self):
+        mqtt = MqttManager(AgentManager(), None, None, None, None)
+        mqtt.subscriptions = Subscriptions(PahoClient())
+        mqtt.agent_attributes = ("heartbeat", "sensor/position", "exec/response")
+        mqtt.subscribe_to_agent({"name": "name1", "base_topic": "waraps/unit/air/real/name1"})
+
+        self.assertEqual(list(mqtt.subscriptions.topics), ["waraps/unit/air/real/name1/heartbeat",
+                                                           "waraps/unit/air/real/name1/sensor/position",
+                                                           "waraps/unit/air/real/name1/exec/response"])
+        route = mqtt.router.resolve("waraps/unit/air/real/name1/sensor/position")[0]
+        self.assertEqual((route.agent_name, route.attribute), ("name1", "position"))
+        self.assertEqual(mqtt.router.resolve("waraps/unit/air/real/name1/sensor/camera_url"), ())
+
+        mqtt.agent_attributes = ("heartbeat", "#")
+        self.assertEqual(mqtt.agent_topics("waraps/unit/air/real/name2"), ["waraps/unit/air/real/name2/#"])
+
+    def test_heartbeats_routed_before_the_wildcard_is_removed_create_the_agent_once(self):
+        agent_manager = AgentManager()
+        mqtt = MqttManager(agent_manager, None, None, None, None)
+        mqtt.subscriptions = Subscriptions(PahoClient())
+        msg = MQTTMessage(topic=b"waraps/unit/air/real/name1/heartbeat")
+        msg.payload = json.dumps({"agent-type": "drone", "agent-uuid": "uuid1", "name": "name1"}).encode()
+
+        mqtt.search_and_create_agent(None, None, msg, "name1")
+        agent = agent_manager.get_agent_by_name("name1")
+        mqtt.search_and_create_agent(None, None, msg, "name1")
+        self.assertIs(agent_manager.get_agent_by_name("name1"), agent)
+        self.assertEqual(len(agent_manager.agents), 1)
+
+    def test_dispatcher_wakes_when_a_task_is_queued_and_when_an_agent_becomes_idle(self):
+        agent_manager = AgentManager()
+        task_queue = TaskQueue(10)
+        mqtt = MqttManager(agent_manager, None, None, None, task_queue)
+        dispatched = threading.Event()
+        mqtt.dispatch_task = lambda task, agent: dispatched.set() or True
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": True})
+        agent.position = {"latitude": 57.76, "longitude": 16.68, "altitude": 40.0}
+        agent.direct_execution_info = {"tasks-available": [{"name": "move-to", "signals": []}]}
+        threading.Thread(target=mqtt.handle_task, daemon=True).start()
+
+        task = Task()
+        task.original_task = {"task": {"name": "move-to", "params": {"waypoint": {"latitude": 57.7, "longitude": 16.6}}}}
+        task_queue.put_task_to_queue(TaskQueueItem(1, task))
+        self.assertFalse(dispatched.wait(0.2)) #The agent is busy
+
+        agent_manager.set_busy(agent, False)
+        self.assertTrue(dispatched.wait(1.0))
+        self.assertTrue(agent.meta["busy"])
+        self.assertTrue(task_queue.empty())
+
+    def test_dispatcher_wakes_when_an_idle_agent_gets_its_first_position(self):
+        agent_manager = AgentManager()
+        task_queue = TaskQueue(10)
+        mqtt = MqttManager(agent_manager, None, None, None, task_queue)
+        dispatched = threading.Event()
+        mqtt.dispatch_task = lambda task, agent: dispatched.set() or True
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+        agent.direct_execution_info = {"tasks-available": [{"name": "move-to", "signals": []}]}
+        threading.Thread(target=mqtt.handle_task, daemon=True).start()
+
+        task = Task()
+        task.original_task = {"task": {"name": "move-to", "params": {"waypoint": {"latitude": 57.7, "longitude": 16.6}}}}
+        task_queue.put_task_to_queue(TaskQueueItem(1, task))
+        self.assertFalse(dispatched.wait(0.2)) #Put back, the agent has no position
+        self.assertEqual(len(task_queue), 1)
+
+        agent.position = {"latitude": 57.76, "longitude": 16.68, "altitude": 40.0}
+        self.assertTrue(dispatched.wait(1.0))
+        self.assertTrue(task_queue.empty())
+
+    def test_task_no_idle_agent_supports_does_not_hold_back_other_tasks(self):
+        agent_manager = AgentManager()
+        task_queue = TaskQueue(10)
+        mqtt = MqttManager(agent_manager, None, None, None, task_queue)
+        dispatched = []
+        mqtt.dispatch_task = lambda task, agent: dispatched.append(task.original_task["task"]["name"]) or True
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+        agent.position = {"latitude": 57.76, "longitude": 16.68, "altitude": 40.0}
+        agent.direct_execution_info = {"tasks-available": [{"name": "move-to", "signals": []}]}
+
+        search_area = Task()
+        search_area.original_task = {"task": {"name": "search-area", "params": {"area": [{"latitude": 57.7, "longitude": 16.6}]}}}
+        move_to = Task()
+        move_to.original_task = {"task": {"name": "move-to", "params": {"waypoint": {"latitude": 57.7, "longitude": 16.6}}}}
+        task_queue.put_task_to_queue(TaskQueueItem(0, search_area)) #More important, but no agent supports it
+        task_queue.put_task_to_queue(TaskQueueItem(1, move_to))
+
+        task_item, selected_agent = mqtt.take_dispatchable_task(set())
+        self.assertIs(task_item.item, move_to)
+        self.assertIs(selected_agent, agent)
+        self.assertEqual(mqtt.take_dispatchable_task(set()), (None, None))
+        self.assertEqual(task_queue.task_names(), ["search-area"])
+
+    def test_batch_assignment_only_takes_as_many_tasks_as_there_are_idle_agents(self):
+        agent_manager = AgentManager()
+        task_queue = TaskQueue(0)
+        mqtt = MqttManager(agent_manager, None, None, None, task_queue)
+        dispatched = []
+        mqtt.dispatch_task = lambda task, agent: dispatched.append((task, agent)) or True
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+        agent.position = {"latitude": 57.76, "longitude": 16.68, "altitude": 40.0}
+        agent.direct_execution_info = {"tasks-available": [{"name": "move-to", "signals": []}]}
+
+        tasks = []
+        for name in ("move-to", "move-to", "move-to", "search-area"):
+            task = Task()
+            task.original_task = {"task": {"name": name, "params": {"waypoint": {"latitude": 57.7, "longitude": 16.6}}}}
+            task_queue.put_task_to_queue(TaskQueueItem(1, task))
+            tasks.append(task)
+
+        self.assertTrue(mqtt.handle_task_batch())
+        self.assertEqual(dispatched, [(tasks[0], agent)])
+        self.assertEqual(len(task_queue), 3)
+        self.assertTrue(mqtt.handle_task_batch()) #No idle agent left
+        self.assertEqual(len(dispatched), 1)
+
+    def test_tasks_are_recovered_from_the_task_journal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            journal = TaskJournal(directory)
+            for task_uuid in ("uuid1", "uuid2"):
+                journal.record("received", task_uuid, task={"task-uuid": task_uuid, "com-uuid": "com1",
+                                                            "task": {"name": "move-to", "params": {}}})
+            journal.record("queued", "uuid1", priority=3, deadline=None)
+            journal.record("assigned", "uuid2", agent="name1")
+            journal.record("planned", "uuid2", plan_id="plan1")
+            journal.record("sent", "uuid2", wait=True, agent={"name": "name1", "base_topic": "waraps/unit/air/real/name1"})
+            journal.close()
+
+            agent_manager = AgentManager()
+            task_queue = TaskQueue(10)
+            mqtt = MqttManager(agent_manager, None, None, None, task_queue, TaskJournal(directory))
+            mqtt.recover_tasks()
+            queued = task_queue.get_all_tasks_from_queue()
+            self.assertEqual([(item.priority, item.item.original_task["task-uuid"]) for item in queued], [(3, "uuid1")])
+            running = agent_manager.running_tasks.get("uuid2")
+            self.assertEqual((running.plan_id, running.status), ("plan1", TaskStatus.RUNNING))
+
+            #The agent is taken over when it is seen, busy with the task
+            agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+            self.assertIs(running.agent, agent)
+            self.assertNotIn("name1", agent_manager.idle_agents)
+            mqtt.task_journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from paho.mqtt.client import MQTT_ERR_SUCCESS, MQTTMessageInfo
+from outbound import PublishPipeline, TokenBucket
+
+
+class FakeClient():
+    '''Records the published messages instead of sending them'''
+    def __init__(self):
+        self.published: list = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload, qos))
+        info = MQTTMessageInfo(len(self.published))
+        info.rc = MQTT_ERR_SUCCESS
+        return info
+
+
+class PublishPipelineTests(unittest.TestCase):
+
+    def test_qos_is_picked_on_the_end_of_the_topic(self):
+        pipeline = PublishPipeline(FakeClient(), {"exec/command": 1, "command": 2, "exec/response": 1})
+        self.assertEqual(pipeline.qos("waraps/unit/air/real/agent1/exec/command"), 1)
+        self.assertEqual(pipeline.qos("ussp/operator1/command"), 2)
+        self.assertEqual(pipeline.qos("waraps/unit/ground/real/operator/sensor/position"), 0)
+        self.assertEqual(pipeline.qos("waraps/unit/ground/real/operator/exec/response"), 1)
+
+    def test_superseded_messages_are_coalesced_and_the_order_is_kept(self):
+        client = FakeClient()
+        pipeline = PublishPipeline(client, {"exec/response": 1})
+        pipeline.publish("operator/heartbeat", b"1", coalesce="operator/heartbeat")
+        pipeline.publish("operator/exec/response", b"response")
+        pipeline.publish("operator/heartbeat", b"2", coalesce="operator/heartbeat")
+        pipeline.start()
+        pipeline.stop()
+        self.assertEqual(client.published, [("operator/heartbeat", b"2", 0), ("operator/exec/response", b"response", 1)])
+
+        pipeline.start() #A sent message is not replaced
+        pipeline.publish("operator/heartbeat", b"3", coalesce="operator/heartbeat")
+        pipeline.stop()
+        self.assertEqual(client.published[-1], ("operator/heartbeat", b"3", 0))
+        metrics = pipeline.metrics()
+        self.assertEqual((metrics["published"], metrics["coalesced"], metrics["dropped"]), (3, 1, 0))
+
+    def test_telemetry_is_dropped_when_the_queue_is_full(self):
+        client = FakeClient()
+        pipeline = PublishPipeline(client, {"exec/command": 1}, queue_size=2)
+        self.assertTrue(pipeline.publish("operator/sensor/position", b"1"))
+        self.assertTrue(pipeline.publish("operator/sensor/speed", b"2"))
+        self.assertFalse(pipeline.publish("operator/sensor/heading", b"3"))
+        self.assertFalse(pipeline.publish("operator/heartbeat", b"4", coalesce="operator/heartbeat"))
+        self.assertEqual(pipeline.pending, {})
+        self.assertEqual(pipeline.metrics()["dropped"], 2)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10.0, burst=2)
+        self.assertEqual(bucket.wait(), 0.0)
+        self.assertEqual(bucket.wait(), 0.0)
+        self.assertAlmostEqual(bucket.wait(), 0.1, places=2)
+        self.assertEqual(TokenBucket(rate=0.0, burst=1).wait(), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
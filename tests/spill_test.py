@@ -0,0 +1,24 @@
+import tempfile
+import unittest
+from spill import SpillFile
+
+
+class SpillFileTests(unittest.TestCase):
+
+    def test_records_are_read_back_while_the_file_grows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spill_file = SpillFile(directory)
+            first = spill_file.append(b'{"task": 1}')
+            self.assertEqual(spill_file.read(*first), b'{"task": 1}')
+            second = spill_file.append(b'{"task": 2}') #Beyond the mapped part
+            self.assertEqual(spill_file.read(*second), b'{"task": 2}')
+            self.assertEqual(spill_file.read(*first), b'{"task": 1}')
+
+            spill_file.clear()
+            self.assertEqual(len(spill_file), 0)
+            self.assertEqual(spill_file.read(*spill_file.append(b"{}")), b"{}")
+            spill_file.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
+from subscriptions import Subscriptions
+
+
+class FakeClient():
+    '''Records the SUBSCRIBE packets instead of sending them'''
+    def __init__(self):
+        self.connected: bool = False
+        self.packets: list = []
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def subscribe(self, topics):
+        if not self.connected:
+            return MQTT_ERR_NO_CONN, None
+        self.packets.append(topics)
+        return MQTT_ERR_SUCCESS, len(self.packets)
+
+    def unsubscribe(self, topic):
+        pass
+
+
+class SubscriptionsTests(unittest.TestCase):
+
+    def test_topics_are_sent_in_chunks_on_connect(self):
+        client = FakeClient()
+        subscriptions = Subscriptions(client, chunk_size=3)
+        subscriptions.subscribe([f"waraps/unit/+/+/agent{i}/heartbeat" for i in range(7)])
+        self.assertEqual(client.packets, []) #Not connected yet
+
+        client.connected = True
+        subscriptions.restore()
+        self.assertEqual([len(packet) for packet in client.packets], [3, 3, 1])
+        self.assertIsNone(subscriptions.ready_time)
+
+        subscriptions.on_subscribe(client, None, 2, [0])
+        subscriptions.on_subscribe(client, None, 1, [0])
+        self.assertIsNone(subscriptions.ready_time)
+        subscriptions.on_subscribe(client, None, 3, [0])
+        self.assertIsNotNone(subscriptions.ready_time)
+
+    def test_reconnect_restores_the_current_subscriptions_in_one_batch(self):
+        client = FakeClient()
+        client.connected = True
+        subscriptions = Subscriptions(client, chunk_size=100)
+        subscriptions.subscribe(["operator/exec/command", "waraps/unit/+/+/agent1/heartbeat"])
+        subscriptions.unsubscribe("waraps/unit/+/+/agent1/heartbeat")
+        subscriptions.subscribe(["waraps/unit/ground/real/agent1/#"])
+        subscriptions.subscribe(["waraps/unit/ground/real/agent1/#"]) #Already subscribed, not sent again
+        self.assertEqual(len(client.packets), 2)
+
+        client.packets = []
+        subscriptions.restore()
+        self.assertEqual(client.packets, [[("operator/exec/command", 0), ("waraps/unit/ground/real/agent1/#", 0)]])
+
+    def test_acknowledgement_before_the_mid_is_recorded(self):
+        class FastClient(FakeClient):
+            def subscribe(self, topics): #SUBACK handled by the network thread before 'subscribe' returned
+                rc, mid = super().subscribe(topics)
+                subscriptions.on_subscribe(self, None, mid, [0])
+                return rc, mid
+
+        client = FastClient()
+        client.connected = True
+        subscriptions = Subscriptions(client)
+        subscriptions.add("operator/exec/command")
+        subscriptions.restore()
+        self.assertEqual(subscriptions.outstanding, set())
+        self.assertIsNotNone(subscriptions.ready_time)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,203 @@
+import os, tempfile, threading, time
+import unittest
+from agent_manager import Agent
+import task
+from task import RunningTasks, Task, TaskQueue, TaskQueueItem, TaskStatus, task_deadline, task_priority
+
+
+class RunningTasksTests(unittest.TestCase):
+
+    def test_running_tasks_index_and_status_counts(self):
+        running_tasks = RunningTasks()
+        agent = Agent({"name": "name1", "busy": True})
+        first_task, second_task = self.__new_task("uuid1", agent), self.__new_task("uuid2", agent)
+        running_tasks.add(first_task)
+        running_tasks.add(second_task)
+
+        self.assertIs(running_tasks.get("uuid1"), first_task)
+        self.assertIsNone(running_tasks.get("uuid3"))
+        self.assertEqual(running_tasks.tasks_for_agent("name1"), [first_task, second_task])
+        self.assertEqual(running_tasks.count(TaskStatus.NONE), 2)
+
+        first_task.status = TaskStatus.RUNNING
+        second_task.status = TaskStatus.PAUSED
+        self.assertEqual(running_tasks.count(TaskStatus.RUNNING), 1)
+        self.assertEqual(running_tasks.count(TaskStatus.PAUSED), 1)
+        self.assertEqual(running_tasks.count(TaskStatus.NONE), 0)
+
+        running_tasks.remove(first_task)
+        running_tasks.remove(first_task)
+        self.assertEqual(len(running_tasks), 1)
+        self.assertNotIn(first_task, running_tasks)
+        self.assertEqual(running_tasks.count(TaskStatus.RUNNING), 0)
+        self.assertEqual(running_tasks.tasks_for_agent("name1"), [second_task])
+
+        # Status changes of removed tasks are not counted
+        first_task.status = TaskStatus.FINISHED
+        self.assertEqual(running_tasks.count(TaskStatus.FINISHED), 0)
+
+    def test_running_tasks_from_several_threads(self):
+        running_tasks = RunningTasks()
+        agents = [Agent({"name": f"name{index}", "busy": True}) for index in range(4)]
+
+        def work(agent: Agent) -> None:
+            for index in range(2000):
+                task = self.__new_task(f"{agent.meta['name']}-{index}", agent)
+                running_tasks.add(task)
+                task.status = TaskStatus.RUNNING
+                task.status = TaskStatus.FINISHED
+                running_tasks.remove(task)
+
+        threads = [threading.Thread(target=work, args=(agent,)) for agent in agents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(running_tasks), 0)
+        self.assertEqual(running_tasks.tasks_by_agent, {})
+        self.assertEqual(set(running_tasks.status_counts.values()), {0})
+
+    @staticmethod
+    def __new_task(task_uuid: str, agent: Agent) -> Task:
+        task = Task()
+        task.task_uuid = task_uuid
+        task.agent = agent
+        return task
+
+
+class TaskQueueTests(unittest.TestCase):
+
+    def test_tasks_are_partitioned_by_name_in_priority_order(self):
+        task_queue = TaskQueue(10)
+        items = [TaskQueueItem(priority, self.__new_task(name)) for name, priority in
+                 (("move-to", 2), ("search-area", 1), ("move-to", 1), ("move-to", 1))]
+        for item in items:
+            task_queue.put_task_to_queue(item)
+
+        self.assertEqual(len(task_queue), 4)
+        self.assertEqual(sorted(task_queue.task_names()), ["move-to", "search-area"])
+        self.assertIsNone(task_queue.get_task_for(["move-path"]))
+        self.assertIs(task_queue.get_task_for(["move-to"]), items[2])
+        self.assertIs(task_queue.get_task_for(["move-to", "search-area"]), items[1]) #Queued before items[3]
+        self.assertEqual(task_queue.get_all_tasks_from_queue(), [items[3], items[0]])
+        self.assertTrue(task_queue.empty())
+
+    def test_only_the_first_tasks_of_each_name_are_taken_up_to_the_limit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            task_queue = TaskQueue(0, memory_size=1, spill_directory=directory)
+            items = [TaskQueueItem(priority, self.__new_task(name)) for name, priority in
+                     (("move-to", 3), ("move-to", 1), ("search-area", 2), ("move-to", 2), ("search-area", 1))]
+            for item in items:
+                task_queue.put_task_to_queue(item)
+
+            self.assertEqual(task_queue.get_tasks_for({"move-to": 2, "search-area": 0, "move-path": 1}), [items[1], items[3]])
+            self.assertEqual(len(task_queue), 3)
+            self.assertEqual(task_queue.get_tasks_for({"search-area": 5}), [items[4], items[2]])
+            self.assertIs(task_queue.get_task_from_queue(), items[0])
+            task_queue.close()
+
+    def test_full(self):
+        task_queue = TaskQueue(2)
+        task_queue.put_task_to_queue(TaskQueueItem(1, self.__new_task("move-to")))
+        self.assertFalse(task_queue.full())
+        task_queue.put_task_to_queue(TaskQueueItem(1, self.__new_task("search-area")))
+        self.assertTrue(task_queue.full())
+
+        #The dispatcher puts back a task it took while the Queue was filled up again, without waiting for room
+        taken = task_queue.get_task_for(["move-to"])
+        task_queue.put_task_to_queue(TaskQueueItem(1, self.__new_task("move-to")))
+        task_queue.put_task_to_queue(taken, requeue=True)
+        self.assertEqual(len(task_queue), 3)
+
+    def test_waiting_tasks_age_and_a_put_back_task_keeps_its_place(self):
+        task_queue = TaskQueue(10, aging=60.0)
+        old = TaskQueueItem(3, self.__new_task("move-to"), queued_at=time.monotonic() - 150.0) #More than two priority levels
+        task_queue.put_task_to_queue(old)
+        new = TaskQueueItem(1, self.__new_task("move-to"))
+        task_queue.put_task_to_queue(new)
+        self.assertIs(task_queue.get_task_for(["move-to"]), old)
+
+        task_queue.put_task_to_queue(old, requeue=True) #Put back with its own age, not as a new task
+        self.assertIs(task_queue.get_task_for(["move-to"]), old)
+        self.assertIs(task_queue.get_task_for(["move-to"]), new)
+
+    def test_tasks_expire_at_their_deadline(self):
+        task_queue = TaskQueue(10)
+        first = TaskQueueItem(1, self.__new_task("move-to"), deadline=100.0)
+        second = TaskQueueItem(1, self.__new_task("move-to"), deadline=200.0)
+        third = TaskQueueItem(1, self.__new_task("search-area"))
+        for item in (first, second, third):
+            task_queue.put_task_to_queue(item)
+
+        self.assertEqual(task_queue.expire(now=50.0), [])
+        self.assertIs(task_queue.get_task_for(["move-to"]), first)
+        self.assertEqual(task_queue.expire(now=150.0), []) #Dispatched before its deadline
+        self.assertEqual(task_queue.expire(now=250.0), [second])
+        self.assertEqual(task_queue.task_names(), ["search-area"])
+        self.assertIsNone(task_queue.get_task_for(["move-to"]))
+        self.assertEqual(len(task_queue), 1)
+
+    def test_priority_and_deadline_of_a_start_task_message(self):
+        self.assertEqual(task_priority({"priority": "3"}), 3)
+        self.assertEqual(task_priority({}), 1)
+        self.assertEqual(task_priority({"priority": "high"}), 1)
+        self.assertIsNone(task_deadline({}))
+        self.assertEqual(task_deadline({"deadline": 1700000000}), 1700000000.0)
+        self.assertEqual(task_deadline({"deadline": "2023-11-14T22:13:20"}), 1700000000.0)
+        self.assertEqual(task_deadline({"deadline": "2023-11-14T23:13:20+01:00"}), 1700000000.0)
+
+    def test_tasks_over_the_memory_size_are_spilled_and_read_back_in_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            task_queue = TaskQueue(0, memory_size=2, spill_directory=directory)
+            items = [TaskQueueItem(priority, self.__new_task(name), deadline=deadline) for name, priority, deadline in
+                     (("move-to", 3, None), ("move-to", 2, None), ("move-to", 1, None), ("search-area", 1, 100.0), ("move-to", 2, None))]
+            tasks = [item.item for item in items]
+            for item in items:
+                task_queue.put_task_to_queue(item)
+            self.assertEqual((len(task_queue), task_queue.loaded), (5, 2))
+            self.assertEqual([item.item is None for item in items], [True, True, False, False, True]) #The worst are spilled
+
+            expired = task_queue.expire(now=200.0)
+            self.assertEqual(expired, [items[3]])
+            taken = [task_queue.get_task_for(["move-to"]) for _ in range(4)]
+            self.assertEqual(taken, [items[2], items[1], items[4], items[0]])
+            self.assertEqual([item.item.original_task for item in taken], [tasks[i].original_task for i in (2, 1, 4, 0)])
+            self.assertEqual((len(task_queue), task_queue.loaded, len(task_queue.spill_file)), (0, 0, 0))
+
+    def test_put_back_tasks_are_not_spilled_again_and_spill_files_are_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            open(os.path.join(directory, "tasks-old.spill"), "w").close() #Left by an earlier run
+            task_queue = TaskQueue(0, memory_size=5, spill_directory=directory)
+            self.assertEqual(os.listdir(directory), [])
+            for index in range(20):
+                task_queue.put_task_to_queue(TaskQueueItem(index % 3, self.__new_task("move-to")))
+            spill_size = len(task_queue.spill_file)
+            for _ in range(2000): #The dispatcher takes a task and puts it back
+                task_queue.put_task_to_queue(task_queue.get_task_for(["move-to"]), requeue=True)
+            self.assertEqual((len(task_queue), task_queue.loaded), (20, 5))
+            self.assertLessEqual(len(task_queue.spill_file), spill_size)
+
+            #Tasks keep coming and going while some stay spilled, the file is written again without the dead tasks
+            compact_bytes, task.SPILL_COMPACT_BYTES = task.SPILL_COMPACT_BYTES, 1000
+            try:
+                for index in range(500):
+                    task_queue.put_task_to_queue(TaskQueueItem(index % 3, self.__new_task("move-to")))
+                    task_queue.get_task_for(["move-to"])
+            finally:
+                task.SPILL_COMPACT_BYTES = compact_bytes
+            self.assertEqual(len(task_queue), 20)
+            self.assertLess(len(task_queue.spill_file), 2 * max(task_queue.spill_live, 1000))
+            self.assertEqual(len(os.listdir(directory)), 1)
+
+            task_queue.close()
+            self.assertEqual(os.listdir(directory), [])
+
+    @staticmethod
+    def __new_task(name: str) -> Task:
+        task = Task()
+        task.original_task = {"task": {"name": name, "params": {}}}
+        return task
+
+
+if __name__ == '__main__':
+    unittest.main()
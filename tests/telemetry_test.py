@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+from agent_manager import AgentManager
+from telemetry import TelemetryHistory, STAMP, LATITUDE, SPEED
+
+
+class TelemetryHistoryTests(unittest.TestCase):
+
+    def test_ring_buffer_keeps_latest_samples_as_views(self):
+        history = TelemetryHistory(capacity=4)
+        for i in range(10):
+            history.append(100.0 + i, 58.0 + i * 0.001, 16.0, 40.0, 5.0)
+
+        self.assertEqual(len(history), 4)
+        latest = history.latest()
+        np.testing.assert_array_equal(latest[:, STAMP], [106.0, 107.0, 108.0, 109.0])
+        self.assertTrue(np.shares_memory(latest, history.samples))
+
+        last_seconds = history.last_seconds(2.0)
+        np.testing.assert_array_equal(last_seconds[:, STAMP], [107.0, 108.0, 109.0])
+        self.assertTrue(np.shares_memory(last_seconds, history.samples))
+        self.assertEqual(history.samples.shape, (8, 5))
+
+    def test_downsample_and_velocity(self):
+        history = TelemetryHistory(capacity=16)
+        for i in range(10):
+            history.append(100.0 + i, 58.0 + i * 0.0001, 16.0, 40.0, 5.0)  # North, about 11 m/s
+
+        np.testing.assert_array_equal(history.downsample(4.0)[:, STAMP], [103.0, 107.0, 109.0])
+        speed, course = history.velocity(5.0)
+        self.assertAlmostEqual(speed, 11.1, delta=0.1)
+        self.assertAlmostEqual(course, 0.0, delta=0.01)
+        self.assertTrue(np.isnan(TelemetryHistory(4).velocity(5.0)[0]))
+
+    def test_agent_position_updates_feed_the_history(self):
+        agent_manager = AgentManager(history_size=8)
+        agent = agent_manager.create_new_agent({"name": "name1", "agent-uuid": "uuid1", "busy": False})
+        agent.update_attribute("speed", {"speed": 3.0})
+        agent.update_attribute("position", {"altitude": 40.0, "latitude": 57.86, "longitude": 16.78})
+        agent.update_attribute("position", "not a position")
+
+        self.assertEqual(len(agent.history), 1)
+        self.assertEqual(agent.history.latest()[-1, LATITUDE], 57.86)
+        self.assertEqual(agent.history.latest()[-1, SPEED], 3.0)
+        self.assertIsNone(AgentManager(history_size=0).create_new_agent({"name": "name2", "busy": False}).history)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from types import SimpleNamespace
+from topic_router import TopicRouter
+
+
+class TopicRouterTests(unittest.TestCase):
+
+    def test_wildcards_and_agent_routes(self):
+        router = TopicRouter()
+        calls: list = []
+        router.add("waraps/unit/+/+/name1/heartbeat", lambda c, u, m, name, attribute: calls.append(("wildcard", name, attribute)), "name1")
+        router.add("waraps/unit/air/real/name2/#", lambda c, u, m, name, attribute: calls.append(("agent", name, attribute)), "name2")
+        router.add("operator/exec/command", lambda c, u, m: calls.append(("command", m.topic)))
+
+        self.assertTrue(router.dispatch(None, None, SimpleNamespace(topic="waraps/unit/ground/sim/name1/heartbeat")))
+        self.assertTrue(router.dispatch(None, None, SimpleNamespace(topic="waraps/unit/air/real/name2/sensor/position")))
+        self.assertTrue(router.dispatch(None, None, SimpleNamespace(topic="operator/exec/command")))
+        self.assertFalse(router.dispatch(None, None, SimpleNamespace(topic="waraps/unit/air/real/name3/sensor/position")))
+        self.assertEqual(calls, [("wildcard", "name1", "heartbeat"), ("agent", "name2", "position"), ("command", "operator/exec/command")])
+
+    def test_remove_prunes_and_drops_cached_topics(self):
+        router = TopicRouter()
+        router.add("a/+/c", lambda c, u, m: None)
+        router.add("a/#", lambda c, u, m: None)
+        self.assertEqual(len(router.resolve("a/b/c")), 2)
+
+        router.remove("a/+/c")
+        self.assertEqual(len(router.resolve("a/b/c")), 1)
+        router.remove("a/#")
+        self.assertEqual(router.resolve("a/b/c"), ())
+        self.assertEqual(router.root.children, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
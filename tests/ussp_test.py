@@ -0,0 +1,60 @@
+import asyncio, json
+import unittest
+from paho.mqtt.client import Client as PahoClient
+from ussp import AsyncUSSP
+
+
+class FakeClient(PahoClient):
+    '''Keeps the published payloads instead of sending them'''
+    def __init__(self):
+        super().__init__()
+        self.published: list = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False, properties=None):
+        self.published.append(json.loads(payload))
+
+
+class AsyncUSSPTests(unittest.TestCase):
+
+    def test_replies_are_matched_on_task_uuid_and_otherwise_in_order(self):
+        async def run():
+            client = FakeClient()
+            ussp = AsyncUSSP(client, asyncio.get_running_loop(), timeout=1.0)
+            first = asyncio.ensure_future(ussp.get_plan("ussp/command", "plan-1"))
+            second = asyncio.ensure_future(ussp.get_plan("ussp/command", "plan-2"))
+            third = asyncio.ensure_future(ussp.get_plan("ussp/command", "plan-3"))
+            await asyncio.sleep(0)
+            uuids = [request["task-uuid"] for request in client.published]
+
+            ussp.reply_received({"reply": "get plan", "task-uuid": uuids[1], "plan": "second"})
+            ussp.reply_received({"reply": "get plan", "plan": "first"}) #No task-uuid, the oldest request gets it
+            ussp.reply_received({"reply": "get plan", "task-uuid": "unknown", "plan": "late"}) #Dropped
+            ussp.reply_received({"reply": "get plan", "task-uuid": uuids[2], "plan": "third"})
+            return [(await request)["plan"] for request in (first, second, third)]
+
+        self.assertEqual(asyncio.run(run()), ["first", "second", "third"])
+
+    def test_reply_with_an_unknown_task_uuid_is_ignored(self):
+        async def run():
+            client = FakeClient()
+            ussp = AsyncUSSP(client, asyncio.get_running_loop(), timeout=0.05)
+            request = asyncio.ensure_future(ussp.get_plan("ussp/command", "plan-1"))
+            await asyncio.sleep(0)
+            ussp.reply_received({"reply": "get plan", "task-uuid": "timed-out", "plan": "plan-0"})
+            with self.assertRaises(asyncio.TimeoutError):
+                await request
+
+        asyncio.run(run())
+
+    def test_request_times_out_without_reply(self):
+        async def run():
+            ussp = AsyncUSSP(FakeClient(), asyncio.get_running_loop(), timeout=0.01)
+            with self.assertRaises(asyncio.TimeoutError):
+                await ussp.request_height("ussp/command")
+            self.assertEqual(ussp.waiting, {"query ground height": []})
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
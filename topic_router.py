@@ -0,0 +1,126 @@
+from threading import Lock
+
+MAX_CACHED_TOPICS: int = 100000 #The cache of resolved topics is dropped when it grows past this
+
+
+class Route():
+    '''A handler for a topic filter, 'agent_name' is set for the topics of an agent and passed on to the handler'''
+    __slots__ = ("topic_filter", "handler", "agent_name")
+
+    def __init__(self, topic_filter: str, handler, agent_name: str = None) -> None:
+        self.topic_filter: str = topic_filter
+        self.handler = handler
+        self.agent_name: str = agent_name
+
+
+class ResolvedRoute():
+    '''A route resolved for one topic, with the attribute (last level of the topic) split out once'''
+    __slots__ = ("handler", "agent_name", "attribute")
+
+    def __init__(self, route: Route, topic: str) -> None:
+        self.handler = route.handler
+        self.agent_name: str = route.agent_name
+        self.attribute: str = topic[topic.rfind("/") + 1:]
+
+
+class TopicNode():
+    __slots__ = ("children", "routes")
+
+    def __init__(self) -> None:
+        self.children: dict = {} #topic level -> TopicNode, '+' and '#' are stored as levels
+        self.routes: list = []
+
+
+class TopicRouter():
+    '''
+    Routes MQTT messages to handlers through a trie of topic filters ('+' and '#' wildcards). \n
+    A topic is resolved once, the routes for it are cached so every later message on the same topic
+    is a single dict lookup. The cache is dropped when a route is added or removed
+    '''
+    def __init__(self) -> None:
+        self.root: TopicNode = TopicNode()
+        self.routes: dict = {} #topic filter -> Route
+        self.cache: dict = {} #topic -> tuple of ResolvedRoute
+        self.lock: Lock = Lock() #Routes are added and removed from the ingest workers
+
+    def __len__(self) -> int:
+        return len(self.routes)
+
+    def __contains__(self, topic_filter: str) -> bool:
+        return topic_filter in self.routes
+
+    def add(self, topic_filter: str, handler, agent_name: str = None) -> None:
+        """Adds a route, replaces the route of the same topic filter"""
+        with self.lock:
+            self.__remove(topic_filter)
+            route = Route(topic_filter, handler, agent_name)
+            node = self.root
+            for level in topic_filter.split("/"):
+                node = node.children.setdefault(level, TopicNode())
+            node.routes.append(route)
+            self.routes[topic_filter] = route
+            self.cache = {}
+
+    def remove(self, topic_filter: str) -> None:
+        with self.lock:
+            self.__remove(topic_filter)
+
+    def __remove(self, topic_filter: str) -> None:
+        route = self.routes.pop(topic_filter, None)
+        if route is None:
+            return
+
+        path = [self.root]
+        levels = topic_filter.split("/")
+        for level in levels:
+            path.append(path[-1].children[level])
+        path[-1].routes.remove(route)
+        #Prune the nodes that no longer lead to a route
+        for i in range(len(levels), 0, -1):
+            node = path[i]
+            if node.routes or node.children:
+                break
+            del path[i - 1].children[levels[i - 1]]
+        self.cache = {}
+
+    def resolve(self, topic: str) -> tuple:
+        """Returns the routes matching the topic"""
+        resolved = self.cache.get(topic)
+        if resolved is None:
+            routes: list = []
+            self.__match(self.root, topic.split("/"), 0, routes)
+            resolved = tuple(ResolvedRoute(route, topic) for route in routes)
+            if len(self.cache) >= MAX_CACHED_TOPICS:
+                self.cache = {}
+            self.cache[topic] = resolved
+        return resolved
+
+    def __match(self, node: TopicNode, levels: list, i: int, routes: list) -> None:
+        multi_level = node.children.get("#")
+        if multi_level is not None: #Also matches the parent level, 'a/#' matches 'a'
+            routes.extend(multi_level.routes)
+        if i == len(levels):
+            routes.extend(node.routes)
+            return
+
+        child = node.children.get(levels[i])
+        if child is not None:
+            self.__match(child, levels, i + 1, routes)
+        single_level = node.children.get("+")
+        if single_level is not None:
+            self.__match(single_level, levels, i + 1, routes)
+
+    def dispatch(self, client, userdata, msg) -> bool:
+        """Calls the handlers of the routes matching the message topic (paho 'on_message'), False if there are none"""
+        resolved = self.resolve(msg.topic)
+        self.call(resolved, client, userdata, msg)
+        return bool(resolved)
+
+    @staticmethod
+    def call(resolved: tuple, client, userdata, msg) -> None:
+        """Calls the handlers of routes returned by 'resolve'"""
+        for route in resolved:
+            if route.agent_name is None:
+                route.handler(client, userdata, msg)
+            else:
+                route.handler(client, userdata, msg, route.agent_name, route.attribute)
@@ -3,50 +3,56 @@ import json
 from datetime import datetime, timedelta
 from paho.mqtt.client import Client as PahoClient
 from data.config import USSPConfig
-import uuid
+import asyncio, uuid
 from threading import Event
 from data.config import OperatorConfig
+import codec
+
+
+def request_payload(name: str, params: dict, task_uuid: str = None) -> bytes:
+    """Encoded USSP request, with a new 'task-uuid' if none is given"""
+    return codec.dumps({
+        "com-uuid": OperatorConfig.OPERATOR_ID,
+        "command": "start-task",
+        "execution-unit": "USSP",
+        "sender": OperatorConfig.OPERATOR_NAME,
+        "task": {
+            "name": name,
+            "meta": {},
+            "params": params
+        },
+        "task-uuid": task_uuid or str(uuid.uuid4())
+    })
+
+
+def request_plan_params(waypoints: list, payload_data: dict, speed: float) -> dict:
+    return {
+        "request": "request plan",
+        "operator ID": payload_data["operator ID"],
+        "UAS ID": payload_data["UAS ID"],
+        "EPSG": payload_data["EPSG"],
+        "plan": [{"type": "2D path", "position": [wp[0], wp[1]]} for wp in waypoints],
+        "when": str(datetime.utcnow() + timedelta(seconds=90)), #90 secounds in the future
+        "preferred speed": speed,
+        "preferred rate of ascend": 10,
+        "preferred rate of descend": 10
+    }
+
 
 class USSP():
     
     @classmethod
     def create_connection(self, client: PahoClient, topic:str, name: str):
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "start-communication",
-                "meta": {},
-                "params": {
-                    "name": name
-                }
-            },
-            "task-uuid": str(uuid.uuid4())
-        }
-        client.publish(topic, json.dumps(payload))
+        payload = request_payload("start-communication", {"name": name})
+        client.publish(topic, payload)
 
 
     @classmethod
     def request_height(self, client: PahoClient, topic: str, event: Event):
 
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "request-height",
-                "meta": {},
-                "params": {
-                    "request": "query ground height"
-                }
-            },
-            "task-uuid": str(uuid.uuid4())
-        }
+        payload = request_payload("request-height", {"request": "query ground height"})
 
-        client.publish(topic, json.dumps(payload))
+        client.publish(topic, payload)
         print(f"Sent 'query ground height' request. Awaiting response.....")
         event.wait()
         event.clear()
@@ -55,39 +61,9 @@ class USSP():
     @classmethod
     def request_plan(self, client: PahoClient, topic: str, event: Event, waypoints: list, payload_data: dict, speed: float = 100.0 ) -> json:
 
-        nodes: list = []
-        for wp in waypoints:
-            node = {
-            "type": "2D path",
-            "position": [ wp[0], wp[1] ]
-            }
-            nodes.append(node)
+        payload = request_payload("request-plan", request_plan_params(waypoints, payload_data, speed))
 
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "request-plan",
-                "meta": {
-                },
-                "params": {
-                    "request": "request plan",
-                    "operator ID": payload_data["operator ID"],
-                    "UAS ID": payload_data["UAS ID"],
-                    "EPSG": payload_data["EPSG"],
-                    "plan": nodes,
-                    "when": str(datetime.utcnow() + timedelta(seconds=90)), #90 secounds in the future
-                    "preferred speed": speed,
-                    "preferred rate of ascend": 10,
-                    "preferred rate of descend": 10
-                }
-            },
-            "task-uuid": str(uuid.uuid4())
-        }
-
-        client.publish(topic, json.dumps(payload))
+        client.publish(topic, payload)
         print("Sent 'request plan' request. Awaiting response.....")
         event.wait()
         event.clear()
@@ -96,24 +72,9 @@ class USSP():
     @classmethod
     def get_plan(self, client: PahoClient, topic: str, event: Event, plan_id: str):
 
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "get-plan",
-                "meta": {
-                },
-                "params": {
-                    "request": "get plan",
-                    "plan ID": plan_id
-                }
-            },
-            "task-uuid": str(uuid.uuid4())
-        }
+        payload = request_payload("get-plan", {"request": "get plan", "plan ID": plan_id})
 
-        client.publish(topic, json.dumps(payload))
+        client.publish(topic, payload)
         print("Sent 'Get plan' request. Awaiting response.....")
         event.wait()
         event.clear()
@@ -121,24 +82,9 @@ class USSP():
 
     @classmethod
     def accept_plan(self, client: PahoClient, topic: str, event: Event, plan_id: str) -> None:
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "accept-plan",
-                "meta": {
-                },
-                "params": {
-                    "request": "accept plan",
-                    "plan ID": plan_id
-                }
-            },
-            "task-uuid": str(uuid.uuid4())
-        }
+        payload = request_payload("accept-plan", {"request": "accept plan", "plan ID": plan_id})
 
-        client.publish(topic, json.dumps(payload))
+        client.publish(topic, payload)
         print("Sent 'Accept Plan' request. Awaiting response.....")
         event.wait()
         event.clear()
@@ -146,49 +92,18 @@ class USSP():
     @classmethod
     def activate_plan(self, client: PahoClient, topic: str, event: Event, plan_id: str) -> None:
 
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "activate-plan",
-                "meta": {
-                },
-                "params": {
-                    "request": "activate plan",
-                    "plan ID": plan_id
-                    #"withdraw plan": 50.0,
-                }
-            },
-            "task-uuid": str(uuid.uuid4())
-        }
+        payload = request_payload("activate-plan", {"request": "activate plan", "plan ID": plan_id})
 
-        client.publish(topic, json.dumps(payload))
+        client.publish(topic, payload)
         print("Sent 'Activate Plan' request. Awaiting response.....")
         event.wait()
         event.clear()
 
     @classmethod
     def end_plan(self, client: PahoClient, topic: str, event: Event, plan_id: str) -> None:
-        payload = {
-            "com-uuid": OperatorConfig.OPERATOR_ID,
-            "command": "start-task",
-            "execution-unit": "USSP",
-            "sender": OperatorConfig.OPERATOR_NAME,
-            "task": {
-                "name": "end-plan",
-                "meta": {
-                },
-                "params": {
-                    "request": "end plan",
-                    "plan ID": plan_id
-                }
-            },
-            "task-uuid": str(uuid.uuid4()) 
-        }
+        payload = request_payload("end-plan", {"request": "end plan", "plan ID": plan_id})
 
-        client.publish(topic, json.dumps(payload))
+        client.publish(topic, payload)
 
         print("Sent 'End Plan' request. Awaiting response.....")
         #client.loop_write()
@@ -225,6 +140,66 @@ class USSP():
         self.service_socket.send_string(json.dumps(payload))
         recv_msg = self.service_socket.recv_string()
         json_msg = json.loads(recv_msg)
-        print(f"'Cancel Plan' response from server: \n {json_msg}") 
-
-
+        print(f"'Cancel Plan' response from server: \n {json_msg}")
+
+
+class AsyncUSSP():
+    '''
+    USSP requests for the asyncio runtime, every request awaits its own reply so many handshakes can be in flight at once. \n
+    Replies are matched on their 'task-uuid' when the USSP sends it back, a reply with an unknown 'task-uuid' is dropped.
+    A reply without one goes to the oldest request waiting for that kind of reply
+    '''
+    def __init__(self, client: PahoClient, loop: asyncio.AbstractEventLoop, timeout: float = USSPConfig.USSP_TIMEOUT) -> None:
+        self.client: PahoClient = client
+        self.loop: asyncio.AbstractEventLoop = loop
+        self.timeout: float = timeout
+        self.waiting: dict[str, list] = {} #reply -> [(task-uuid, future)] in the order they were sent
+
+    def reply_received(self, message: dict) -> None:
+        """Called with every USSP reply, from any thread"""
+        self.loop.call_soon_threadsafe(self.__resolve, message)
+
+    def __resolve(self, message: dict) -> None:
+        waiting = self.waiting.get(message.get("reply"))
+        if not waiting:
+            return
+        task_uuid = message.get("task-uuid")
+        if task_uuid is None:
+            index = 0
+        else:
+            index = next((i for i, (uuid_, _) in enumerate(waiting) if uuid_ == task_uuid), None)
+            if index is None: #A late reply to a request that has timed out
+                return
+        _, future = waiting.pop(index)
+        if not future.done():
+            future.set_result(message)
+
+    async def request(self, topic: str, name: str, params: dict) -> dict:
+        """Sends a request and returns the reply, raises asyncio.TimeoutError if there is none within 'timeout'"""
+        task_uuid = str(uuid.uuid4())
+        reply = params["request"]
+        future = self.loop.create_future()
+        entry = (task_uuid, future)
+        self.waiting.setdefault(reply, []).append(entry)
+        self.client.publish(topic, request_payload(name, params, task_uuid))
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            waiting = self.waiting.get(reply, [])
+            if entry in waiting:
+                waiting.remove(entry)
+
+    async def request_height(self, topic: str) -> dict:
+        return await self.request(topic, "request-height", {"request": "query ground height"})
+
+    async def request_plan(self, topic: str, waypoints: list, payload_data: dict, speed: float = 100.0) -> dict:
+        return await self.request(topic, "request-plan", request_plan_params(waypoints, payload_data, speed))
+
+    async def get_plan(self, topic: str, plan_id: str) -> dict:
+        return await self.request(topic, "get-plan", {"request": "get plan", "plan ID": plan_id})
+
+    async def accept_plan(self, topic: str, plan_id: str) -> dict:
+        return await self.request(topic, "accept-plan", {"request": "accept plan", "plan ID": plan_id})
+
+    async def activate_plan(self, topic: str, plan_id: str) -> dict:
+        return await self.request(topic, "activate-plan", {"request": "activate plan", "plan ID": plan_id})